@@ -0,0 +1,237 @@
+import numpy as np
+
+# Doses taken within this many minutes of the reminder count as on time
+ON_TIME_MINUTES = 15
+
+# Lateness histogram buckets as (label, first minute of the bucket)
+LATENESS_BUCKETS = (
+    ('early', None),
+    ('on_time', -ON_TIME_MINUTES),
+    ('up_to_1h_late', ON_TIME_MINUTES + 1),
+    ('up_to_3h_late', 61),
+    ('over_3h_late', 181),
+)
+
+EVENT_DTYPE = [('medication_id', 'i8'), ('taken_at', 'M8[m]'), ('scheduled_for', 'M8[m]')]
+
+
+def _group_percentiles(groups, values, size, quantiles):
+    # Nearest-rank percentiles. Group and value are packed into one integer
+    # so a single sort orders the values within each group.
+    counts = np.bincount(groups, minlength=size)
+    starts = np.cumsum(counts) - counts
+    if len(values):
+        low = values.min()
+        width = values.max() - low + 1
+        ordered = np.sort(groups * width + (values - low)) % width + low
+    result = []
+    for quantile in quantiles:
+        index = starts + np.maximum(np.ceil(quantile * counts).astype(np.int64) - 1, 0)
+        picked = ordered[np.minimum(index, len(values) - 1)] if len(values) else np.zeros(size)
+        result.append(np.where(counts > 0, picked, np.nan))
+    return result
+
+
+def _streaks(groups, taken, size):
+    """
+    Return the longest and the current run of consecutive taken doses of
+    each group, given doses ordered by group and then time
+    """
+    new_group = np.ones(len(groups), dtype=bool)
+    new_group[1:] = groups[1:] != groups[:-1]
+    run_starts = taken.copy()
+    run_starts[1:] &= ~taken[:-1] | new_group[1:]
+    run_ids = np.cumsum(run_starts) - 1
+    lengths = np.bincount(run_ids[taken], minlength=int(run_starts.sum()))
+
+    longest = np.zeros(size, dtype=np.int64)
+    np.maximum.at(longest, groups[run_starts], lengths)
+    current = np.zeros(size, dtype=np.int64)
+    last_taken = np.append(new_group[1:], True) & taken
+    current[groups[last_taken]] = lengths[run_ids[last_taken]]
+    return longest, current
+
+
+class AdherenceResult:
+    def __init__(self, analyzer, dose_medications, taken, lateness):
+        """
+        Scheduled doses of an AdherenceAnalyzer window, whether each was
+        taken and how many minutes late (negative when early)
+        """
+        self.analyzer = analyzer
+        self.dose_medications = dose_medications
+        self.taken = taken
+        self.lateness = lateness
+
+    def _summarize(self, medication_groups, size):
+        dose_groups = medication_groups[self.dose_medications]
+        scheduled = np.bincount(dose_groups, minlength=size)
+        taken = np.bincount(dose_groups[self.taken], minlength=size)
+        lateness = self.lateness[self.taken]
+        lateness_groups = dose_groups[self.taken]
+        on_time = np.bincount(lateness_groups[np.abs(lateness) <= ON_TIME_MINUTES], minlength=size)
+        median, p90 = _group_percentiles(lateness_groups, lateness, size, (0.5, 0.9))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rate = np.where(scheduled > 0, taken / scheduled, np.nan)
+            on_time_rate = np.where(taken > 0, on_time / taken, np.nan)
+        return {
+            'scheduled': scheduled,
+            'taken': taken,
+            'rate': rate,
+            'on_time_rate': on_time_rate,
+            'median_lateness': median,
+            'p90_lateness': p90,
+        }
+
+    @staticmethod
+    def _rows(columns):
+        # NaN (no doses) is returned as None so the rows are valid JSON
+        names = list(columns)
+        values = [columns[name].tolist() for name in names]
+        return [
+            {name: None if value != value else value for name, value in zip(names, row)}
+            for row in zip(*values)
+        ]
+
+    def by_medication(self):
+        """
+        Return a dict per medication with its scheduled and taken doses,
+        adherence and on-time rates, lateness percentiles and streaks
+        """
+        analyzer = self.analyzer
+        size = len(analyzer.medication_ids)
+        columns = {'medication_id': analyzer.medication_ids, 'user_id': analyzer.user_ids}
+        if analyzer.names is not None:
+            columns['name'] = analyzer.names
+        columns.update(self._summarize(np.arange(size), size))
+        columns['longest_streak'], columns['current_streak'] = _streaks(
+            self.dose_medications, self.taken, size)
+        return self._rows(columns)
+
+    def by_user(self):
+        """
+        Return the by_medication figures combined per user; the streaks
+        are those of the user's best medication
+        """
+        users, medication_users = np.unique(self.analyzer.user_ids, return_inverse=True)
+        columns = {'user_id': users}
+        columns.update(self._summarize(medication_users, len(users)))
+        longest, current = _streaks(self.dose_medications, self.taken, len(self.analyzer.medication_ids))
+        for name, streaks in (('longest_streak', longest), ('current_streak', current)):
+            columns[name] = np.zeros(len(users), dtype=np.int64)
+            np.maximum.at(columns[name], medication_users, streaks)
+        return self._rows(columns)
+
+    def cohort(self, counts=True):
+        """
+        Return the figures of every dose in the window together, with a
+        histogram of lateness and, with `counts`, the number of users and
+        medications
+        """
+        size = len(self.analyzer.medication_ids)
+        summary = self._rows(self._summarize(np.zeros(size, dtype=np.int64), 1))[0]
+        edges = [low for label, low in LATENESS_BUCKETS[1:]]
+        buckets = np.bincount(np.searchsorted(edges, self.lateness[self.taken], side='right'),
+                              minlength=len(LATENESS_BUCKETS))
+        if counts:
+            summary['users'] = len(np.unique(self.analyzer.user_ids))
+            summary['medications'] = size
+        summary['lateness'] = {label: count for (label, low), count in zip(LATENESS_BUCKETS, buckets.tolist())}
+        return summary
+
+
+class AdherenceAnalyzer:
+    """
+    Adherence of medications taken once a day at their reminder time.
+
+    Each dose from the start to the end date of a medication is scheduled
+    at its reminder time, and counts as taken if a DoseEvent was recorded
+    for that occurrence. All work is done on NumPy arrays, so a window of
+    millions of doses is computed without a Python loop per dose.
+    """
+
+    def __init__(self, medication_ids, user_ids, reminder_minutes, start_dates, end_dates, names=None):
+        """
+        Arrays aligned per medication: reminder_minutes is the minute of
+        the day of the reminder, start_dates and end_dates are naive local
+        datetimes, None for open ends
+        """
+        order = np.argsort(np.asarray(medication_ids, dtype=np.int64), kind='stable')
+        self.medication_ids = np.asarray(medication_ids, dtype=np.int64)[order]
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)[order]
+        self.reminders = np.asarray(reminder_minutes, dtype='m8[m]')[order]
+        self.start_dates = np.asarray(start_dates, dtype='M8[m]')[order]
+        self.end_dates = np.asarray(end_dates, dtype='M8[m]')[order]
+        self.names = np.asarray(names, dtype=object)[order] if names is not None else None
+
+    def _days(self, window_start, window_end):
+        # First day and number of days of each medication whose reminder
+        # falls within the window and its start and end dates
+        low = np.maximum(self.start_dates, window_start)
+        low[np.isnat(self.start_dates)] = window_start
+        high = np.minimum(self.end_dates, window_end)
+        high[np.isnat(self.end_dates)] = window_end
+
+        first_day = (low - self.reminders).astype('M8[D]')
+        first_day += (first_day + self.reminders < low).astype(np.int64).astype('m8[D]')
+        last_day = (high - self.reminders).astype('M8[D]')
+        counts = np.maximum((last_day - first_day).astype(np.int64) + 1, 0)
+        return first_day, counts
+
+    def schedule(self, window_start, window_end):
+        """
+        Return (medication index, scheduled time) arrays of every dose
+        within the window, ordered by medication and then time
+        """
+        first_day, counts = self._days(np.datetime64(window_start, 'm'), np.datetime64(window_end, 'm'))
+        # Expand each medication into its run of days
+        dose_medications = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        scheduled = (np.repeat(first_day, counts) + offsets.astype('m8[D]')
+                     + np.repeat(self.reminders, counts))
+        return dose_medications, scheduled.astype('M8[m]')
+
+    def analyze(self, event_medication_ids, taken_at, scheduled_for, window_start, window_end):
+        """
+        Match dose events, as arrays of medication id, taken time and
+        scheduled occurrence, against the doses scheduled within
+        [window_start, window_end] and return an AdherenceResult
+        """
+        window_start = np.datetime64(window_start, 'm')
+        window_end = np.datetime64(window_end, 'm')
+        first_day, counts = self._days(window_start, window_end)
+        dose_medications, scheduled = self.schedule(window_start, window_end)
+        dose_starts = np.cumsum(counts) - counts
+
+        event_medication_ids = np.asarray(event_medication_ids, dtype=np.int64)
+        taken_at = np.asarray(taken_at, dtype='M8[m]')
+        scheduled_for = np.asarray(scheduled_for, dtype='M8[m]')
+        if not len(self.medication_ids):
+            event_medication_ids = event_medication_ids[:0]
+        medications = np.searchsorted(self.medication_ids, event_medication_ids)
+        medications = np.minimum(medications, max(len(self.medication_ids) - 1, 0))
+
+        # Doses are laid out day by day per medication, so the position of
+        # an occurrence follows from its day without searching
+        since = (scheduled_for - first_day[medications] - self.reminders[medications]).astype(np.int64)
+        days, remainder = np.divmod(since, 24 * 60)
+        matched = ((self.medication_ids[medications] == event_medication_ids) & ~np.isnat(scheduled_for)
+                   & (remainder == 0) & (days >= 0) & (days < counts[medications]))
+        positions = dose_starts[medications[matched]] + days[matched]
+
+        # Only the first event of an occurrence counts
+        never = np.iinfo(np.int64).max
+        first_taken = np.full(len(scheduled), never, dtype=np.int64)
+        np.minimum.at(first_taken, positions, taken_at[matched].astype(np.int64))
+        taken = first_taken != never
+        lateness = np.where(taken, first_taken - scheduled.astype(np.int64), 0)
+        return AdherenceResult(self, dose_medications, taken, lateness)
+
+    def analyze_rows(self, rows, window_start, window_end):
+        """
+        analyze() over an iterable of (medication_id, taken_at,
+        scheduled_for) rows, such as a database cursor
+        """
+        events = np.fromiter(rows, dtype=EVENT_DTYPE)
+        return self.analyze(events['medication_id'], events['taken_at'], events['scheduled_for'],
+                            window_start, window_end)
@@ -1,22 +1,36 @@
+import json
+import multiprocessing
 import os
-from datetime import datetime
+import signal
+import sys
+import time
+from datetime import datetime, timedelta, timezone
 
 from dotenv import load_dotenv
-from flask import (Flask, flash, jsonify, redirect, render_template, request,
-                   send_from_directory, url_for)
+from flask import (Flask, Response, flash, jsonify, redirect, render_template,
+                   request, send_from_directory, stream_with_context, url_for)
 from flask_login import (LoginManager, UserMixin, current_user, login_required,
                          login_user, logout_user)
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from twilio.rest import Client
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 
+from adherence import AdherenceAnalyzer
+from ocr_jobs import OCRJobQueue, available_cores
+from report_cache import ReportCache
+from report_generator import iter_csv, iter_jsonl
+from sms_queue import SMSQueue, TwilioTransport
+
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///medtrackr.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///medtrackr.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads/prescriptions'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
@@ -29,6 +43,23 @@ TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 # Initialize Twilio client
 twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN) if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN else None
 
+# Outbound SMS are queued and delivered by background workers, so request
+# handlers never wait on Twilio. The rate limit is shared by every process
+# using the same queue database.
+sms_queue = SMSQueue(
+    os.getenv('SMS_QUEUE_PATH', 'sms_queue.db'),
+    TwilioTransport(twilio_client),
+    workers=int(os.getenv('SMS_QUEUE_WORKERS', 4)),
+    rate=float(os.getenv('TWILIO_MESSAGES_PER_SECOND', 1)),
+    retention=int(os.getenv('SMS_QUEUE_RETENTION', 7 * 24 * 3600))
+) if twilio_client else None
+
+# Rendered PDF reports, reused until the user's data changes
+report_cache = ReportCache(
+    os.getenv('REPORT_CACHE_DIR', os.path.join('reports', 'cache')),
+    max_bytes=int(os.getenv('REPORT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+)
+
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
 
@@ -50,6 +81,16 @@ class User(UserMixin, db.Model):
     phone_number = db.Column(db.String(20))  # Add phone number field
     prescriptions = db.relationship('Prescription', backref='user', lazy=True)
     medications = db.relationship('Medication', backref='user', lazy=True)
+    device_tokens = db.relationship('DeviceToken', backref='user', lazy=True)
+
+class DeviceToken(db.Model):
+    """
+    Firebase Cloud Messaging registration token of one of a user's devices
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    token = db.Column(db.String(255), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Prescription(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -58,6 +99,11 @@ class Prescription(db.Model):
     date_prescribed = db.Column(db.DateTime, default=datetime.utcnow)
     image_path = db.Column(db.String(200))
     notes = db.Column(db.Text)
+    ocr_status = db.Column(db.String(20))  # pending, done or failed
+    ocr_text = db.Column(db.Text)
+    ocr_data = db.Column(db.Text)  # JSON of the extracted fields
+    ocr_error = db.Column(db.Text)
+    ocr_queued_at = db.Column(db.DateTime)  # UTC time the OCR job was submitted
 
 class Medication(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -69,6 +115,275 @@ class Medication(db.Model):
     end_date = db.Column(db.DateTime)
     reminder_time = db.Column(db.Time)
     last_taken = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # UTC time of the dose currently pending, kept in step with reminder_time
+    next_due_at = db.Column(db.DateTime, index=True)
+
+    # Dose events and tombstones outlive the row, so its id is never reused
+    __table_args__ = (
+        db.Index('ix_medication_user_next_due_at', 'user_id', 'next_due_at'),
+        {'sqlite_autoincrement': True},
+    )
+
+class DoseEvent(db.Model):
+    """
+    One dose marked as taken. Rows are only ever appended, so the history
+    outlives later doses and deleted medications.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    medication_id = db.Column(db.Integer, nullable=False)
+    taken_at = db.Column(db.DateTime, nullable=False)
+    # Local reminder occurrence closest to taken_at, if the medication has one
+    scheduled_for = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_dose_event_user_taken_at', 'user_id', 'taken_at'),
+        db.Index('ix_dose_event_medication_taken_at', 'medication_id', 'taken_at'),
+    )
+
+class MedicationTombstone(db.Model):
+    """
+    Record of a deleted medication, so reminder sync can drop its schedule
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    medication_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Sync watermarks are tombstone ids, so purged ids must not come back
+    __table_args__ = ({'sqlite_autoincrement': True},)
+
+class NotificationLedger(db.Model):
+    """
+    One row per notified dose occurrence and channel. The unique key makes
+    claiming an occurrence atomic across web workers and scheduler processes.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    medication_id = db.Column(db.Integer, nullable=False)
+    scheduled_for = db.Column(db.DateTime, nullable=False)
+    channel = db.Column(db.String(20), nullable=False)
+    notified_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('medication_id', 'scheduled_for', 'channel', name='uq_notification_occurrence'),
+    )
+
+def claim_notification(medication_id, scheduled_for, channel):
+    """
+    Record that a dose occurrence is being notified on a channel. Returns
+    False if another request or process already claimed it.
+    """
+    try:
+        db.session.add(NotificationLedger(
+            medication_id=medication_id,
+            scheduled_for=scheduled_for,
+            channel=channel
+        ))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+# Ledger rows claimed per INSERT, within SQLite's bound parameter limit
+CLAIM_BATCH_ROWS = 500
+
+def claim_notifications(occurrences, channel):
+    """
+    Claim many (medication_id, scheduled_for) occurrences on a channel at
+    once and return the set of those this call claimed. Each chunk is one
+    INSERT that skips occurrences already in the ledger and returns the
+    rows it inserted.
+    """
+    occurrences = list(occurrences)
+    insert = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}.get(db.engine.dialect.name)
+    if insert is None:
+        return {occurrence for occurrence in occurrences if claim_notification(*occurrence, channel)}
+
+    claimed = set()
+    now = datetime.utcnow()
+    for start in range(0, len(occurrences), CLAIM_BATCH_ROWS):
+        statement = insert(NotificationLedger).values([
+            {'medication_id': medication_id, 'scheduled_for': scheduled_for,
+             'channel': channel, 'notified_at': now}
+            for medication_id, scheduled_for in occurrences[start:start + CLAIM_BATCH_ROWS]
+        ]).on_conflict_do_nothing().returning(NotificationLedger.medication_id, NotificationLedger.scheduled_for)
+        claimed.update(tuple(row) for row in db.session.execute(statement))
+    db.session.commit()
+    return claimed
+
+# Reminders are due within this many minutes either side of reminder_time
+REMINDER_WINDOW = timedelta(minutes=1)
+
+def to_utc(local_datetime):
+    """
+    Convert a naive local datetime to a naive UTC datetime
+    """
+    return local_datetime.astimezone(timezone.utc).replace(tzinfo=None)
+
+def compute_next_due_at(reminder_time, after=None):
+    """
+    Return the first occurrence of the local reminder_time at or after the
+    local datetime `after`, as naive UTC
+    """
+    if reminder_time is None:
+        return None
+    after = after or datetime.now()
+    due = datetime.combine(after.date(), reminder_time)
+    if due < after:
+        due += timedelta(days=1)
+    return to_utc(due)
+
+def nearest_occurrence(reminder_time, at):
+    """
+    Return the local occurrence of reminder_time closest to the local
+    datetime `at`
+    """
+    if reminder_time is None:
+        return None
+    today = datetime.combine(at.date(), reminder_time)
+    candidates = [today - timedelta(days=1), today, today + timedelta(days=1)]
+    return min(candidates, key=lambda occurrence: abs(occurrence - at))
+
+def dose_history(user_id, start=None, end=None, medication_id=None, newest_first=False):
+    """
+    Return a query of a user's doses taken within [start, end] as rows of
+    (taken_at, scheduled_for, medication_id, name) in taken_at order. The
+    range is read from the (user_id, taken_at) or (medication_id, taken_at)
+    index; name is None for deleted medications.
+    """
+    query = db.session.query(
+        DoseEvent.taken_at, DoseEvent.scheduled_for, DoseEvent.medication_id, Medication.name
+    ).outerjoin(Medication, db.and_(
+        Medication.id == DoseEvent.medication_id, Medication.user_id == DoseEvent.user_id
+    )).filter(DoseEvent.user_id == user_id)
+    if medication_id is not None:
+        query = query.filter(DoseEvent.medication_id == medication_id)
+    if start is not None:
+        query = query.filter(DoseEvent.taken_at >= start)
+    if end is not None:
+        query = query.filter(DoseEvent.taken_at <= end)
+    return query.order_by(DoseEvent.taken_at.desc() if newest_first else DoseEvent.taken_at)
+
+# Rows of exports and analytics fetched from the database cursor at a time
+EXPORT_BATCH_ROWS = 1000
+
+def load_adherence(start, end, user_ids=None):
+    """
+    Return the AdherenceResult of the medications with a reminder of the
+    given users, or of every user, for doses scheduled within [start, end]
+    """
+    # Doses that are not due yet are not missed
+    end = min(end, datetime.now())
+    medications = db.session.query(
+        Medication.id, Medication.user_id, Medication.name, Medication.reminder_time,
+        Medication.start_date, Medication.end_date
+    ).filter(Medication.reminder_time.isnot(None))
+    # Events are logged against the occurrence closest to when they were
+    # taken, which is always within a day of it
+    events = db.session.query(
+        DoseEvent.medication_id, DoseEvent.taken_at, DoseEvent.scheduled_for
+    ).filter(
+        DoseEvent.taken_at >= start - timedelta(days=1),
+        DoseEvent.taken_at <= end + timedelta(days=1),
+        DoseEvent.scheduled_for.isnot(None)
+    )
+    if user_ids is not None:
+        medications = medications.filter(Medication.user_id.in_(user_ids))
+        events = events.filter(DoseEvent.user_id.in_(user_ids))
+    
+    rows = medications.all()
+    analyzer = AdherenceAnalyzer(
+        [row.id for row in rows],
+        [row.user_id for row in rows],
+        [row.reminder_time.hour * 60 + row.reminder_time.minute for row in rows],
+        [row.start_date for row in rows],
+        [row.end_date for row in rows],
+        names=[row.name for row in rows]
+    )
+    cursor = db.session.execute(events.statement.execution_options(yield_per=EXPORT_BATCH_ROWS))
+    return analyzer.analyze_rows((tuple(row) for row in cursor), start, end)
+
+def invalidate_reports(user_id):
+    """
+    Drop a user's cached reports after their data changed
+    """
+    try:
+        report_cache.invalidate(user_id)
+    except Exception as e:
+        print(f"Error invalidating reports of user {user_id}: {str(e)}")
+
+def store_ocr_result(prescription_id, result):
+    """
+    Save the result of an OCR job on its prescription
+    """
+    with app.app_context():
+        prescription = db.session.get(Prescription, prescription_id)
+        if not prescription:
+            return
+        if result['success']:
+            prescription.ocr_status = 'done'
+            prescription.ocr_text = result['text']
+            prescription.ocr_data = json.dumps(result['extracted_data'])
+        else:
+            prescription.ocr_status = 'failed'
+            prescription.ocr_error = result['error']
+        db.session.commit()
+        invalidate_reports(prescription.user_id)
+
+# OCR runs on a process pool off the request path. Every web worker has its
+# own pool, so the cores are shared out between them (WEB_CONCURRENCY, as
+# in gunicorn.conf.py), and the pool processes are started fresh rather
+# than forked from a gevent-patched worker.
+ocr_jobs = OCRJobQueue(
+    store_ocr_result,
+    max_workers=int(os.getenv('OCR_WORKERS', 0))
+    or max(1, available_cores() // int(os.getenv('WEB_CONCURRENCY', 1))),
+    start_method=os.getenv('OCR_START_METHOD', 'forkserver'
+                           if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'),
+    logger=app.logger
+)
+
+# Pending OCR jobs queued longer ago than this were lost, e.g. to a restart
+OCR_STALE_AFTER = timedelta(minutes=int(os.getenv('OCR_STALE_MINUTES', 10)))
+
+def requeue_stale_ocr_jobs(now=None):
+    """
+    Resubmit prescriptions left pending by a restart, as OCR jobs only live
+    in memory; those whose file is gone are marked failed. Each row is
+    claimed with a conditional update, so when every web worker runs this at
+    startup a job is still submitted once. Returns the number resubmitted.
+    """
+    now = now or datetime.utcnow()
+    stale = db.and_(
+        Prescription.ocr_status == 'pending',
+        db.or_(Prescription.ocr_queued_at.is_(None), Prescription.ocr_queued_at < now - OCR_STALE_AFTER)
+    )
+    requeued = 0
+    for prescription_id, image_path in db.session.query(Prescription.id, Prescription.image_path).filter(stale).all():
+        claimed = Prescription.query.filter(Prescription.id == prescription_id, stale).update(
+            {'ocr_queued_at': now}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            continue
+        
+        error = None
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], image_path or '')
+        if not image_path or not os.path.exists(file_path):
+            error = 'Uploaded file is missing'
+        else:
+            try:
+                ocr_jobs.submit(prescription_id, file_path)
+                requeued += 1
+            except Exception as e:
+                error = str(e)
+        if error:
+            Prescription.query.filter_by(id=prescription_id).update(
+                {'ocr_status': 'failed', 'ocr_error': error}, synchronize_session=False)
+            db.session.commit()
+    if requeued:
+        app.logger.info("Requeued %s pending OCR jobs", requeued)
+    return requeued
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -122,7 +437,11 @@ def dashboard():
     prescriptions = Prescription.query.filter_by(user_id=current_user.id).order_by(Prescription.date_prescribed.desc()).all()
     # Fetch user's medications
     medications = Medication.query.filter_by(user_id=current_user.id).order_by(Medication.start_date.desc()).all()
-    return render_template('dashboard.html', prescriptions=prescriptions, medications=medications)
+    # Fetch the doses of the last week
+    recent_doses = dose_history(current_user.id, start=datetime.now() - timedelta(days=7),
+                                newest_first=True).limit(50).all()
+    return render_template('dashboard.html', prescriptions=prescriptions, medications=medications,
+                           recent_doses=recent_doses)
 
 @app.route('/logout')
 @login_required
@@ -145,6 +464,7 @@ def delete_prescription(prescription_id):
             # Delete the prescription from the database
             db.session.delete(prescription)
             db.session.commit()
+            invalidate_reports(current_user.id)
             return jsonify({'success': True})
         except Exception as e:
             db.session.rollback()
@@ -186,11 +506,22 @@ def upload_prescription():
             doctor_name=doctor_name,
             date_prescribed=datetime.strptime(prescription_date, '%Y-%m-%d'),
             image_path=unique_filename,
-            notes=notes
+            notes=notes,
+            ocr_status='pending',
+            ocr_queued_at=datetime.utcnow()
         )
         
         db.session.add(prescription)
         db.session.commit()
+        invalidate_reports(current_user.id)
+        
+        # Extract the prescription text in the background
+        try:
+            ocr_jobs.submit(prescription.id, file_path)
+        except Exception as e:
+            prescription.ocr_status = 'failed'
+            prescription.ocr_error = str(e)
+            db.session.commit()
         
         # Return success response with prescription data
         return jsonify({
@@ -200,7 +531,8 @@ def upload_prescription():
                 'doctor_name': prescription.doctor_name,
                 'date_prescribed': prescription.date_prescribed.strftime('%B %d, %Y'),
                 'image_path': prescription.image_path,
-                'notes': prescription.notes
+                'notes': prescription.notes,
+                'ocr_status': prescription.ocr_status
             }
         })
         
@@ -208,6 +540,21 @@ def upload_prescription():
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/prescription/<int:prescription_id>/ocr', methods=['GET'])
+@login_required
+def get_prescription_ocr(prescription_id):
+    prescription = Prescription.query.filter_by(id=prescription_id, user_id=current_user.id).first()
+    if not prescription:
+        return jsonify({'success': False, 'error': 'Prescription not found'}), 404
+    
+    return jsonify({
+        'success': True,
+        'status': prescription.ocr_status,
+        'text': prescription.ocr_text,
+        'extracted_data': json.loads(prescription.ocr_data) if prescription.ocr_data else None,
+        'error': prescription.ocr_error
+    })
+
 @app.route('/uploads/prescriptions/<filename>')
 @login_required
 def serve_prescription(filename):
@@ -239,17 +586,20 @@ def add_medication():
         reminder_time = request.form.get('reminderTime')
         
         # Create medication record
+        now = datetime.now()
         medication = Medication(
             user_id=current_user.id,
             name=name,
             dosage=dosage,
             frequency=frequency,
-            start_date=datetime.now(),
+            start_date=now,
             reminder_time=datetime.strptime(reminder_time, '%H:%M').time() if reminder_time else None
         )
+        medication.next_due_at = compute_next_due_at(medication.reminder_time, now - REMINDER_WINDOW)
         
         db.session.add(medication)
         db.session.commit()
+        invalidate_reports(current_user.id)
         
         # Return success response with medication data
         return jsonify({
@@ -279,59 +629,175 @@ def delete_medication(medication_id):
         
         # Delete the medication
         db.session.delete(medication)
+        db.session.add(MedicationTombstone(medication_id=medication.id))
         db.session.commit()
+        invalidate_reports(current_user.id)
         
         return jsonify({'success': True, 'message': 'Medication deleted successfully'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)})
 
+def due_medications(user_id=None, now=None):
+    """
+    Return medications whose pending dose is due, from one range query over
+    next_due_at. Doses that lapsed without being taken are rolled forward to
+    their next occurrence on the way.
+    
+    That write is left in this read path on purpose. Nothing else notices
+    that a dose lapsed, and rows left behind would keep every missed dose
+    inside the range query. Every reader computes the same next occurrence,
+    so concurrent requests and streams racing on the write agree.
+    """
+    now = (now or datetime.now()).replace(second=0, microsecond=0)
+    now_utc = to_utc(now)
+    # Medications written without next_due_at are scheduled here as well
+    query = Medication.query.filter(db.or_(
+        Medication.next_due_at <= now_utc + REMINDER_WINDOW,
+        db.and_(Medication.next_due_at.is_(None), Medication.reminder_time.isnot(None))
+    ))
+    if user_id is not None:
+        query = query.filter(Medication.user_id == user_id)
+    
+    due = []
+    lapsed = False
+    for medication in query:
+        if medication.next_due_at is None or medication.next_due_at < now_utc - REMINDER_WINDOW:
+            medication.next_due_at = compute_next_due_at(medication.reminder_time, now - REMINDER_WINDOW)
+            lapsed = True
+            if medication.next_due_at > now_utc + REMINDER_WINDOW:
+                continue
+        due.append(medication)
+    if lapsed:
+        db.session.commit()
+    return due
+
+def backfill_next_due_at(now=None):
+    """
+    Set next_due_at on medications with a reminder that have none, such as
+    rows written before it existed. Returns the number of rows updated.
+    """
+    now = (now or datetime.now()).replace(second=0, microsecond=0)
+    medications = Medication.query.filter(
+        Medication.next_due_at.is_(None), Medication.reminder_time.isnot(None)
+    ).all()
+    for medication in medications:
+        medication.next_due_at = compute_next_due_at(medication.reminder_time, now - REMINDER_WINDOW)
+    db.session.commit()
+    return len(medications)
+
+def _reminder_payload(medication):
+    return {
+        'id': medication.id,
+        'name': medication.name,
+        'dosage': medication.dosage,
+        'frequency': medication.frequency,
+        'reminder_time': medication.reminder_time.strftime('%I:%M %p')
+    }
+
+def _send_reminder_sms(user, medication):
+    # Each dose occurrence is texted once, however many tabs and workers see it
+    if (user.phone_number and sms_queue
+            and claim_notification(medication.id, medication.next_due_at, 'sms')):
+        sms_message = f"MedTrackr Reminder: Time to take {medication.name} - {medication.dosage}"
+        send_sms_notification(user.phone_number, sms_message)
+
+@app.route('/reminders/due', methods=['GET'])
+@login_required
+def get_due_reminders():
+    """
+    Return every medication of the current user that is due right now
+    """
+    try:
+        medications = due_medications(current_user.id)
+        for medication in medications:
+            _send_reminder_sms(current_user, medication)
+        
+        return jsonify({
+            'success': True,
+            'medications': [_reminder_payload(medication) for medication in medications]
+        })
+    except Exception as e:
+        print(f"Error in reminder check: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
+
+# Seconds between keep-alive comments on an idle reminder stream
+REMINDER_STREAM_HEARTBEAT = 25
+
+def _seconds_until_next_window(user_id, now):
+    """
+    Return how long until the next reminder window of the user opens
+    """
+    now_utc = to_utc(now)
+    upcoming = db.session.query(db.func.min(Medication.next_due_at)).filter(
+        Medication.user_id == user_id,
+        Medication.next_due_at > now_utc + REMINDER_WINDOW
+    ).scalar()
+    if upcoming is None:
+        return None
+    return (upcoming - REMINDER_WINDOW - now_utc).total_seconds()
+
+@app.route('/reminders/stream', methods=['GET'])
+@login_required
+def stream_reminders():
+    """
+    Push due reminders to the dashboard as Server-Sent Events. The stream
+    sleeps until the next reminder window opens, so an idle dashboard costs
+    one open connection rather than a request every few seconds.
+    """
+    user_id = current_user.id
+
+    def generate():
+        sent = set()
+        yield f"retry: {REMINDER_STREAM_HEARTBEAT * 1000}\n\n"
+        while True:
+            now = datetime.now()
+            # Forget occurrences from previous days
+            yesterday = to_utc(now) - timedelta(days=1)
+            sent = {occurrence for occurrence in sent if occurrence[1] > yesterday}
+            user = db.session.get(User, user_id)
+            for medication in due_medications(user_id, now):
+                occurrence = (medication.id, medication.next_due_at)
+                if occurrence in sent:
+                    continue
+                sent.add(occurrence)
+                _send_reminder_sms(user, medication)
+                yield f"event: reminder\ndata: {json.dumps(_reminder_payload(medication))}\n\n"
+            
+            wait = _seconds_until_next_window(user_id, now)
+            # Give the pooled connection back while the stream is idle
+            db.session.remove()
+            
+            if wait is None or wait > REMINDER_STREAM_HEARTBEAT:
+                time.sleep(REMINDER_STREAM_HEARTBEAT)
+                yield ": keepalive\n\n"
+            else:
+                time.sleep(max(wait, 1))
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/medication/<int:medication_id>/reminder', methods=['GET'])
 @login_required
 def get_medication_reminder(medication_id):
     try:
         medication = Medication.query.filter_by(id=medication_id, user_id=current_user.id).first()
         if not medication:
-            print(f"Medication {medication_id} not found")
             return jsonify({'error': 'Medication not found'}), 404
         
-        # Get current time
-        current_time = datetime.now().time()
-        reminder_time = medication.reminder_time
+        now_utc = to_utc(datetime.now().replace(second=0, microsecond=0))
+        next_due_at = medication.next_due_at
         
-        print(f"Checking reminder for medication {medication.name}")
-        print(f"Current time: {current_time}")
-        print(f"Reminder time: {reminder_time}")
+        if next_due_at and now_utc - REMINDER_WINDOW <= next_due_at <= now_utc + REMINDER_WINDOW:
+            _send_reminder_sms(current_user, medication)
+            return jsonify({
+                'success': True,
+                'medication': _reminder_payload(medication)
+            })
         
-        if reminder_time:
-            # Convert times to minutes for easier comparison
-            current_minutes = current_time.hour * 60 + current_time.minute
-            reminder_minutes = reminder_time.hour * 60 + reminder_time.minute
-            
-            # Check if it's time for the reminder (within 1 minute of the reminder time)
-            time_diff = abs(current_minutes - reminder_minutes)
-            print(f"Time difference in minutes: {time_diff}")
-            
-            if time_diff <= 1:  # Within 1 minute of reminder time
-                print(f"Reminder triggered for {medication.name}")
-                
-                # Send SMS notification if phone number is available
-                if current_user.phone_number:
-                    sms_message = f"MedTrackr Reminder: Time to take {medication.name} - {medication.dosage}"
-                    send_sms_notification(current_user.phone_number, sms_message)
-                
-                return jsonify({
-                    'success': True,
-                    'medication': {
-                        'id': medication.id,
-                        'name': medication.name,
-                        'dosage': medication.dosage,
-                        'frequency': medication.frequency,
-                        'reminder_time': reminder_time.strftime('%I:%M %p')
-                    }
-                })
-        
-        print(f"No reminder needed for {medication.name}")
         return jsonify({'success': False, 'message': 'Not time for medication yet'})
     except Exception as e:
         print(f"Error in reminder check: {str(e)}")
@@ -345,10 +811,129 @@ def mark_medication_taken(medication_id):
         return jsonify({'error': 'Medication not found'}), 404
     
     medication.last_taken = datetime.now()
+    scheduled_for = nearest_occurrence(medication.reminder_time, medication.last_taken)
+    db.session.add(DoseEvent(
+        user_id=current_user.id,
+        medication_id=medication.id,
+        taken_at=medication.last_taken,
+        scheduled_for=scheduled_for
+    ))
+    # Skip every occurrence that could be showing as due right now, and the
+    # one this dose was taken for, even if it is still ahead
+    taken_minute = medication.last_taken.replace(second=0, microsecond=0)
+    after = taken_minute + REMINDER_WINDOW + timedelta(minutes=1)
+    if scheduled_for is not None:
+        after = max(after, scheduled_for + timedelta(minutes=1))
+    medication.next_due_at = compute_next_due_at(medication.reminder_time, after)
     db.session.commit()
+    invalidate_reports(current_user.id)
     
     return jsonify({'success': True})
 
+def date_range_args(default_days=30):
+    """
+    Return the period given by the ?start= and ?end= dates (YYYY-MM-DD) of
+    the request, by default the last `default_days` days up to now
+    """
+    end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1) \
+        if 'end' in request.args else datetime.now()
+    start = datetime.strptime(request.args['start'], '%Y-%m-%d') \
+        if 'start' in request.args else end - timedelta(days=default_days)
+    return start, end
+
+@app.route('/doses', methods=['GET'])
+@login_required
+def get_dose_history():
+    """
+    Return the doses taken between ?start= and ?end= (YYYY-MM-DD, default
+    the last 30 days), optionally of one ?medication_id=
+    """
+    try:
+        start, end = date_range_args()
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Dates must be YYYY-MM-DD'}), 400
+    
+    doses = dose_history(current_user.id, start, end,
+                         medication_id=request.args.get('medication_id', type=int))
+    return jsonify({
+        'success': True,
+        'doses': [{
+            'medication_id': medication_id,
+            'medication': name,
+            'taken_at': taken_at.isoformat(),
+            'scheduled_for': scheduled_for.isoformat() if scheduled_for else None
+        } for taken_at, scheduled_for, medication_id, name in doses]
+    })
+
+# Columns of the history exports, in output order
+EXPORT_COLUMNS = {
+    'medications': ['id', 'name', 'dosage', 'frequency', 'start_date', 'end_date',
+                    'reminder_time', 'last_taken'],
+    'prescriptions': ['id', 'doctor_name', 'date_prescribed', 'notes', 'ocr_status', 'ocr_data'],
+    'doses': ['id', 'medication_id', 'taken_at', 'scheduled_for'],
+}
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv'),
+    'jsonl': (iter_jsonl, 'application/x-ndjson'),
+}
+
+def export_rows(kind, user_id=None):
+    """
+    Return a cursor over the EXPORT_COLUMNS of a history kind, of one user
+    or of every user, fetched EXPORT_BATCH_ROWS at a time
+    """
+    model = {'medications': Medication, 'prescriptions': Prescription, 'doses': DoseEvent}[kind]
+    statement = db.select(*[getattr(model, column) for column in EXPORT_COLUMNS[kind]]).order_by(model.id)
+    if user_id is not None:
+        statement = statement.where(model.user_id == user_id)
+    return db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_ROWS))
+
+@app.route('/export/<kind>', methods=['GET'])
+@login_required
+def export_history(kind):
+    """
+    Stream the user's medications, prescriptions or doses as CSV or JSON
+    lines (?format=csv|jsonl). Rows go out as they are read, so exports of
+    any size use constant memory.
+    """
+    if kind not in EXPORT_COLUMNS:
+        return jsonify({'error': 'Unknown export'}), 404
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Format must be csv or jsonl'}), 400
+
+    serialize, mimetype = EXPORT_FORMATS[export_format]
+    rows = export_rows(kind, current_user.id)
+    return Response(
+        stream_with_context(serialize(rows, EXPORT_COLUMNS[kind])),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename={kind}.{export_format}',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/adherence', methods=['GET'])
+@login_required
+def get_adherence():
+    """
+    Return the user's adherence between ?start= and ?end= (YYYY-MM-DD,
+    default the last 30 days), per medication and overall
+    """
+    try:
+        start, end = date_range_args()
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Dates must be YYYY-MM-DD'}), 400
+    
+    result = load_adherence(start, end, [current_user.id])
+    return jsonify({
+        'success': True,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'summary': result.cohort(counts=False),
+        'medications': result.by_medication()
+    })
+
 @app.route('/update_phone', methods=['POST'])
 @login_required
 def update_phone():
@@ -377,22 +962,87 @@ def update_phone():
         print(f"Error updating phone number: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/device_token', methods=['POST'])
+@login_required
+def register_device_token():
+    try:
+        token = request.json.get('token')
+        if not token:
+            return jsonify({'success': False, 'error': 'Token is required'})
+        
+        # A token belongs to one device, so move it if another user had it
+        device_token = DeviceToken.query.filter_by(token=token).first()
+        if device_token:
+            device_token.user_id = current_user.id
+        else:
+            db.session.add(DeviceToken(user_id=current_user.id, token=token))
+        db.session.commit()
+        
+        return jsonify({'success': True})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/device_token', methods=['DELETE'])
+@login_required
+def unregister_device_token():
+    try:
+        token = request.json.get('token')
+        deleted = DeviceToken.query.filter_by(token=token, user_id=current_user.id).delete()
+        db.session.commit()
+        
+        if not deleted:
+            return jsonify({'success': False, 'error': 'Token not found'}), 404
+        return jsonify({'success': True})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+
+def load_device_tokens(user_ids):
+    """
+    Return {user_id: [token, ...]} for a batch of users in one query
+    """
+    tokens = {user_id: [] for user_id in user_ids}
+    rows = db.session.query(DeviceToken.user_id, DeviceToken.token).filter(
+        DeviceToken.user_id.in_(list(user_ids)))
+    for user_id, token in rows:
+        tokens[user_id].append(token)
+    return tokens
+
+def prune_device_tokens(tokens):
+    """
+    Delete tokens that FCM reported as no longer valid
+    """
+    DeviceToken.query.filter(DeviceToken.token.in_(list(tokens))).delete(synchronize_session=False)
+    db.session.commit()
+
 def send_sms_notification(phone_number, message):
-    """Send SMS notification using Twilio"""
-    if not twilio_client or not phone_number:
+    """Queue an SMS notification for delivery through Twilio"""
+    if not sms_queue or not phone_number:
         return False
     
     try:
-        message = twilio_client.messages.create(
-            body=message,
-            from_=TWILIO_PHONE_NUMBER,
-            to=phone_number
-        )
+        # Under gunicorn a process of its own delivers, see run_sms_delivery
+        if not os.getenv('SMS_DELIVERY_PROCESS'):
+            sms_queue.start()
+        sms_queue.enqueue(phone_number, message, sender=TWILIO_PHONE_NUMBER)
         return True
     except Exception as e:
-        print(f"Error sending SMS: {str(e)}")
+        print(f"Error queueing SMS: {str(e)}")
         return False
 
+def run_sms_delivery():
+    """
+    Deliver queued SMS until the process is terminated. Sending waits on
+    SQLite locks inside the sqlite3 C module, which gevent cannot yield
+    from, so gunicorn runs this apart from the web workers.
+    """
+    if not sms_queue:
+        return
+    # Let the workers finish their current message on shutdown
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    sms_queue.run()
+
 def init_app():
     """
     Initialize the application and create necessary directories
@@ -0,0 +1,71 @@
+"""
+Benchmark FuzzyIndex lookups of OCR-noisy medication names.
+
+    python benchmarks/bench_fuzzy_index.py --lexicon-size 100000
+
+Pads the bundled lexicon with generated names, corrupts lexicon names the
+way OCR does and times uncached lookups, next to a brute-force edit
+distance scan over the whole lexicon for a few queries.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fuzzy_index import FuzzyIndex, bounded_levenshtein
+from prescription_extractor import load_lexicon
+
+CONFUSIONS = {'l': '1', 'o': '0', 's': '5', 'i': 'l', 'rn': 'm', 'm': 'rn', 'e': 'c'}
+
+
+def corrupt(name, edits):
+    for _ in range(edits):
+        options = [source for source in CONFUSIONS if source in name]
+        if options and random.random() < 0.7:
+            source = random.choice(options)
+            name = name.replace(source, CONFUSIONS[source], 1)
+        else:
+            position = random.randrange(len(name))
+            name = name[:position] + name[position + 1:]
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lexicon-size', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=10000)
+    parser.add_argument('--brute-force', type=int, default=20,
+                        help='queries to time with a full scan (0 to skip)')
+    args = parser.parse_args()
+
+    lexicon = [name for name in load_lexicon() if ' ' not in name]
+    while len(lexicon) < args.lexicon_size:
+        lexicon.append(''.join(random.choices(string.ascii_lowercase, k=random.randint(6, 14))))
+
+    started = time.perf_counter()
+    index = FuzzyIndex(lexicon)
+    print(f"build over {len(lexicon)} names: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    targets = [random.choice(lexicon) for _ in range(args.queries)]
+    queries = [corrupt(name, random.randint(0, 2)) for name in targets]
+    started = time.perf_counter()
+    results = [index._lookup(query) for query in queries]
+    elapsed = time.perf_counter() - started
+    found = sum(1 for target, result in zip(targets, results) if result and result[0][0] == target)
+    print(f"indexed lookup: {elapsed / len(queries) * 1e6:.1f} us/query, "
+          f"target ranked first for {found / len(queries):.1%}")
+
+    if args.brute_force:
+        started = time.perf_counter()
+        for query in queries[:args.brute_force]:
+            [name for name in lexicon if bounded_levenshtein(query.lower(), name, 2) is not None]
+        elapsed = time.perf_counter() - started
+        print(f"brute-force scan: {elapsed / args.brute_force * 1e6:.1f} us/query")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark streaming CSV and JSONL exports of the medication history.
+
+    python benchmarks/bench_history_export.py --rows 1000000
+
+Creates a scratch database with one user's medications, then streams the
+export endpoint and reports the time to the first chunk, the total time
+and throughput, and the peak traced memory while streaming.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+scratch = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(scratch, 'bench.db')
+
+from app import Medication, User, app, db
+
+
+def populate(count):
+    with app.app_context():
+        db.create_all()
+        user = User(email='clinic@example.com', password_hash='x', name='Clinic')
+        db.session.add(user)
+        db.session.flush()
+        start = datetime(2015, 1, 1)
+        rows = ({'user_id': user.id, 'name': f'Medication {index % 50}', 'dosage': '10mg',
+                 'frequency': 'Daily', 'start_date': start, 'last_taken': start + timedelta(minutes=index)}
+                for index in range(count))
+        db.session.execute(db.insert(Medication), list(rows))
+        db.session.commit()
+        return user.id
+
+
+def run(client, export_format):
+    tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get(f'/export/medications?format={export_format}')
+    chunks = iter(response.response)
+    total = len(next(chunks))
+    first_chunk = time.perf_counter() - started
+    for chunk in chunks:
+        total += len(chunk)
+    elapsed = time.perf_counter() - started
+    response.close()
+    peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    print(f"{export_format:<6} first chunk {first_chunk * 1000:7.1f} ms  total {elapsed:6.1f} s  "
+          f"{total / 1024 / 1024 / elapsed:6.1f} MB/s  peak {peak_mb:6.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    user_id = populate(args.rows)
+    print(f"{args.rows} medication rows")
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    for export_format in ('csv', 'jsonl'):
+        run(client, export_format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Throughput of NotificationDispatcher against a local stub of the FCM API.
+
+    python benchmarks/bench_notification_dispatcher.py --notifications 20000 --latency 0.05
+
+The stub sleeps for one simulated HTTP round trip per call. The baseline
+sends one message per reminder on a single thread, as the scheduler did.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from notification_dispatcher import NotificationDispatcher
+
+
+class StubMessaging:
+    def __init__(self, latency, per_token_latency=0.00002):
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def _round_trip(self, tokens=1):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency + self.per_token_latency * tokens)
+
+    def send_notification(self, token, title, body, data=None):
+        self._round_trip()
+        return 'projects/stub/messages/1'
+
+    def send_multicast_notification(self, tokens, title, body, data=None):
+        self._round_trip(len(tokens))
+        return SimpleNamespace(responses=[SimpleNamespace(success=True, exception=None)
+                                          for _ in tokens])
+
+
+def notifications(count, payloads):
+    random.seed(0)
+    bodies = [f"Time to take Medication{i} - 500mg" for i in range(payloads)]
+    return [(f"token-{i}", "Medication Reminder", random.choice(bodies), None)
+            for i in range(count)]
+
+
+def report(label, count, calls, elapsed):
+    print(f"{label:<28} {elapsed:8.2f}s {calls:7d} API calls {count / elapsed:10.0f} notifications/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--notifications', type=int, default=20000)
+    parser.add_argument('--payloads', type=int, default=20,
+                        help='number of distinct medication/dosage payloads')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='simulated round trip per API call in seconds')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--serial-sample', type=int, default=200,
+                        help='notifications to send serially for the baseline')
+    args = parser.parse_args()
+
+    batch = notifications(args.notifications, args.payloads)
+
+    stub = StubMessaging(args.latency)
+    started = time.perf_counter()
+    for token, title, body, data in batch[:args.serial_sample]:
+        stub.send_notification(token, title, body, data)
+    report('serial send_notification', args.serial_sample, stub.calls,
+           time.perf_counter() - started)
+
+    stub = StubMessaging(args.latency)
+    dispatcher = NotificationDispatcher(stub, max_workers=args.workers)
+    started = time.perf_counter()
+    result = dispatcher.dispatch(batch)
+    report('multicast dispatcher', result.success_count, stub.calls,
+           time.perf_counter() - started)
+    dispatcher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark OCRCache lookups against running tesseract.
+
+    python benchmarks/bench_ocr_cache.py --entries 10000
+
+Fills a cache with synthetic results, then times hits, misses and inserts.
+Pass --image to also time an uncached tesseract run on a real image.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ocr_cache import OCRCache
+
+
+def timed(label, func, count=None):
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    per_op = f" ({elapsed / count * 1e6:.2f} us/op)" if count else ''
+    print(f"{label:<40} {elapsed * 1000:10.1f} ms{per_op}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--image', help='prescription image for an uncached OCR run')
+    args = parser.parse_args()
+
+    result = {
+        'success': True,
+        'text': 'Dr. Jane Smith MD\nAmoxicillin 500mg\nthree times daily\n' * 5,
+        'extracted_data': {'doctor_name': 'Dr. Jane Smith MD', 'medications': ['amoxicillin'],
+                           'dosage': ['Amoxicillin 500mg'], 'frequency': ['three times daily'],
+                           'date': None},
+    }
+    settings = {'tesseract': '5.3.0'}
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = OCRCache(os.path.join(directory, 'ocr_cache.db'))
+        keys = [OCRCache.key(str(i).encode() * 1000, settings) for i in range(args.entries)]
+        timed(f"put x{args.entries}", lambda: [cache.put(key, result) for key in keys], args.entries)
+        timed(f"get (hit) x{args.entries}", lambda: [cache.get(key) for key in keys], args.entries)
+        timed("get (miss) x10000", lambda: [cache.get(str(i)) for i in range(10000)], 10000)
+        image_bytes = os.urandom(2 * 1024 * 1024)
+        timed("key of a 2 MB image x100", lambda: [OCRCache.key(image_bytes, settings) for _ in range(100)], 100)
+        print(cache.stats())
+
+        if args.image:
+            from ocr_processor import OCRProcessor
+            processor = OCRProcessor(cache=cache)
+            timed("process_image (tesseract)", lambda: processor.process_image(args.image))
+            timed("process_image (cached)", lambda: processor.process_image(args.image))
+
+
+if __name__ == '__main__':
+    main()
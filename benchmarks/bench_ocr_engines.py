@@ -0,0 +1,61 @@
+"""
+Compare per-image OCR latency of the pytesseract and tesserocr engines.
+
+    python benchmarks/bench_ocr_engines.py prescription1.jpg prescription2.png --repeat 5
+
+pytesseract starts a tesseract process and writes temporary files for each
+image; tesserocr keeps one engine loaded in-process. Requires tesseract,
+and tesserocr for the second engine.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+
+import ocr_processor
+from image_preprocessing import ImagePreprocessor
+from ocr_processor import OCRProcessor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--preprocess', action='store_true',
+                        help='run the default ImagePreprocessor first')
+    args = parser.parse_args()
+
+    preprocessor = ImagePreprocessor() if args.preprocess else None
+    images = []
+    for path in args.images:
+        with Image.open(path) as image:
+            image.load()
+            images.append(preprocessor.process(image) if preprocessor else image)
+
+    engines = ['pytesseract']
+    if ocr_processor.tesserocr is not None:
+        engines.append('tesserocr')
+    else:
+        print("tesserocr not installed, timing pytesseract only")
+
+    print(f"{'engine':<12} {'first ms':>10} {'median ms':>10} {'p95 ms':>10}")
+    for engine in engines:
+        processor = OCRProcessor(engine=engine)
+        timings = []
+        for _ in range(args.repeat):
+            for image in images:
+                started = time.perf_counter()
+                processor.image_to_string(image)
+                timings.append((time.perf_counter() - started) * 1000)
+        ordered = sorted(timings)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        print(f"{engine:<12} {timings[0]:10.1f} {statistics.median(timings):10.1f} {p95:10.1f}")
+
+
+if __name__ == '__main__':
+    main()
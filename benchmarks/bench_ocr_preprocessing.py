@@ -0,0 +1,129 @@
+"""
+Compare OCR latency and extraction accuracy across preprocessing pipelines.
+
+    python benchmarks/bench_ocr_preprocessing.py --corpus samples/
+
+The corpus is a directory of prescription images, each with a JSON sidecar
+of the expected fields (e.g. scan1.jpg and scan1.json containing
+{"doctor_name": ..., "medications": [...], "date": ...}). Fields present
+in a sidecar are compared with OCRProcessor's extracted_data. Use
+--synthesize N to write N generated phone-sized samples to the corpus
+directory first. Without tesseract only preprocessing time is reported.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from image_preprocessing import ImagePreprocessor
+from ocr_processor import OCRProcessor
+
+PIPELINES = {
+    'raw': None,
+    'orient+downscale': ImagePreprocessor(grayscale=False, binarize=False),
+    'grayscale': ImagePreprocessor(binarize=False),
+    'binarize': ImagePreprocessor(),
+    'binarize+crop': ImagePreprocessor(crop=True),
+    'binarize 200dpi': ImagePreprocessor(target_dpi=200),
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+
+def synthesize(directory, count):
+    """
+    Write phone-photo-sized samples with known fields
+    """
+    os.makedirs(directory, exist_ok=True)
+    medications = ['amoxicillin', 'ibuprofen', 'aspirin', 'metformin']
+    for index in range(count):
+        fields = {
+            'doctor_name': f'Dr. Sample {index} MD',
+            'medications': [random.choice(medications)],
+            'date': f'2024-0{random.randint(1, 9)}-1{random.randint(0, 9)}',
+        }
+        lines = [fields['doctor_name'], f"{fields['medications'][0].title()} 500mg",
+                 'Take twice daily', fields['date']]
+        # Render small and scale up so the default bitmap font is legible
+        text = Image.new('L', (400, 300), 255)
+        draw = ImageDraw.Draw(text)
+        for row, line in enumerate(lines):
+            draw.text((40, 40 + row * 40), line, fill=0)
+        text = text.resize((4000, 3000), Image.NEAREST).filter(ImageFilter.GaussianBlur(3))
+        # Uneven lighting across the page, as in a phone photo
+        shade = Image.linear_gradient('L').resize((4000, 3000)).point(lambda v: 255 - v // 3)
+        photo = Image.merge('RGB', (Image.composite(text, shade, text.point(lambda v: 255 - v)),) * 3)
+        stem = os.path.join(directory, f'sample_{index}')
+        photo.save(stem + '.jpg', quality=90)
+        with open(stem + '.json', 'w') as f:
+            json.dump(fields, f)
+
+
+def load_corpus(directory):
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(name)
+        sidecar = os.path.join(directory, stem + '.json')
+        if extension.lower() in IMAGE_EXTENSIONS and os.path.exists(sidecar):
+            with open(sidecar) as f:
+                corpus.append((os.path.join(directory, name), json.load(f)))
+    return corpus
+
+
+def field_matches(expected, extracted):
+    matched = 0
+    for field, value in expected.items():
+        actual = extracted.get(field)
+        if isinstance(value, list):
+            matched += set(v.lower() for v in value) <= set(v.lower() for v in actual or [])
+        else:
+            matched += bool(actual) and str(value).lower() in str(actual).lower()
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', required=True)
+    parser.add_argument('--synthesize', type=int, default=0,
+                        help='generate this many samples into the corpus first')
+    args = parser.parse_args()
+
+    if args.synthesize:
+        synthesize(args.corpus, args.synthesize)
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        parser.error(f"no images with JSON sidecars in {args.corpus}")
+    ocr = shutil.which('tesseract') is not None
+    if not ocr:
+        print("tesseract not found, reporting preprocessing time only")
+
+    total_fields = sum(len(expected) for _, expected in corpus)
+    print(f"{'pipeline':<20} {'ms/image':>10} {'accuracy':>10}")
+    for name, preprocessor in PIPELINES.items():
+        processor = OCRProcessor(preprocessor=preprocessor)
+        elapsed = 0.0
+        matched = 0
+        for image_path, expected in corpus:
+            started = time.perf_counter()
+            if ocr:
+                result = processor.process_image(image_path)
+            else:
+                with Image.open(image_path) as image:
+                    (preprocessor.process(image) if preprocessor else image).load()
+                result = None
+            elapsed += time.perf_counter() - started
+            if result and result['success']:
+                matched += field_matches(expected, result['extracted_data'])
+        accuracy = f"{matched / total_fields:.1%}" if ocr else '-'
+        print(f"{name:<20} {elapsed / len(corpus) * 1000:10.1f} {accuracy:>10}")
+
+
+if __name__ == '__main__':
+    main()
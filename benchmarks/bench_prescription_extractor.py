@@ -0,0 +1,91 @@
+"""
+Benchmark prescription field extraction against lexicon size and text length.
+
+    python benchmarks/bench_prescription_extractor.py --lexicon-sizes 250 10000 100000
+
+Times PrescriptionExtractor.extract on synthetic OCR text with lexicons
+padded by generated names, next to the previous per-line loop over a
+hard-coded list of four drugs for reference.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from prescription_extractor import PrescriptionExtractor, load_lexicon
+
+
+def legacy_extract(text):
+    """
+    The line-by-line extraction this module replaced
+    """
+    extracted_data = {'doctor_name': None, 'medications': [], 'dosage': [], 'frequency': [], 'date': None}
+    for line in text.split('\n'):
+        line = line.strip()
+        if 'Dr.' in line or 'MD' in line:
+            extracted_data['doctor_name'] = line
+        for med in ['amoxicillin', 'ibuprofen', 'aspirin', 'metformin']:
+            if med.lower() in line.lower():
+                extracted_data['medications'].append(med)
+        if 'mg' in line.lower() or 'ml' in line.lower():
+            extracted_data['dosage'].append(line)
+        for indicator in ['daily', 'twice', 'three times', 'every']:
+            if indicator in line.lower():
+                extracted_data['frequency'].append(line)
+        for date_format in ['%m/%d/%Y', '%d/%m/%Y', '%Y-%m-%d']:
+            try:
+                extracted_data['date'] = datetime.strptime(line, date_format).strftime('%Y-%m-%d')
+                break
+            except ValueError:
+                continue
+    return extracted_data
+
+
+def synthetic_text(names, lines):
+    rows = ['Dr. Jane Smith MD', 'City Clinic, 12 Main Street', '03/15/2024']
+    for _ in range(lines):
+        rows.append(f"{random.choice(names).title()} {random.choice([5, 10, 250, 500])} mg "
+                    f"{random.choice(['once daily', 'twice daily', 'every 8 hours', 'at night'])}")
+        rows.append('Take with food and plenty of water')
+    return '\n'.join(rows)
+
+
+def timed_per_call(func, text, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(text)
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lexicon-sizes', type=int, nargs='+', default=[250, 10000, 100000])
+    parser.add_argument('--lines', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    bundled = load_lexicon()
+    texts = {lines: synthetic_text(bundled, lines) for lines in args.lines}
+
+    print(f"{'extractor':<24} {'lexicon':>8} {'lines':>6} {'us/call':>10}")
+    for lines, text in texts.items():
+        print(f"{'legacy':<24} {4:>8} {lines:>6} {timed_per_call(legacy_extract, text, args.repeat):10.1f}")
+    for size in args.lexicon_sizes:
+        lexicon = list(bundled)
+        while len(lexicon) < size:
+            lexicon.append(''.join(random.choices(string.ascii_lowercase, k=random.randint(6, 14))))
+        started = time.perf_counter()
+        extractor = PrescriptionExtractor(lexicon)
+        print(f"{'build':<24} {size:>8} {'':>6} {(time.perf_counter() - started) * 1e6:10.1f}")
+        for lines, text in texts.items():
+            print(f"{'PrescriptionExtractor':<24} {size:>8} {lines:>6} "
+                  f"{timed_per_call(extractor.extract, text, args.repeat):10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Measure memory per reminder held by ReminderSystem.
+
+    python benchmarks/bench_reminder_memory.py --reminders 200000
+
+"before" rebuilds the original layout (a 7-key dict, a notify closure and
+a schedule.Job per reminder); "after" is the current ReminderSystem with
+slotted records, interned strings, the heap scheduler and its indexes.
+"""
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from reminder_system import ReminderSystem
+
+MEDICATIONS = ['Amoxicillin', 'Ibuprofen', 'Aspirin', 'Metformin', 'Lisinopril',
+               'Atorvastatin', 'Levothyroxine', 'Amlodipine', 'Omeprazole', 'Losartan']
+DOSAGES = ['5mg', '10mg', '20mg', '100mg', '250mg', '500mg']
+FREQUENCIES = ['once', 'twice', 'thrice']
+
+
+def rows(count):
+    """
+    Yield reminder rows with freshly built strings, as a DB driver returns them
+    """
+    random.seed(0)
+    for medication_id in range(count):
+        minute = random.randrange(24 * 60)
+        yield (
+            medication_id // 3,
+            medication_id,
+            random.choice(MEDICATIONS).encode().decode(),
+            random.choice(DOSAGES).encode().decode(),
+            random.choice(FREQUENCIES).encode().decode(),
+            f"{minute // 60:02d}:{minute % 60:02d}"
+        )
+
+
+def measure(label, build, count):
+    tracemalloc.start()
+    kept = build(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<8} {current / count:8.0f} bytes/reminder ({current / 2 ** 20:.1f} MiB total)")
+    return kept
+
+
+def build_before(count):
+    import schedule
+
+    scheduler = schedule.Scheduler()
+    reminders = {}
+    for user_id, medication_id, name, dosage, frequency, reminder_time in rows(count):
+        reminder = {
+            'user_id': user_id,
+            'medication_id': medication_id,
+            'medication_name': name,
+            'dosage': dosage,
+            'frequency': frequency,
+            'reminder_time': reminder_time,
+            'last_notified': None
+        }
+        reminders[medication_id] = reminder
+
+        def notify(reminder=reminder):
+            reminder['last_notified'] = None
+
+        scheduler.every().day.at(reminder_time).do(notify).tag(medication_id)
+    return reminders, scheduler
+
+
+def build_after(count):
+    class NullHandler:
+        def send_notification(self, *args, **kwargs):
+            pass
+
+    reminder_system = ReminderSystem(firebase_handler=NullHandler())
+    for row in rows(count):
+        reminder_system.add_reminder(*row)
+    return reminder_system
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reminders', type=int, default=200000)
+    args = parser.parse_args()
+
+    try:
+        before = measure('before', build_before, args.reminders)
+        del before
+    except ImportError:
+        print("schedule library not installed, skipping the before layout")
+    measure('after', build_after, args.reminders)
+
+
+if __name__ == '__main__':
+    main()
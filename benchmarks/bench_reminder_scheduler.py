@@ -0,0 +1,77 @@
+"""
+Benchmark the heap-based ReminderScheduler with a large number of reminders.
+
+    python benchmarks/bench_reminder_scheduler.py --reminders 1000000
+
+Compares the idle per-tick cost with the `schedule` library, which scans
+every job on each run_pending() call (pass --legacy 0 to skip).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from reminder_scheduler import ReminderScheduler
+
+
+def timed(label, func, count=None):
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    per_op = f" ({elapsed / count * 1e6:.2f} us/op)" if count else ''
+    print(f"{label:<40} {elapsed * 1000:10.1f} ms{per_op}")
+    return result
+
+
+def bench_heap(count):
+    day_start = time.time()
+    fire_times = [day_start + random.randrange(24 * 60) * 60 for _ in range(count)]
+    scheduler = ReminderScheduler(clock=lambda: day_start)
+
+    timed(f"schedule_many {count}", lambda: scheduler.schedule_many(enumerate(fire_times)), count)
+
+    sample = random.sample(range(count), 10000)
+    timed("schedule (update) x10000",
+          lambda: [scheduler.schedule(key, fire_times[key] + 60) for key in sample], 10000)
+    timed("cancel x10000", lambda: [scheduler.cancel(key) for key in sample], 10000)
+    timed("idle tick (next_fire_time) x10000",
+          lambda: [scheduler.next_fire_time() for _ in range(10000)], 10000)
+
+    # Fire one minute's worth of co-due reminders as a batch
+    first = scheduler.next_fire_time()
+    batch = timed("pop_due one minute batch", lambda: scheduler.pop_due(first + 59))
+    print(f"{'':<40} {len(batch)} reminders in batch")
+
+
+def bench_legacy(count):
+    try:
+        import schedule
+    except ImportError:
+        print("schedule library not installed, skipping legacy comparison")
+        return
+
+    for _ in range(count):
+        minute = random.randrange(24 * 60)
+        schedule.every().day.at(f"{minute // 60:02d}:{minute % 60:02d}").do(lambda: None)
+    timed(f"schedule.run_pending with {count} jobs x10",
+          lambda: [schedule.run_pending() for _ in range(10)], 10)
+    schedule.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reminders', type=int, default=1000000)
+    parser.add_argument('--legacy', type=int, default=100000,
+                        help='number of jobs for the schedule library comparison')
+    args = parser.parse_args()
+
+    bench_heap(args.reminders)
+    if args.legacy:
+        bench_legacy(args.legacy)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark ReminderSync startup and incremental sync.
+
+    python benchmarks/bench_reminder_sync.py --medications 1000000 --changes 1000
+
+Builds a scratch SQLite database, times the bulk load into a fresh
+ReminderSystem, then times a sync after a small batch of updates.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DATABASE = os.path.join(tempfile.mkdtemp(), 'bench_sync.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DATABASE}'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import Medication, app, db
+from reminder_sync import ReminderSync
+from reminder_system import ReminderSystem
+
+
+class NullHandler:
+    def send_notification(self, *args, **kwargs):
+        pass
+
+
+def populate(count):
+    random.seed(0)
+    now = datetime.utcnow() - timedelta(hours=1)
+    rows = ({
+        'user_id': medication_id // 3 + 1,
+        'name': random.choice(['Amoxicillin', 'Ibuprofen', 'Aspirin', 'Metformin']),
+        'dosage': '500mg',
+        'frequency': 'twice',
+        'start_date': now,
+        'reminder_time': (datetime.min + timedelta(minutes=random.randrange(24 * 60))).time(),
+        'updated_at': now
+    } for medication_id in range(count))
+    with app.app_context():
+        db.create_all()
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == 50000:
+                db.session.execute(db.insert(Medication), batch)
+                batch = []
+        if batch:
+            db.session.execute(db.insert(Medication), batch)
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--medications', type=int, default=1000000)
+    parser.add_argument('--changes', type=int, default=1000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    populate(args.medications)
+    print(f"populated {args.medications} medications in {time.perf_counter() - started:.1f}s")
+
+    sync = ReminderSync(ReminderSystem(firebase_handler=NullHandler()))
+    started = time.perf_counter()
+    loaded = sync.load_all()
+    print(f"load_all: {loaded} reminders in {time.perf_counter() - started:.2f}s")
+
+    # Move the watermark past the overlap window so only real changes are read
+    sync.watermark = datetime.utcnow() - timedelta(seconds=1)
+    with app.app_context():
+        for medication_id in random.sample(range(1, args.medications + 1), args.changes):
+            db.session.execute(db.update(Medication).where(Medication.id == medication_id).values(
+                reminder_time=(datetime.min + timedelta(minutes=random.randrange(24 * 60))).time(),
+                updated_at=datetime.utcnow()
+            ))
+        db.session.commit()
+
+    started = time.perf_counter()
+    applied = sync.sync()
+    print(f"sync: {applied} changes in {(time.perf_counter() - started) * 1000:.1f}ms")
+    os.remove(DATABASE)
+
+
+if __name__ == '__main__':
+    main()
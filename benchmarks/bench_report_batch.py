@@ -0,0 +1,66 @@
+"""
+Benchmark batch report throughput against the number of worker processes.
+
+    python benchmarks/bench_report_batch.py --users 200 --workers 1 2 4 8
+
+Creates a scratch database with synthetic users, medications and
+prescriptions, then renders every user's reports with each worker count.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+scratch = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(scratch, 'bench.db')
+
+from app import Medication, Prescription, User, app, db
+from report_batch import generate_reports
+
+
+def populate(count):
+    with app.app_context():
+        db.create_all()
+        for index in range(count):
+            user = User(email=f'user{index}@example.com', password_hash='x', name=f'User {index}')
+            db.session.add(user)
+            db.session.flush()
+            for medication in range(5):
+                db.session.add(Medication(user_id=user.id, name=f'Medication {medication}', dosage='10mg',
+                                          frequency='Daily', start_date=datetime(2024, 1, 1),
+                                          last_taken=datetime(2024, 1, 20)))
+            for prescription in range(3):
+                db.session.add(Prescription(user_id=user.id, doctor_name='Dr. Smith',
+                                            date_prescribed=datetime(2024, 1, 1), ocr_status='done'))
+        db.session.commit()
+        user_ids = [user.id for user in User.query.all()]
+        db.engine.dispose()
+    return user_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    user_ids = populate(args.users)
+    baseline = None
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as output_dir:
+            started = time.perf_counter()
+            results = list(generate_reports(user_ids, output_dir, datetime(2024, 1, 1),
+                                            datetime(2024, 1, 1) + timedelta(days=31), workers))
+            elapsed = time.perf_counter() - started
+        throughput = len(results) / elapsed
+        baseline = baseline or throughput
+        failed = sum(not result['success'] for result in results)
+        print(f"{workers:>3} workers: {throughput:7.1f} users/s ({throughput / baseline:.2f}x), {failed} failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark medication reports with long histories.
+
+    python benchmarks/bench_report_history.py --entries 100000
+
+Each run happens in a fresh process so its peak RSS can be reported. The
+streaming report consumes a generator of history entries; the legacy run
+lays the whole history out as one Table, as the report did before (pass
+--legacy-entries 0 to skip it, it is slow for large histories).
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Table
+
+from report_generator import HISTORY_TABLE_STYLE, ReportGenerator
+
+START = datetime(2015, 1, 1)
+
+
+def history(count):
+    names = ['Amoxicillin', 'Metformin', 'Lisinopril', 'Atorvastatin']
+    for index in range(count):
+        yield {
+            'date': START + timedelta(hours=index),
+            'medication': names[index % len(names)],
+            'action': 'Taken' if index % 7 else 'Missed',
+            'notes': 'Taken with food' if index % 3 else ''
+        }
+
+
+def run_streaming(count, output_dir):
+    generator = ReportGenerator(output_dir)
+    medications = [{'name': 'Metformin', 'dosage': '500mg', 'frequency': 'Twice daily', 'start_date': START}]
+    generator.generate_medication_report({'name': 'Benchmark Patient'}, medications,
+                                         START, START + timedelta(hours=count), history=history(count))
+
+
+def run_legacy(count, output_dir):
+    rows = [['Date', 'Medication', 'Action', 'Notes']]
+    for entry in list(history(count)):
+        rows.append([entry['date'].strftime('%Y-%m-%d'), entry['medication'], entry['action'], entry['notes']])
+    table = Table(rows)
+    table.setStyle(HISTORY_TABLE_STYLE)
+    SimpleDocTemplate(os.path.join(output_dir, 'legacy.pdf'), pagesize=letter).build([table])
+
+
+def child(mode, count):
+    with tempfile.TemporaryDirectory() as output_dir:
+        started = time.perf_counter()
+        (run_streaming if mode == 'streaming' else run_legacy)(count, output_dir)
+        elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:<10} {count:>8} entries {elapsed:8.1f} s  peak RSS {peak_mb:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--legacy-entries', type=int, nargs='*', default=[10000])
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'COUNT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], int(args.child[1]))
+        return
+    runs = [('streaming', count) for count in args.entries]
+    runs += [('legacy', count) for count in args.legacy_entries or []]
+    for mode, count in runs:
+        subprocess.run([sys.executable, __file__, '--child', mode, str(count)], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark the SMS queue against a fake transport.
+
+    python benchmarks/bench_sms_queue.py --messages 2000 --latency 0.3
+
+Compares the time a request handler spends sending one SMS directly with
+the time it spends queueing it, then measures drain throughput with the
+per-sender rate limit applied.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sms_queue import SMSQueue
+
+
+class FakeTransport:
+    def __init__(self, latency):
+        self.latency = latency
+        self.sent = 0
+
+    def send(self, recipient, sender, body):
+        time.sleep(self.latency)
+        self.sent += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.3,
+                        help='simulated Twilio API latency in seconds')
+    parser.add_argument('--senders', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=50,
+                        help='messages per second allowed per sender')
+    parser.add_argument('--workers', type=int, default=32)
+    args = parser.parse_args()
+
+    transport = FakeTransport(args.latency)
+    started = time.perf_counter()
+    for _ in range(10):
+        transport.send('+15550000000', '+15551111111', 'Time to take Aspirin')
+    direct = (time.perf_counter() - started) / 10
+
+    with tempfile.TemporaryDirectory() as directory:
+        queue = SMSQueue(os.path.join(directory, 'sms.db'), FakeTransport(args.latency),
+                         workers=args.workers, rate=args.rate, burst=args.rate)
+        started = time.perf_counter()
+        for index in range(args.messages):
+            queue.enqueue(f'+1555{index:07d}', 'Time to take Aspirin',
+                          sender=f'+1666{index % args.senders:07d}')
+        enqueue = (time.perf_counter() - started) / args.messages
+
+        started = time.perf_counter()
+        queue.start()
+        while queue.stats().get('sent', 0) < args.messages:
+            time.sleep(0.05)
+        drained = time.perf_counter() - started
+        queue.stop()
+
+    print(f"request latency, direct send   {direct * 1000:8.2f} ms")
+    print(f"request latency, enqueue       {enqueue * 1000:8.2f} ms")
+    print(f"drain {args.messages} messages        {drained:8.2f} s "
+          f"({args.messages / drained:.0f}/s, limit {args.rate * args.senders:.0f}/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Load test comparing dashboard polling with the reminder event stream.
+
+Simulates N idle dashboards against a running server and reports the
+request rate each approach puts on the web workers:
+
+    gunicorn -c gunicorn.conf.py app:app
+    python benchmarks/reminder_stream_load.py --url http://127.0.0.1:8000 --dashboards 1000
+"""
+import argparse
+import asyncio
+import random
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from http.cookiejar import CookieJar
+
+
+def login(base_url):
+    """
+    Register a throwaway user and return its session cookie header
+    """
+    jar = CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    form = urllib.parse.urlencode({
+        'email': f'loadtest-{uuid.uuid4().hex[:8]}@example.com',
+        'password': 'loadtest',
+        'name': 'Load Test'
+    }).encode()
+    opener.open(f'{base_url}/register', data=form)
+    return '; '.join(f'{cookie.name}={cookie.value}' for cookie in jar)
+
+
+async def open_request(host, port, path, cookie):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write((
+        f'GET {path} HTTP/1.1\r\n'
+        f'Host: {host}\r\n'
+        f'Cookie: {cookie}\r\n'
+        'Connection: close\r\n\r\n'
+    ).encode())
+    await writer.drain()
+    return reader, writer
+
+
+async def polling_dashboard(host, port, cookie, interval, deadline, stats):
+    # Spread the first poll so dashboards do not fire in lockstep
+    await asyncio.sleep(random.uniform(0, interval))
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await open_request(host, port, '/reminders/due', cookie)
+            await reader.read()
+            writer.close()
+            stats['requests'] += 1
+        except OSError:
+            stats['errors'] += 1
+        await asyncio.sleep(interval)
+
+
+async def streaming_dashboard(host, port, cookie, deadline, stats):
+    try:
+        reader, writer = await open_request(host, port, '/reminders/stream', cookie)
+        stats['requests'] += 1
+    except OSError:
+        stats['errors'] += 1
+        return
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                line = await asyncio.wait_for(reader.readline(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                stats['errors'] += 1
+                break
+            if line.startswith(b'event: reminder'):
+                stats['events'] += 1
+    finally:
+        writer.close()
+
+
+async def run(mode, base_url, dashboards, duration, interval):
+    parsed = urllib.parse.urlparse(base_url)
+    host, port = parsed.hostname, parsed.port or 80
+    cookie = login(base_url)
+    stats = {'requests': 0, 'events': 0, 'errors': 0}
+    deadline = time.monotonic() + duration
+
+    if mode == 'poll':
+        tasks = [polling_dashboard(host, port, cookie, interval, deadline, stats)
+                 for _ in range(dashboards)]
+    else:
+        tasks = [streaming_dashboard(host, port, cookie, deadline, stats)
+                 for _ in range(dashboards)]
+    started = time.monotonic()
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+
+    print(f"{mode:>6}: {dashboards} dashboards, {elapsed:.0f}s, "
+          f"{stats['requests']} requests ({stats['requests'] / elapsed:.1f} req/s), "
+          f"{stats['events']} reminder events, {stats['errors']} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--dashboards', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--interval', type=float, default=10,
+                        help='polling interval of the legacy dashboard in seconds')
+    parser.add_argument('--mode', choices=['poll', 'stream', 'both'], default='both')
+    args = parser.parse_args()
+
+    modes = ['poll', 'stream'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        asyncio.run(run(mode, args.url, args.dashboards, args.duration, args.interval))
+
+
+if __name__ == '__main__':
+    main()
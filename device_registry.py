@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class DeviceTokenRegistry:
+    def __init__(self, loader, pruner=None, ttl=300, max_users=100000, clock=time.monotonic):
+        """
+        In-process cache of users' device tokens with a TTL and LRU
+        eviction. `loader(user_ids)` returns {user_id: [token, ...]} for a
+        batch of users; `pruner(tokens)` deletes invalid tokens from storage.
+        """
+        self.loader = loader
+        self.pruner = pruner
+        self.ttl = ttl
+        self.max_users = max_users
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.owners = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def tokens_for_users(self, user_ids):
+        """
+        Return {user_id: [token, ...]}, loading every missing or expired
+        user with a single loader call
+        """
+        now = self.clock()
+        tokens = {}
+        missing = []
+        with self.lock:
+            for user_id in user_ids:
+                entry = self.entries.get(user_id)
+                if entry and entry[0] > now:
+                    self.entries.move_to_end(user_id)
+                    tokens[user_id] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(user_id)
+                    self.misses += 1
+        
+        if missing:
+            loaded = self.loader(missing)
+            with self.lock:
+                for user_id in missing:
+                    user_tokens = list(loaded.get(user_id, ()))
+                    self._store(user_id, user_tokens, now + self.ttl)
+                    tokens[user_id] = user_tokens
+        return tokens
+
+    def invalidate(self, user_id):
+        """
+        Drop a user's cached tokens
+        """
+        with self.lock:
+            self._discard(user_id)
+
+    def prune(self, tokens):
+        """
+        Remove invalid tokens from storage and from the cache
+        """
+        tokens = set(tokens)
+        if not tokens:
+            return
+        if self.pruner:
+            self.pruner(tokens)
+        with self.lock:
+            for token in tokens:
+                user_id = self.owners.pop(token, None)
+                if user_id in self.entries:
+                    self.entries[user_id][1].remove(token)
+
+    def _store(self, user_id, user_tokens, expires_at):
+        self._discard(user_id)
+        self.entries[user_id] = (expires_at, user_tokens)
+        for token in user_tokens:
+            self.owners[token] = user_id
+        while len(self.entries) > self.max_users:
+            self._discard(next(iter(self.entries)))
+
+    def _discard(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry:
+            for token in entry[1]:
+                if self.owners.get(token) == user_id:
+                    del self.owners[token]
@@ -0,0 +1,105 @@
+from collections import Counter
+from functools import lru_cache
+
+# Characters tesseract commonly returns in place of letters
+OCR_CONFUSIONS = str.maketrans({'0': 'o', '1': 'l', '5': 's', '8': 'b', '|': 'l'})
+
+
+def trigrams(word):
+    """
+    Return the trigrams of `word` padded with two spaces on each side
+    """
+    padded = f'  {word}  '
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def bounded_levenshtein(a, b, limit):
+    """
+    Return the edit distance between `a` and `b`, or None if it exceeds
+    `limit`. Only the diagonal band of width 2 * limit + 1 is computed.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return None
+    beyond = limit + 1
+    previous = [j if j <= limit else beyond for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [beyond] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        low = max(1, i - limit)
+        high = min(len(b), i + limit)
+        row_min = current[0]
+        char = a[i - 1]
+        for j in range(low, high + 1):
+            cost = previous[j - 1] if b[j - 1] == char else previous[j - 1] + 1
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+class FuzzyIndex:
+    """
+    Trigram inverted index over medication names for OCR-noisy lookups.
+
+    A word within k edits of a name shares all but at most 3k of its
+    trigrams with it, so only names reaching that count in the query's
+    postings (and within k of its length) are verified with a banded edit
+    distance.
+    """
+
+    def __init__(self, names, max_distance=2, min_length=5, cache_size=100000):
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.names = []
+        self.postings = {}
+        for name in dict.fromkeys(name.lower() for name in names):
+            name_id = len(self.names)
+            self.names.append(name)
+            for gram in set(trigrams(name)):
+                self.postings.setdefault(gram, []).append(name_id)
+        # The same noisy tokens recur across prescriptions
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, token, limit=3):
+        """
+        Return up to `limit` (name, score) pairs within the edit distance
+        bound of `token`, best first. The score is 1 minus the distance
+        relative to the longer of the two words.
+        """
+        token = token.lower().translate(OCR_CONFUSIONS)
+        if len(token) < self.min_length:
+            return ()
+        # Allow more edits in longer words
+        max_distance = min(self.max_distance, len(token) // 4)
+
+        postings = self.postings
+        grams = sorted(set(trigrams(token)), key=lambda gram: len(postings.get(gram, ())))
+        required = len(grams) - 3 * max_distance
+        # Leave out the most common trigrams, usually word edges shared by
+        # a large part of the lexicon, lowering the required count to match
+        common = max(100, len(self.names) // 100)
+        while required > 2 and len(postings.get(grams[-1], ())) > common:
+            grams.pop()
+            required -= 1
+        counts = Counter()
+        for gram in grams:
+            counts.update(postings.get(gram, ()))
+
+        matches = []
+        for name_id, shared in counts.items():
+            if shared < required:
+                continue
+            name = self.names[name_id]
+            distance = bounded_levenshtein(token, name, max_distance)
+            if distance is not None:
+                matches.append((1 - distance / max(len(token), len(name)), name))
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return tuple((name, score) for score, name in matches[:limit])
@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+
+# Each open dashboard keeps a reminder stream connected, so use an async
+# worker that parks idle connections instead of a thread per browser tab
+worker_class = 'gevent'
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 2000))
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+# The app sizes its OCR pool by this, so pass the worker count on
+os.environ['WEB_CONCURRENCY'] = str(workers)
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+# Web workers only enqueue SMS; when_ready starts the process that sends them
+os.environ['SMS_DELIVERY_PROCESS'] = '1'
+sms_delivery = None
+
+
+def when_ready(server):
+    global sms_delivery
+    sms_delivery = subprocess.Popen([sys.executable, '-c', 'from app import run_sms_delivery; run_sms_delivery()'])
+
+
+def on_exit(server):
+    if sms_delivery is not None:
+        sms_delivery.terminate()
+        sms_delivery.wait()
+
+
+def post_worker_init(worker):
+    # OCR jobs only live in memory, so pick up those a restart dropped. Each
+    # job is claimed in the database, so only one worker resubmits it.
+    from app import app, requeue_stale_ocr_jobs
+    with app.app_context():
+        requeue_stale_ocr_jobs()
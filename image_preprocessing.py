@@ -0,0 +1,90 @@
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+# Assumed height of the photographed page when an image carries no DPI
+PAGE_HEIGHT_INCHES = 11
+
+
+class ImagePreprocessor:
+    def __init__(self, fix_orientation=True, target_dpi=300, grayscale=True,
+                 binarize=True, crop=False, block_size=31, offset=10, crop_margin=20):
+        """
+        Prepare a photo or scan for OCR: apply the EXIF orientation,
+        downscale to `target_dpi`, convert to grayscale, binarize against the
+        local mean of each `block_size` neighbourhood and optionally crop to
+        the text region. Set an option to False/None to skip its step.
+        """
+        self.fix_orientation = fix_orientation
+        self.target_dpi = target_dpi
+        self.grayscale = grayscale
+        self.binarize = binarize
+        self.crop = crop
+        self.block_size = block_size
+        self.offset = offset
+        self.crop_margin = crop_margin
+
+    def settings(self):
+        """
+        Return the options as a dict, e.g. for an OCR cache key
+        """
+        return {
+            'fix_orientation': self.fix_orientation,
+            'target_dpi': self.target_dpi,
+            'grayscale': self.grayscale,
+            'binarize': self.binarize,
+            'crop': self.crop,
+            'block_size': self.block_size,
+            'offset': self.offset,
+            'crop_margin': self.crop_margin,
+        }
+
+    def process(self, image):
+        """
+        Return the preprocessed copy of a PIL image
+        """
+        grayscale = self.grayscale or self.binarize
+        target_size = None
+        if self.target_dpi:
+            scale = self._scale(image)
+            if scale < 1:
+                target_size = max(1, round(max(image.size) * scale))
+                # Let the JPEG decoder skip most of the work by decoding at
+                # a reduced size (and straight to grayscale) up front
+                image.draft('L' if grayscale else image.mode,
+                            (round(image.width * scale), round(image.height * scale)))
+        if self.fix_orientation:
+            image = ImageOps.exif_transpose(image)
+        if grayscale:
+            image = image.convert('L')
+        if target_size and max(image.size) > target_size:
+            factor = target_size / float(max(image.size))
+            image = image.resize((max(1, round(image.width * factor)), max(1, round(image.height * factor))),
+                                 Image.LANCZOS, reducing_gap=2.0)
+        if self.binarize:
+            image = self._binarize(image)
+            if self.crop:
+                image = self._crop_to_text(image)
+        return image
+
+    def _scale(self, image):
+        dpi = image.info.get('dpi')
+        # Cameras usually record a nominal 72 DPI, so only trust the value
+        # at scanner resolutions
+        if dpi and dpi[1] >= 150:
+            return self.target_dpi / float(dpi[1])
+        return self.target_dpi * PAGE_HEIGHT_INCHES / float(max(image.size))
+
+    def _binarize(self, image):
+        # A pixel is ink when it is darker than its neighbourhood mean by
+        # more than `offset`; this copes with shadows and uneven lighting
+        # where a single global threshold does not
+        mean = image.filter(ImageFilter.BoxBlur(self.block_size // 2))
+        darker = ImageChops.subtract(mean, image)
+        return darker.point(lambda value: 0 if value > self.offset else 255)
+
+    def _crop_to_text(self, image):
+        box = ImageOps.invert(image).getbbox()
+        if box is None:
+            return image
+        margin = self.crop_margin
+        return image.crop((max(0, box[0] - margin), max(0, box[1] - margin),
+                           min(image.width, box[2] + margin), min(image.height, box[3] + margin)))
@@ -1,7 +1,7 @@
 import os
 import sys
 
-from app import app, db
+from app import app, backfill_next_due_at, db
 
 
 def init_database():
@@ -38,5 +38,17 @@ def init_database():
                 db.create_all()
                 print("Database recreated successfully!")
 
+def backfill_reminders():
+    """
+    Schedule the pending dose of existing medications that have a reminder
+    but no next_due_at, without touching other data
+    """
+    with app.app_context():
+        updated = backfill_next_due_at()
+        print(f"Scheduled reminders of {updated} medications")
+
 if __name__ == "__main__":
-    init_database() 
\ No newline at end of file
+    if '--backfill-reminders' in sys.argv:
+        backfill_reminders()
+    else:
+        init_database() 
\ No newline at end of file
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from firebase_admin import exceptions, messaging
+
+# FCM accepts at most 500 tokens per multicast message
+MAX_MULTICAST_TOKENS = 500
+
+
+def is_invalid_token_error(error):
+    """
+    Return True if FCM rejected a token for good, so it should be pruned.
+    INVALID_ARGUMENT is also raised for a malformed message, which says
+    nothing about the token, so it only counts when it names the token.
+    """
+    if isinstance(error, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+        return True
+    return (isinstance(error, exceptions.InvalidArgumentError)
+            and 'registration token' in str(error).lower())
+
+
+class DispatchResult:
+    def __init__(self):
+        """
+        Outcome of a dispatch: number of messages delivered and the
+        (token, exception) pairs that failed
+        """
+        self.success_count = 0
+        self.failures = []
+
+    @property
+    def failure_count(self):
+        return len(self.failures)
+
+
+class NotificationDispatcher:
+    def __init__(self, firebase_handler, max_workers=8, chunk_size=MAX_MULTICAST_TOKENS):
+        """
+        Coalesce notifications with identical payloads into multicast
+        messages and send them from a bounded worker pool
+        """
+        self.firebase_handler = firebase_handler
+        self.chunk_size = min(chunk_size, MAX_MULTICAST_TOKENS)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='notification-dispatch')
+
+    def dispatch(self, notifications):
+        """
+        Send (token, title, body, data) notifications and wait for the
+        result
+        """
+        # Group tokens by payload; a dict per payload keeps token order and
+        # drops duplicate tokens
+        groups = {}
+        for token, title, body, data in notifications:
+            key = (title, body, tuple(sorted((data or {}).items())))
+            groups.setdefault(key, {})[token] = None
+
+        futures = {}
+        for (title, body, data), tokens in groups.items():
+            tokens = list(tokens)
+            for start in range(0, len(tokens), self.chunk_size):
+                chunk = tokens[start:start + self.chunk_size]
+                future = self.executor.submit(
+                    self.firebase_handler.send_multicast_notification,
+                    chunk, title, body, dict(data)
+                )
+                futures[future] = chunk
+
+        result = DispatchResult()
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                response = future.result()
+            except Exception as e:
+                result.failures.extend((token, e) for token in chunk)
+                continue
+            for token, send_response in zip(chunk, response.responses):
+                if send_response.success:
+                    result.success_count += 1
+                else:
+                    result.failures.append((token, send_response.exception))
+        return result
+
+    def shutdown(self):
+        """
+        Stop the worker pool once queued sends have finished
+        """
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,154 @@
+"""
+Run OCR over many prescription images and PDFs and stream the results as
+JSON lines.
+
+    python ocr_batch.py uploads/prescriptions --output ocr_results.jsonl --workers 8
+
+Sources are directories (searched recursively), files, or with
+--file-list a text file of paths. Each result is written as one line
+{"path": ..., "success": ..., "text": ..., "extracted_data": ...} as soon
+as it completes. Re-running with the same --output skips paths already
+recorded there, so an interrupted run continues where it stopped.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from image_preprocessing import ImagePreprocessor
+from ocr_cache import OCRCache
+from ocr_processor import OCRProcessor
+
+DOCUMENT_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.tif', '.tiff', '.bmp', '.pdf')
+
+# One processor per worker process, created by _init_worker
+_processor = None
+
+
+def _init_worker(engine, preprocess, cache_path):
+    global _processor
+    cache = OCRCache(cache_path) if cache_path else None
+    preprocessor = ImagePreprocessor() if preprocess else None
+    _processor = OCRProcessor(cache=cache, preprocessor=preprocessor, engine=engine)
+
+
+def _process(path):
+    return _processor.process_document(path)
+
+
+def iter_inputs(sources, file_list=None):
+    """
+    Yield the document paths under `sources` and listed in `file_list`
+    """
+    for source in sources:
+        if os.path.isdir(source):
+            for directory, subdirectories, filenames in os.walk(source):
+                subdirectories.sort()
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(DOCUMENT_EXTENSIONS):
+                        yield os.path.normpath(os.path.join(directory, filename))
+        else:
+            yield os.path.normpath(source)
+    if file_list:
+        with open(file_list) as f:
+            for line in f:
+                if line.strip():
+                    yield os.path.normpath(line.strip())
+
+
+def load_completed(output_path, retry_failed=False):
+    """
+    Return the paths recorded in an existing output file. A final line cut
+    off by an interruption is removed so appending continues cleanly.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'rb+') as f:
+        valid_length = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            valid_length += len(line)
+            if record.get('success') or not retry_failed:
+                completed.add(record['path'])
+        f.truncate(valid_length)
+    return completed
+
+
+def run_batch(paths, workers, initargs=('pytesseract', True, None), max_in_flight=None):
+    """
+    OCR `paths` across `workers` processes and yield a result dict per
+    path as it completes. Paths are consumed lazily with at most
+    `max_in_flight` submitted at a time.
+    """
+    max_in_flight = max_in_flight or workers * 4
+    paths = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        pending = {}
+        while True:
+            for path in paths:
+                pending[executor.submit(_process, path)] = path
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+                yield dict(path=path, **result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('sources', nargs='*', help='files or directories to process')
+    parser.add_argument('--file-list', help='text file with one path per line')
+    parser.add_argument('--output', help='JSONL file to append results to (default stdout)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--engine', choices=['pytesseract', 'tesserocr'], default='pytesseract',
+                        help='tesserocr is faster but must be installed separately')
+    parser.add_argument('--no-preprocess', action='store_true', help='OCR images as they are')
+    parser.add_argument('--cache', help='OCRCache database to read and fill')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='process paths again whose recorded result failed')
+    args = parser.parse_args(argv)
+    if not args.sources and not args.file_list:
+        parser.error('no sources given')
+
+    completed = load_completed(args.output, args.retry_failed) if args.output else set()
+    if completed:
+        print(f"Resuming: skipping {len(completed)} completed paths", file=sys.stderr)
+    paths = (path for path in iter_inputs(args.sources, args.file_list) if path not in completed)
+
+    output = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+    processed = failed = 0
+    started = time.time()
+    try:
+        for result in run_batch(paths, args.workers,
+                                (args.engine, not args.no_preprocess, args.cache)):
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            processed += 1
+            failed += not result['success']
+            if processed % 100 == 0:
+                print(f"{processed} processed ({failed} failed), "
+                      f"{processed / (time.time() - started):.1f}/s", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Done: {processed} processed, {failed} failed", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
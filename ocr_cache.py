@@ -0,0 +1,164 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class OCRCache:
+    # Hit/miss counters and access times are kept in memory and written
+    # after this many lookups or seconds, so a lookup stays a read
+    FLUSH_LOOKUPS = 100
+    FLUSH_INTERVAL = 10
+
+    def __init__(self, db_path='ocr_cache.db', max_bytes=64 * 1024 * 1024):
+        """
+        Persistent cache of OCR results keyed on a hash of the image bytes
+        and OCR settings, evicting least recently used entries once the
+        stored results exceed `max_bytes`
+        """
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.lock = threading.Lock()
+        self._counts = {'hits': 0, 'misses': 0}
+        self._accessed = {}
+        self.flushed_at = time.time()
+
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS ocr_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_ocr_cache_last_access ON ocr_cache (last_access);
+            CREATE TABLE IF NOT EXISTS ocr_cache_stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO ocr_cache_stats VALUES
+                ('hits', 0), ('misses', 0), ('evictions', 0), ('bytes', 0);
+        ''')
+
+    def _connection(self):
+        # SQLite connections cannot be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            # Commits in WAL mode stay durable against crashes of the
+            # process without an fsync each
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def key(image_bytes, settings):
+        """
+        Return the cache key of an image under the given OCR settings
+        """
+        digest = hashlib.sha256(image_bytes)
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached result for `key`, or None
+        """
+        row = self._connection().execute('SELECT result FROM ocr_cache WHERE key = ?', (key,)).fetchone()
+        with self.lock:
+            if row is None:
+                self._counts['misses'] += 1
+            else:
+                self._counts['hits'] += 1
+                self._accessed[key] = time.time()
+            due = (sum(self._counts.values()) >= self.FLUSH_LOOKUPS
+                   or time.time() - self.flushed_at >= self.FLUSH_INTERVAL)
+        if due:
+            self.flush()
+        return None if row is None else json.loads(row[0])
+
+    def flush(self):
+        """
+        Write the counters and access times batched in memory since the
+        last flush. They only feed stats() and eviction order, so they are
+        dropped if the database is busy.
+        """
+        with self.lock:
+            counts, accessed = self._counts, self._accessed
+            self._counts = {'hits': 0, 'misses': 0}
+            self._accessed = {}
+            self.flushed_at = time.time()
+        if not accessed and not any(counts.values()):
+            return
+        connection = self._connection()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany('UPDATE ocr_cache_stats SET value = value + ? WHERE name = ?',
+                                       [(count, name) for name, count in counts.items()])
+                connection.executemany('UPDATE ocr_cache SET last_access = MAX(last_access, ?) WHERE key = ?',
+                                       [(accessed_at, key) for key, accessed_at in accessed.items()])
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.OperationalError as e:
+            print(f"Error flushing OCR cache stats: {str(e)}")
+
+    def put(self, key, result):
+        """
+        Store a result and evict old entries beyond the size limit
+        """
+        # Pending access times decide what is evicted
+        self.flush()
+        connection = self._connection()
+        payload = json.dumps(result)
+        size = len(payload)
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            previous = connection.execute('SELECT size FROM ocr_cache WHERE key = ?', (key,)).fetchone()
+            connection.execute(
+                'INSERT OR REPLACE INTO ocr_cache (key, result, size, last_access) VALUES (?, ?, ?, ?)',
+                (key, payload, size, time.time())
+            )
+            connection.execute(
+                "UPDATE ocr_cache_stats SET value = value + ? WHERE name = 'bytes'",
+                (size - (previous[0] if previous else 0),)
+            )
+            self._evict(connection)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _evict(self, connection):
+        total = connection.execute("SELECT value FROM ocr_cache_stats WHERE name = 'bytes'").fetchone()[0]
+        evicted = 0
+        freed = 0
+        oldest = connection.execute('SELECT key, size FROM ocr_cache ORDER BY last_access')
+        for key, size in oldest:
+            if total - freed <= self.max_bytes:
+                break
+            freed += size
+            evicted += 1
+            connection.execute('DELETE FROM ocr_cache WHERE key = ?', (key,))
+        if evicted:
+            connection.execute(
+                "UPDATE ocr_cache_stats SET value = value - ? WHERE name = 'bytes'", (freed,))
+            connection.execute(
+                "UPDATE ocr_cache_stats SET value = value + ? WHERE name = 'evictions'", (evicted,))
+
+    def stats(self):
+        """
+        Return hit/miss/eviction counters, stored bytes, entries and hit rate
+        """
+        self.flush()
+        connection = self._connection()
+        stats = dict(connection.execute('SELECT name, value FROM ocr_cache_stats').fetchall())
+        stats['entries'] = connection.execute('SELECT COUNT(*) FROM ocr_cache').fetchone()[0]
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
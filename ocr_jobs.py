@@ -0,0 +1,155 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from image_preprocessing import ImagePreprocessor
+from ocr_cache import OCRCache
+from ocr_processor import OCRProcessor, file_digest, is_pdf, pdf_page_count
+
+# One processor per worker process, created on its first job
+_processor = None
+
+
+def _cache_path():
+    # Empty to run the workers without a cache
+    return os.getenv('OCR_CACHE_PATH', 'ocr_cache.db')
+
+
+def _get_processor():
+    global _processor
+    if _processor is None:
+        cache = None
+        cache_path = _cache_path()
+        if cache_path:
+            cache = OCRCache(cache_path, max_bytes=int(os.getenv('OCR_CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+        preprocessor = ImagePreprocessor() if os.getenv('OCR_PREPROCESS', '1') != '0' else None
+        _processor = OCRProcessor(cache=cache, preprocessor=preprocessor,
+                                  engine=os.getenv('OCR_ENGINE', 'pytesseract'))
+    return _processor
+
+
+def _run_ocr(image_path):
+    return _get_processor().process_image(image_path)
+
+
+def _run_ocr_pdf_page(pdf_path, page_number, digest=None):
+    return _get_processor().process_pdf_page(pdf_path, page_number, digest)
+
+
+def _combine_pages(page_results):
+    return _get_processor().combine_pages(page_results)
+
+
+def iter_pdf_pages(executor, pdf_path, max_in_flight, digest=None):
+    """
+    OCR the pages of a PDF on `executor` and yield each page's result as it
+    completes. Each worker rasterizes only its own page, and at most
+    `max_in_flight` pages are submitted at a time, so memory does not grow
+    with the page count. `digest` is the PDF's file_digest, passed to every
+    page for its cache lookup.
+    """
+    pages = iter(range(1, pdf_page_count(pdf_path) + 1))
+    pending = set()
+    for page_number in pages:
+        pending.add(executor.submit(_run_ocr_pdf_page, pdf_path, page_number, digest))
+        if len(pending) >= max_in_flight:
+            break
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            for page_number in pages:
+                pending.add(executor.submit(_run_ocr_pdf_page, pdf_path, page_number, digest))
+                break
+            yield future.result()
+
+
+def available_cores():
+    """
+    Return the number of cores this process may run on
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class OCRJobQueue:
+    def __init__(self, on_complete, max_workers=None, start_method=None, logger=None, max_pdf_jobs=2):
+        """
+        Run OCR jobs on a process pool off the request path.
+        `on_complete(job_id, result)` is called with the process_image
+        result when a job finishes. The pages of a PDF are spread across
+        the pool, coordinated by at most `max_pdf_jobs` threads; further
+        PDFs wait their turn.
+        `start_method` is the multiprocessing start method of the workers,
+        by default the platform's; 'forkserver' or 'spawn' keep them from
+        inheriting the state of a monkey-patched web worker.
+        """
+        self.on_complete = on_complete
+        self.max_workers = max_workers or available_cores()
+        self.start_method = start_method
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_pdf_jobs = max_pdf_jobs
+        self.executor = None
+        self.pdf_executor = None
+        self.lock = threading.Lock()
+
+    def _executor(self):
+        # Started lazily so importing the app does not fork workers
+        with self.lock:
+            if self.executor is None:
+                context = multiprocessing.get_context(self.start_method) if self.start_method else None
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self.executor
+
+    def _pdf_executor(self):
+        with self.lock:
+            if self.pdf_executor is None:
+                self.pdf_executor = ThreadPoolExecutor(max_workers=self.max_pdf_jobs,
+                                                       thread_name_prefix='ocr-pdf')
+            return self.pdf_executor
+
+    def submit(self, job_id, image_path):
+        """
+        Queue an image or PDF for OCR and return the job's future
+        """
+        if is_pdf(image_path):
+            future = self._pdf_executor().submit(self._run_pdf, image_path)
+        else:
+            future = self._executor().submit(_run_ocr, image_path)
+        future.add_done_callback(lambda done: self._complete(job_id, done))
+        return future
+
+    def _run_pdf(self, pdf_path):
+        executor = self._executor()
+        # Hash the document once here rather than once per page, and only
+        # when the workers have a cache to look it up in
+        digest = file_digest(pdf_path) if _cache_path() else None
+        pages = list(iter_pdf_pages(executor, pdf_path, self.max_workers, digest))
+        return executor.submit(_combine_pages, pages).result()
+
+    def _complete(self, job_id, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        try:
+            self.on_complete(job_id, result)
+        except Exception as e:
+            self.logger.error("Error storing OCR result for job %s: %s", job_id, e)
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker processes
+        """
+        # PDF jobs take the lock to reach the process pool, so they are
+        # stopped first and outside it
+        with self.lock:
+            pdf_executor, self.pdf_executor = self.pdf_executor, None
+        if pdf_executor is not None:
+            pdf_executor.shutdown(wait=wait)
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=wait)
+                self.executor = None
@@ -1,97 +1,251 @@
+import hashlib
+import io
 import os
+import threading
+import warnings
 from datetime import datetime
 
 import pytesseract
 from PIL import Image
 
+from prescription_extractor import default_extractor
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+try:
+    import pdf2image
+except ImportError:
+    pdf2image = None
+
+# One loaded tesseract engine per process, shared by every OCRProcessor
+# using the tesserocr backend. The engine is not thread-safe.
+_tesserocr_api = None
+_tesserocr_lock = threading.Lock()
+
+
+def _tesserocr_image_to_string(image):
+    global _tesserocr_api
+    with _tesserocr_lock:
+        if _tesserocr_api is None:
+            _tesserocr_api = tesserocr.PyTessBaseAPI()
+        _tesserocr_api.SetImage(image)
+        return _tesserocr_api.GetUTF8Text()
+
+
+def is_pdf(path):
+    return path.lower().endswith('.pdf')
+
+
+def file_digest(path, block_size=1024 * 1024):
+    """
+    Return the sha256 hex digest of a file, read a block at a time
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def pdf_page_count(pdf_path):
+    """
+    Return the number of pages of a PDF without rasterizing it
+    """
+    if pdf2image is None:
+        raise Exception("PDF support requires pdf2image and poppler")
+    return pdf2image.pdfinfo_from_path(pdf_path)['Pages']
+
 
 class OCRProcessor:
-    def __init__(self, tesseract_cmd=None):
+    def __init__(self, tesseract_cmd=None, cache=None, preprocessor=None, engine='pytesseract',
+                 extractor=None, pdf_dpi=300):
+        """
+        `cache` is an optional OCRCache; results are then looked up by a
+        hash of the image bytes and the OCR settings before running OCR.
+        `preprocessor` is an optional ImagePreprocessor applied to each
+        image before OCR.
+        `engine` is 'pytesseract', which runs the tesseract binary per
+        image, or 'tesserocr', which keeps the engine loaded in-process. The
+        optional tesserocr package must be built against the installed
+        tesseract; without it a warning is issued and pytesseract is used.
+        `extractor` turns OCR text into fields and defaults to the shared
+        PrescriptionExtractor over the bundled drug lexicon.
+        `pdf_dpi` is the resolution PDF pages are rasterized at, unless the
+        preprocessor sets a lower target DPI.
+        """
+        if engine not in ('pytesseract', 'tesserocr'):
+            raise ValueError(f"Unknown OCR engine: {engine}")
+        if engine == 'tesserocr' and tesserocr is None:
+            warnings.warn("tesserocr is not installed, falling back to pytesseract", RuntimeWarning)
+            engine = 'pytesseract'
         if tesseract_cmd:
             pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+        self.engine = engine
+        self.cache = cache
+        self.preprocessor = preprocessor
+        self.extractor = extractor or default_extractor()
+        self.pdf_dpi = pdf_dpi
+        self._settings = None
+
+    def cache_settings(self):
+        """
+        Return everything besides the image that affects the OCR result
+        """
+        if self._settings is None:
+            if self.engine == 'tesserocr':
+                version = tesserocr.tesseract_version()
+            else:
+                # Looking up the version runs tesseract, so do it once
+                version = f"{pytesseract.get_tesseract_version()} {pytesseract.pytesseract.tesseract_cmd}"
+            self._settings = {
+                'engine': self.engine,
+                'tesseract': str(version),
+                'preprocessing': self.preprocessor.settings() if self.preprocessor else None,
+                'extractor': self.extractor.fingerprint,
+            }
+        return self._settings
+
+    def image_to_string(self, image):
+        """
+        Run OCR on a PIL image with the configured engine
+        """
+        if self.engine == 'tesserocr':
+            return _tesserocr_image_to_string(image)
+        return pytesseract.image_to_string(image)
 
     def process_image(self, image_path):
         """
         Process an image file and extract text using OCR
         """
         try:
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+
+            key = None
+            if self.cache is not None:
+                key = self.cache.key(image_bytes, self.cache_settings())
+                cached = self.cache.get(key)
+                if cached is not None:
+                    return cached
+
             # Open the image
-            image = Image.open(image_path)
+            image = Image.open(io.BytesIO(image_bytes))
+            if self.preprocessor is not None:
+                image = self.preprocessor.process(image)
             
             # Perform OCR
-            text = pytesseract.image_to_string(image)
+            text = self.image_to_string(image)
             
             # Extract relevant information
             extracted_data = self._extract_prescription_data(text)
             
-            return {
+            result = {
                 'success': True,
                 'text': text,
                 'extracted_data': extracted_data
             }
+            if key is not None:
+                self.cache.put(key, result)
+            return result
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
 
-    def _extract_prescription_data(self, text):
+    def process_pdf_page(self, pdf_path, page_number, digest=None):
         """
-        Extract relevant information from OCR text
+        Rasterize and OCR a single page of a PDF, numbered from 1. Only
+        this page is held in memory. `digest` is the file_digest of the
+        PDF, computed once per document by the caller so pages do not each
+        read the whole file to look up the cache.
+        """
+        try:
+            key = None
+            if self.cache is not None:
+                digest = digest or file_digest(pdf_path)
+                key = self.cache.key(digest.encode(), dict(self.cache_settings(), page=page_number))
+                cached = self.cache.get(key)
+                if cached is not None:
+                    return cached
+
+            if pdf2image is None:
+                raise Exception("PDF support requires pdf2image and poppler")
+            dpi = self.pdf_dpi
+            grayscale = False
+            if self.preprocessor is not None:
+                if self.preprocessor.target_dpi:
+                    dpi = min(dpi, self.preprocessor.target_dpi)
+                grayscale = self.preprocessor.grayscale or self.preprocessor.binarize
+            image = pdf2image.convert_from_path(pdf_path, dpi=dpi, first_page=page_number,
+                                                last_page=page_number, grayscale=grayscale)[0]
+            if self.preprocessor is not None:
+                image = self.preprocessor.process(image)
+
+            result = {
+                'success': True,
+                'page': page_number,
+                'text': self.image_to_string(image)
+            }
+            if key is not None:
+                self.cache.put(key, result)
+            return result
+        except Exception as e:
+            return {
+                'success': False,
+                'page': page_number,
+                'error': str(e)
+            }
+
+    def combine_pages(self, page_results):
         """
-        # This is a basic implementation. In a real application,
-        # you would want to use more sophisticated NLP techniques
-        # or machine learning to extract structured data.
-        
-        extracted_data = {
-            'doctor_name': None,
-            'medications': [],
-            'dosage': [],
-            'frequency': [],
-            'date': None
+        Merge per-page results, in any order, into one process_image style
+        result with the fields extracted from the whole document
+        """
+        pages = sorted(page_results, key=lambda page: page['page'])
+        failed = [page for page in pages if not page['success']]
+        text = '\n\f\n'.join(page.get('text', '') for page in pages if page['success'])
+        result = {
+            'success': not failed,
+            'text': text,
+            'extracted_data': self._extract_prescription_data(text),
+            'pages': len(pages)
         }
+        if failed:
+            result['error'] = '; '.join(f"page {page['page']}: {page['error']}" for page in failed)
+        return result
 
-        # Split text into lines
-        lines = text.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            
-            # Look for doctor's name (assuming it's followed by "MD" or "Dr.")
-            if 'Dr.' in line or 'MD' in line:
-                extracted_data['doctor_name'] = line
-            
-            # Look for medication names (this is a very basic implementation)
-            common_medications = ['amoxicillin', 'ibuprofen', 'aspirin', 'metformin']
-            for med in common_medications:
-                if med.lower() in line.lower():
-                    extracted_data['medications'].append(med)
-            
-            # Look for dosage information
-            if 'mg' in line.lower() or 'ml' in line.lower():
-                extracted_data['dosage'].append(line)
-            
-            # Look for frequency
-            frequency_indicators = ['daily', 'twice', 'three times', 'every']
-            for indicator in frequency_indicators:
-                if indicator in line.lower():
-                    extracted_data['frequency'].append(line)
-            
-            # Look for date
-            try:
-                # Try to parse date in various formats
-                date_formats = ['%m/%d/%Y', '%d/%m/%Y', '%Y-%m-%d']
-                for date_format in date_formats:
-                    try:
-                        date = datetime.strptime(line, date_format)
-                        extracted_data['date'] = date.strftime('%Y-%m-%d')
-                        break
-                    except ValueError:
-                        continue
-            except:
-                pass
-
-        return extracted_data
+    def process_pdf(self, pdf_path):
+        """
+        OCR every page of a PDF one page at a time
+        """
+        try:
+            page_count = pdf_page_count(pdf_path)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+        digest = file_digest(pdf_path) if self.cache is not None else None
+        return self.combine_pages(self.process_pdf_page(pdf_path, page_number, digest)
+                                  for page_number in range(1, page_count + 1))
+
+    def process_document(self, path):
+        """
+        Process an image or a PDF
+        """
+        if is_pdf(path):
+            return self.process_pdf(path)
+        return self.process_image(path)
+
+    def _extract_prescription_data(self, text):
+        """
+        Extract relevant information from OCR text
+        """
+        return self.extractor.extract(text)
 
     def save_processed_image(self, image_path, output_dir):
         """
@@ -117,5 +271,5 @@ class OCRProcessor:
 # Example usage:
 if __name__ == "__main__":
     processor = OCRProcessor()
-    result = processor.process_image("path_to_prescription_image.jpg")
+    result = processor.process_document("path_to_prescription_image.jpg")
     print(result) 
\ No newline at end of file
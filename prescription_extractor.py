@@ -0,0 +1,205 @@
+import hashlib
+import os
+import re
+from datetime import date
+from functools import lru_cache
+
+from fuzzy_index import FuzzyIndex
+
+# Bump when a change to extraction changes its results, so cached OCR
+# results extracted by the old code are not reused
+EXTRACTOR_VERSION = 1
+
+DEFAULT_LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'drug_lexicon.txt')
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+# Each pattern matches whole lines so a single scan of the text finds them all
+DOCTOR_RE = re.compile(r'^.*(?:\bDr\.|\bMD\b).*$', re.MULTILINE)
+DOSAGE_RE = re.compile(r'^.*\d\s*(?:mg|mcg|ml)\b.*$', re.MULTILINE | re.IGNORECASE)
+FREQUENCY_RE = re.compile(
+    r'^.*\b(?:daily|twice|three times|four times|once|every|nightly|weekly|as needed|bid|tid|qid|prn)\b.*$',
+    re.MULTILINE | re.IGNORECASE
+)
+DATE_RE = re.compile(r'\b(?:(\d{4})-(\d{1,2})-(\d{1,2})|(\d{1,2})/(\d{1,2})/(\d{4}))\b')
+
+
+def load_lexicon(path=DEFAULT_LEXICON_PATH):
+    """
+    Read medication names from a text file with one name per line,
+    skipping blank lines and # comments
+    """
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over words rather than characters.
+
+    Scanning is a single pass over the words of a text, so it costs the
+    same for ten names as for a hundred thousand. Transitions live in one
+    dict keyed on (state, word), which keeps a large lexicon of mostly
+    single-word names compact.
+    """
+
+    def __init__(self, phrases):
+        self._goto = {}
+        self._fail = [0]
+        self._output = [()]
+        for phrase in phrases:
+            words = WORD_RE.findall(phrase.lower())
+            if not words:
+                continue
+            state = 0
+            for word in words:
+                following = self._goto.get((state, word))
+                if following is None:
+                    following = len(self._fail)
+                    self._goto[(state, word)] = following
+                    self._fail.append(0)
+                    self._output.append(())
+                state = following
+            self._output[state] = ((len(words), phrase),)
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        children = {}
+        for (state, word), following in self._goto.items():
+            children.setdefault(state, []).append((word, following))
+        queue = [following for _, following in children.get(0, ())]
+        for state in queue:
+            for word, following in children.get(state, ()):
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and (fallback, word) not in self._goto:
+                    fallback = self._fail[fallback]
+                target = self._goto.get((fallback, word), 0)
+                self._fail[following] = target if target != following else 0
+                # A state also ends every phrase its failure state ends
+                self._output[following] = self._output[following] + self._output[self._fail[following]]
+
+    def find(self, text):
+        """
+        Return the phrases found in `text` in order of appearance,
+        preferring the longest phrase where matches overlap
+        """
+        return [phrase for _, _, phrase in self.find_spans(WORD_RE.findall(text.lower()))]
+
+    def find_spans(self, words):
+        """
+        Return (start, end, phrase) for the phrases found in a list of
+        lowercase words, where start and end are word positions
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        matches = []
+        state = 0
+        for position, word in enumerate(words):
+            while state and (state, word) not in goto:
+                state = fail[state]
+            state = goto.get((state, word), 0)
+            for length, phrase in output[state]:
+                matches.append((position - length + 1, -length, phrase))
+
+        spans = []
+        end = 0
+        for start, negative_length, phrase in sorted(matches):
+            if start >= end:
+                end = start - negative_length
+                spans.append((start, end, phrase))
+        return spans
+
+
+def _parse_date(match):
+    year, month, day, first, second, slash_year = match.groups()
+    if year:
+        candidates = [(int(year), int(month), int(day))]
+    else:
+        # Month first, then day first, as for the formats accepted before
+        candidates = [(int(slash_year), int(first), int(second)),
+                      (int(slash_year), int(second), int(first))]
+    for candidate in candidates:
+        try:
+            return date(*candidate).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+class PrescriptionExtractor:
+    def __init__(self, lexicon, fuzzy=True, fuzzy_min_score=0.75):
+        """
+        Extract doctor, medications, dosage, frequency and date from OCR
+        text using a PhraseMatcher built over the `lexicon` of medication
+        names and precompiled regular expressions. With `fuzzy`, words that
+        match no name exactly are looked up in a FuzzyIndex of the
+        single-word names to catch OCR misreadings.
+        """
+        self.matcher = PhraseMatcher(lexicon)
+        self.lexicon_words = set(WORD_RE.findall(' '.join(lexicon).lower()))
+        self.fuzzy_index = None
+        if fuzzy:
+            self.fuzzy_index = FuzzyIndex(name for name in lexicon if len(WORD_RE.findall(name.lower())) == 1)
+        self.fuzzy_min_score = fuzzy_min_score
+        # Identifies the extractor code, settings and lexicon in OCR cache keys
+        settings = [EXTRACTOR_VERSION, fuzzy_min_score]
+        if self.fuzzy_index is not None:
+            settings += [self.fuzzy_index.max_distance, self.fuzzy_index.min_length]
+        digest = hashlib.sha256(repr(settings).encode())
+        digest.update('\n'.join(lexicon).encode())
+        self.fingerprint = digest.hexdigest()[:16]
+
+    def extract(self, text):
+        """
+        Return the fields found in `text`
+        """
+        extracted_data = {
+            'doctor_name': None,
+            'medications': [],
+            'dosage': [],
+            'frequency': [],
+            'date': None
+        }
+
+        # Each name once, in order of first appearance
+        extracted_data['medications'] = list(dict.fromkeys(self._find_medications(text)))
+
+        doctor_lines = DOCTOR_RE.findall(text)
+        if doctor_lines:
+            extracted_data['doctor_name'] = doctor_lines[-1].strip()
+        extracted_data['dosage'] = [line.strip() for line in DOSAGE_RE.findall(text)]
+        extracted_data['frequency'] = [line.strip() for line in FREQUENCY_RE.findall(text)]
+        for match in DATE_RE.finditer(text):
+            parsed = _parse_date(match)
+            if parsed:
+                extracted_data['date'] = parsed
+
+        return extracted_data
+
+    def _find_medications(self, text):
+        words = WORD_RE.findall(text.lower())
+        spans = self.matcher.find_spans(words)
+        if self.fuzzy_index is None:
+            return [phrase for _, _, phrase in spans]
+
+        found = [(start, phrase) for start, _, phrase in spans]
+        covered = set()
+        for start, end, _ in spans:
+            covered.update(range(start, end))
+        for position, word in enumerate(words):
+            if position in covered or word in self.lexicon_words or not word[0].isalpha():
+                continue
+            best = self.fuzzy_index.lookup(word, 1)
+            if best and best[0][1] >= self.fuzzy_min_score:
+                found.append((position, best[0][0]))
+        found.sort()
+        return [phrase for _, phrase in found]
+
+
+@lru_cache(maxsize=None)
+def default_extractor():
+    """
+    Return the process-wide extractor over the bundled drug lexicon
+    """
+    return PrescriptionExtractor(load_lexicon(os.getenv('DRUG_LEXICON_PATH', DEFAULT_LEXICON_PATH)))
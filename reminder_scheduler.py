@@ -0,0 +1,137 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class ReminderScheduler:
+    """
+    Min-heap of keys ordered by their next fire time.
+
+    Adding, updating and cancelling a key is O(log N). Cancelled and
+    superseded heap entries are skipped lazily when they reach the top and
+    compacted away once they outnumber the live ones.
+    """
+
+    # Upper bound on a single sleep so wall clock changes are picked up
+    MAX_WAIT = 60
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._stale = 0
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def schedule(self, key, fire_at):
+        """
+        Schedule `key` to fire at the epoch time `fire_at`, replacing any
+        earlier schedule for the same key
+        """
+        with self._condition:
+            if key in self._entries:
+                self._stale += 1
+            seq = next(self._counter)
+            self._entries[key] = seq
+            heapq.heappush(self._heap, (fire_at, seq, key))
+            self._compact()
+            # Wake the waiting thread if this is now the earliest entry
+            if self._heap[0][1] == seq:
+                self._condition.notify_all()
+
+    def schedule_many(self, items):
+        """
+        Schedule many (key, fire_at) pairs at once in O(N) with one heapify
+        """
+        with self._condition:
+            for key, fire_at in items:
+                if key in self._entries:
+                    self._stale += 1
+                seq = next(self._counter)
+                self._entries[key] = seq
+                self._heap.append((fire_at, seq, key))
+            heapq.heapify(self._heap)
+            self._compact()
+            self._condition.notify_all()
+
+    def cancel(self, key):
+        """
+        Cancel the schedule of `key`
+        """
+        with self._condition:
+            if self._entries.pop(key, None) is None:
+                return False
+            self._stale += 1
+            self._compact()
+            return True
+
+    def next_fire_time(self):
+        """
+        Return the fire time of the earliest live entry, or None
+        """
+        with self._condition:
+            self._drop_stale_top()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """
+        Remove and return every (key, fire_at) due at `now`, earliest first
+        """
+        now = self.clock() if now is None else now
+        due = []
+        with self._condition:
+            while self._heap:
+                fire_at, seq, key = self._heap[0]
+                if self._entries.get(key) != seq:
+                    heapq.heappop(self._heap)
+                    self._stale -= 1
+                    continue
+                if fire_at > now:
+                    break
+                heapq.heappop(self._heap)
+                del self._entries[key]
+                due.append((key, fire_at))
+        return due
+
+    def wait_due(self, should_stop):
+        """
+        Block until at least one entry is due or `should_stop()` is true,
+        then return the due batch
+        """
+        with self._condition:
+            while not should_stop():
+                self._drop_stale_top()
+                now = self.clock()
+                if self._heap and self._heap[0][0] <= now:
+                    break
+                timeout = self.MAX_WAIT
+                if self._heap:
+                    timeout = min(self._heap[0][0] - now, timeout)
+                self._condition.wait(timeout)
+        return self.pop_due() if not should_stop() else []
+
+    def wake(self):
+        """
+        Wake any thread blocked in wait_due
+        """
+        with self._condition:
+            self._condition.notify_all()
+
+    def _drop_stale_top(self):
+        while self._heap and self._entries.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+            self._stale -= 1
+
+    def _compact(self):
+        if self._stale > 1024 and self._stale > len(self._entries):
+            self._heap = [entry for entry in self._heap
+                          if self._entries.get(entry[2]) == entry[1]]
+            heapq.heapify(self._heap)
+            self._stale = 0
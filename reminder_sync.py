@@ -0,0 +1,132 @@
+import time
+from datetime import datetime, timedelta
+
+from app import (Medication, MedicationTombstone, app, claim_notifications, db,
+                 load_device_tokens, prune_device_tokens)
+from device_registry import DeviceTokenRegistry
+from reminder_system import ReminderSystem
+
+
+class ReminderSync:
+    # Re-read rows this far behind the watermark, so a change committed
+    # with a slightly older updated_at is not missed. Applying a row twice
+    # is harmless.
+    OVERLAP = timedelta(seconds=5)
+    # Tombstones are kept this long, far beyond the interval of any sync
+    # process, so every ReminderSync has applied them before they go
+    TOMBSTONE_RETENTION = timedelta(days=1)
+
+    def __init__(self, reminder_system, chunk_size=10000):
+        """
+        Keep a ReminderSystem in step with the Medication table
+        """
+        self.reminder_system = reminder_system
+        self.chunk_size = chunk_size
+        self.watermark = None
+        self.tombstone_watermark = 0
+
+    def _rows(self, statement):
+        """
+        Stream (user_id, medication_id, name, dosage, frequency, 'HH:MM')
+        rows from the database in chunks
+        """
+        result = db.session.execute(statement.execution_options(yield_per=self.chunk_size))
+        for user_id, medication_id, name, dosage, frequency, reminder_time in result:
+            # reminder_time is read as text ('HH:MM:SS...') to skip
+            # building a time object per row only to format it again
+            yield (user_id, medication_id, name, dosage, frequency,
+                   reminder_time[:5] if reminder_time else None)
+
+    def _select(self):
+        return db.select(
+            Medication.user_id,
+            Medication.id,
+            Medication.name,
+            Medication.dosage,
+            Medication.frequency,
+            db.cast(Medication.reminder_time, db.String)
+        )
+
+    def load_all(self):
+        """
+        Load every medication with a reminder time into the reminder system
+        """
+        with app.app_context():
+            started = datetime.utcnow()
+            self.tombstone_watermark = db.session.query(
+                db.func.coalesce(db.func.max(MedicationTombstone.id), 0)).scalar()
+            statement = self._select().where(Medication.reminder_time.isnot(None))
+            count = self.reminder_system.add_reminders(self._rows(statement))
+            self.watermark = started - self.OVERLAP
+            return count
+
+    def sync(self):
+        """
+        Apply medications changed or deleted since the last sync
+        """
+        if self.watermark is None:
+            return self.load_all()
+        
+        with app.app_context():
+            started = datetime.utcnow()
+            applied = 0
+            
+            # Deletions first, so a reused id is re-added by the changes below
+            tombstones = MedicationTombstone.query.filter(
+                MedicationTombstone.id > self.tombstone_watermark
+            ).order_by(MedicationTombstone.id)
+            for tombstone in tombstones:
+                self.reminder_system.remove_reminder(tombstone.medication_id)
+                self.tombstone_watermark = tombstone.id
+                applied += 1
+            MedicationTombstone.query.filter(
+                MedicationTombstone.id <= self.tombstone_watermark,
+                MedicationTombstone.deleted_at < started - self.TOMBSTONE_RETENTION
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            
+            changed = self._select().where(Medication.updated_at >= self.watermark)
+            for row in self._rows(changed):
+                if row[5] is None:
+                    self.reminder_system.remove_reminder(row[1])
+                else:
+                    self.reminder_system.add_reminder(*row)
+                applied += 1
+            
+            self.watermark = started - self.OVERLAP
+            return applied
+
+    def run(self, interval=30):
+        """
+        Load all reminders, start the reminder system and keep it in sync
+        """
+        loaded = self.load_all()
+        print(f"Loaded {loaded} reminders")
+        self.reminder_system.start()
+        try:
+            while True:
+                time.sleep(interval)
+                self.sync()
+        finally:
+            self.reminder_system.stop()
+
+def claim_push(occurrences):
+    """
+    Claim push notifications for (medication_id, scheduled_for) occurrences
+    in the shared ledger and return those won, so running several
+    scheduler processes does not notify a dose twice
+    """
+    with app.app_context():
+        return claim_notifications(occurrences, 'push')
+
+def load_tokens(user_ids):
+    with app.app_context():
+        return load_device_tokens(user_ids)
+
+def prune_tokens(tokens):
+    with app.app_context():
+        prune_device_tokens(tokens)
+
+if __name__ == "__main__":
+    registry = DeviceTokenRegistry(load_tokens, prune_tokens)
+    ReminderSync(ReminderSystem(claim=claim_push, token_registry=registry)).run()
@@ -1,19 +1,86 @@
+import bisect
+import sys
 import threading
 import time
 from datetime import datetime, timedelta
-
-import schedule
+from functools import lru_cache
 
 from firebase_handler import FirebaseHandler
+from notification_dispatcher import NotificationDispatcher, is_invalid_token_error
+from reminder_scheduler import ReminderScheduler
+
+
+class Reminder:
+    """
+    Compact reminder record. Repeated strings such as medication names and
+    dosages are interned, and dict-style access is kept for callers that
+    treat reminders as dictionaries.
+    """
+    __slots__ = ('user_id', 'medication_id', 'medication_name', 'dosage', 'frequency',
+                 'reminder_time', 'minute_of_day', 'last_notified')
+
+    def __init__(self, user_id, medication_id, medication_name, dosage, frequency,
+                 reminder_time, minute_of_day, last_notified=None):
+        self.user_id = user_id
+        self.medication_id = medication_id
+        self.medication_name = _intern(medication_name)
+        self.dosage = _intern(dosage)
+        self.frequency = _intern(frequency)
+        self.reminder_time = _intern(reminder_time)
+        self.minute_of_day = minute_of_day
+        self.last_notified = last_notified
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, _intern(value))
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __repr__(self):
+        return f"Reminder({self.to_dict()!r})"
+
+    def keys(self):
+        return self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+def _intern(value):
+    return sys.intern(value) if value.__class__ is str else value
 
 
 class ReminderSystem:
-    def __init__(self, firebase_handler=None):
+    def __init__(self, firebase_handler=None, dispatcher=None, claim=None, token_registry=None):
         """
-        Initialize the reminder system
+        Initialize the reminder system. `claim(occurrences)`, if given, is
+        asked once per batch of co-due reminders with their
+        (medication_id, UTC datetime) occurrences, and returns the set of
+        those no other process has notified yet, such as
+        app.claim_notifications with a channel.
+        `token_registry` is the DeviceTokenRegistry notifications are
+        addressed from.
         """
         self.firebase_handler = firebase_handler or FirebaseHandler()
+        self.dispatcher = dispatcher or NotificationDispatcher(self.firebase_handler)
+        self.claim = claim
+        self.token_registry = token_registry
         self.reminders = {}
+        # Secondary indexes: user_id -> ([minute_of_day, ...], [medication_id, ...])
+        # kept sorted by minute, and minute_of_day -> {medication_id, ...}
+        self.user_index = {}
+        self.minute_index = {}
+        self.scheduler = ReminderScheduler()
         self.running = False
         self.thread = None
 
@@ -23,18 +90,21 @@ class ReminderSystem:
         """
         try:
             # Create reminder object
-            reminder = {
-                'user_id': user_id,
-                'medication_id': medication_id,
-                'medication_name': medication_name,
-                'dosage': dosage,
-                'frequency': frequency,
-                'reminder_time': reminder_time,
-                'last_notified': None
-            }
+            reminder = Reminder(
+                user_id,
+                medication_id,
+                medication_name,
+                dosage,
+                frequency,
+                reminder_time,
+                self._parse_minute(reminder_time)
+            )
             
             # Store reminder
+            if medication_id in self.reminders:
+                self._unindex(self.reminders[medication_id])
             self.reminders[medication_id] = reminder
+            self._index(reminder)
             
             # Schedule the reminder
             self._schedule_reminder(reminder)
@@ -43,6 +113,41 @@ class ReminderSystem:
         except Exception as e:
             raise Exception(f"Error adding reminder: {str(e)}")
 
+    def add_reminders(self, rows):
+        """
+        Bulk-add reminders from (user_id, medication_id, medication_name,
+        dosage, frequency, reminder_time) rows with a single heapify
+        """
+        try:
+            now = datetime.now()
+            fire_times = {}
+            scheduled = []
+            for user_id, medication_id, medication_name, dosage, frequency, reminder_time in rows:
+                reminder = Reminder(
+                    user_id,
+                    medication_id,
+                    medication_name,
+                    dosage,
+                    frequency,
+                    reminder_time,
+                    self._parse_minute(reminder_time)
+                )
+                if medication_id in self.reminders:
+                    self._unindex(self.reminders[medication_id])
+                self.reminders[medication_id] = reminder
+                self._index(reminder)
+                
+                # At most 1440 distinct fire times, so compute each once
+                fire_at = fire_times.get(reminder.minute_of_day)
+                if fire_at is None:
+                    fire_at = fire_times[reminder.minute_of_day] = self._next_fire_time(reminder, now)
+                scheduled.append((medication_id, fire_at))
+            
+            self.scheduler.schedule_many(scheduled)
+            return len(scheduled)
+        except Exception as e:
+            raise Exception(f"Error adding reminders: {str(e)}")
+
     def remove_reminder(self, medication_id):
         """
         Remove a medication reminder
@@ -50,9 +155,9 @@ class ReminderSystem:
         try:
             if medication_id in self.reminders:
                 # Clear the scheduled job
-                schedule.clear(medication_id)
+                self.scheduler.cancel(medication_id)
                 # Remove from reminders dictionary
-                del self.reminders[medication_id]
+                self._unindex(self.reminders.pop(medication_id))
                 return True
             return False
         except Exception as e:
@@ -64,10 +169,16 @@ class ReminderSystem:
         """
         try:
             if medication_id in self.reminders:
+                reminder = self.reminders[medication_id]
+                minute = self._parse_minute(kwargs.get('reminder_time', reminder.reminder_time))
+                self._unindex(reminder)
+                
                 # Update reminder properties
                 for key, value in kwargs.items():
-                    if key in self.reminders[medication_id]:
-                        self.reminders[medication_id][key] = value
+                    if key in reminder:
+                        reminder[key] = value
+                reminder.minute_of_day = minute
+                self._index(reminder)
                 
                 # Reschedule the reminder
                 self._schedule_reminder(self.reminders[medication_id])
@@ -76,27 +187,110 @@ class ReminderSystem:
         except Exception as e:
             raise Exception(f"Error updating reminder: {str(e)}")
 
+    @staticmethod
+    @lru_cache(maxsize=2048)
+    def _parse_minute(reminder_time):
+        """
+        Convert an 'HH:MM' reminder time to minutes since midnight
+        """
+        parsed = datetime.strptime(reminder_time, '%H:%M')
+        return parsed.hour * 60 + parsed.minute
+
+    def _index(self, reminder):
+        """
+        Add a reminder to the per-user and per-minute indexes
+        """
+        minute = reminder.minute_of_day
+        minutes, ids = self.user_index.setdefault(reminder.user_id, ([], []))
+        position = bisect.bisect_right(minutes, minute)
+        minutes.insert(position, minute)
+        ids.insert(position, reminder.medication_id)
+        self.minute_index.setdefault(minute, set()).add(reminder.medication_id)
+
+    def _unindex(self, reminder):
+        """
+        Remove a reminder from the per-user and per-minute indexes
+        """
+        minute = reminder.minute_of_day
+        minutes, ids = self.user_index[reminder.user_id]
+        position = bisect.bisect_left(minutes, minute)
+        while ids[position] != reminder.medication_id:
+            position += 1
+        del minutes[position]
+        del ids[position]
+        if not ids:
+            del self.user_index[reminder.user_id]
+        
+        medication_ids = self.minute_index[minute]
+        medication_ids.discard(reminder.medication_id)
+        if not medication_ids:
+            del self.minute_index[minute]
+
     def _schedule_reminder(self, reminder):
         """
-        Schedule a reminder using the schedule library
+        Schedule the next occurrence of a reminder
         """
-        def notify():
-            # Get user's notification token from database
-            # This is a placeholder - you would need to implement this
-            user_token = "user_notification_token"
-            
-            # Send notification
-            self.firebase_handler.send_notification(
-                user_token,
-                "Medication Reminder",
-                f"Time to take {reminder['medication_name']} - {reminder['dosage']}"
-            )
+        self.scheduler.schedule(reminder.medication_id, self._next_fire_time(reminder))
+
+    def _next_fire_time(self, reminder, after=None):
+        """
+        Return the epoch time of the next daily occurrence of a reminder
+        """
+        after = after or datetime.now()
+        fire_at = datetime.combine(after.date(), datetime.min.time()) + timedelta(
+            minutes=reminder.minute_of_day)
+        if fire_at <= after:
+            fire_at += timedelta(days=1)
+        return fire_at.timestamp()
+
+    def _notifications(self, reminders):
+        """
+        Build (token, title, body, data) push notifications for every device
+        of the reminders' users
+        """
+        if self.token_registry is None:
+            return []
+        tokens = self.token_registry.tokens_for_users({reminder.user_id for reminder in reminders})
+        return [
+            (token,
+             "Medication Reminder",
+             f"Time to take {reminder.medication_name} - {reminder.dosage}",
+             None)
+            for reminder in reminders
+            for token in tokens.get(reminder.user_id, ())
+        ]
+
+    def _fire(self, due):
+        """
+        Notify a batch of co-due reminders and schedule their next occurrence
+        """
+        due = [(self.reminders[medication_id], fire_at) for medication_id, fire_at in due
+               if medication_id in self.reminders]
+        claimed = []
+        try:
+            occurrences = {(reminder.medication_id, datetime.utcfromtimestamp(fire_at)): reminder
+                           for reminder, fire_at in due}
+            won = occurrences if self.claim is None else self.claim(list(occurrences))
+            claimed = [reminder for occurrence, reminder in occurrences.items() if occurrence in won]
+            result = self.dispatcher.dispatch(self._notifications(claimed))
+            for token, error in result.failures:
+                print(f"Error sending reminder to {token}: {str(error)}")
             
-            # Update last notified time
-            reminder['last_notified'] = datetime.now()
+            # Forget tokens of uninstalled apps so fan-out does not keep growing
+            if self.token_registry is not None:
+                self.token_registry.prune(
+                    token for token, error in result.failures if is_invalid_token_error(error)
+                )
+        except Exception as e:
+            print(f"Error sending reminders: {str(e)}")
         
-        # Schedule the reminder
-        schedule.every().day.at(reminder['reminder_time']).do(notify).tag(reminder['medication_id'])
+        # Update last notified time
+        notified_at = datetime.now()
+        for reminder in claimed:
+            reminder.last_notified = notified_at
+        
+        for reminder, _ in due:
+            self._schedule_reminder(reminder)
 
     def start(self):
         """
@@ -113,47 +307,48 @@ class ReminderSystem:
         Stop the reminder system
         """
         self.running = False
+        self.scheduler.wake()
         if self.thread:
             self.thread.join()
 
     def _run_scheduler(self):
         """
-        Run the scheduler loop
+        Run the scheduler loop, sleeping until the next reminder is due
         """
         while self.running:
-            schedule.run_pending()
-            time.sleep(1)
+            due = self.scheduler.wait_due(lambda: not self.running)
+            if due:
+                self._fire(due)
 
     def get_reminders(self, user_id=None):
         """
         Get all reminders or reminders for a specific user
         """
         if user_id:
-            return {k: v for k, v in self.reminders.items() if v['user_id'] == user_id}
+            _, ids = self.user_index.get(user_id, ([], []))
+            return {medication_id: self.reminders[medication_id] for medication_id in ids}
         return self.reminders
 
+    def get_reminders_at(self, minute_of_day):
+        """
+        Get all reminders scheduled at a minute of the day
+        """
+        return [self.reminders[medication_id]
+                for medication_id in self.minute_index.get(minute_of_day, ())]
+
     def get_next_reminder(self, user_id):
         """
         Get the next upcoming reminder for a user
         """
-        user_reminders = self.get_reminders(user_id)
-        if not user_reminders:
+        if user_id not in self.user_index:
             return None
         
         now = datetime.now()
-        next_reminder = None
-        next_time = None
-        
-        for reminder in user_reminders.values():
-            reminder_time = datetime.strptime(reminder['reminder_time'], '%H:%M').time()
-            reminder_datetime = datetime.combine(now.date(), reminder_time)
-            
-            if reminder_datetime > now:
-                if next_time is None or reminder_datetime < next_time:
-                    next_time = reminder_datetime
-                    next_reminder = reminder
-        
-        return next_reminder
+        minutes, ids = self.user_index[user_id]
+        position = bisect.bisect_right(minutes, now.hour * 60 + now.minute)
+        if position == len(ids):
+            return None
+        return self.reminders[ids[position]]
 
 # Example usage:
 if __name__ == "__main__":
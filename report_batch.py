@@ -0,0 +1,220 @@
+"""
+Render medication and prescription reports for many users in parallel.
+
+    python report_batch.py --all-users --output reports/2024-06 --archive reports/2024-06.zip
+
+Reports are rendered across a pool of worker processes, each with its own
+database connection and ReportGenerator. Files are written to
+<output>/run_<timestamp>_<suffix>/user_<id>/, a directory of their own
+per run, so concurrent runs and users never collide, and can also be
+collected into a single .zip, .tar or .tar.gz archive, or a tar stream on
+stdout with --archive -.
+"""
+import argparse
+import heapq
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+from app import DoseEvent, Medication, Prescription, User, app, db, dose_history, load_adherence
+from report_cache import ReportCache
+from report_generator import ReportGenerator
+
+REPORT_KINDS = ('medication', 'prescription')
+# Dose events read from the database at a time while rendering
+HISTORY_BATCH_ROWS = 1000
+
+# One generator per worker process, created by _init_worker
+_generator = None
+
+
+def _init_worker(output_dir, cache_dir):
+    global _generator
+    # Connections inherited from the parent process must not be reused
+    with app.app_context():
+        db.engine.dispose(close=False)
+    _generator = ReportGenerator(output_dir, cache=ReportCache(cache_dir) if cache_dir else None)
+
+
+def load_report_data(user_id, start_date=None, end_date=None):
+    """
+    Return the user_data, medications and prescriptions of a user in the
+    form ReportGenerator expects, with the doses taken between
+    `start_date` and `end_date` as the medication history and, when both
+    are given, the adherence over that period. The history is an iterator
+    over a database cursor and must be consumed within the app context.
+    """
+    user = db.session.get(User, user_id)
+    if user is None:
+        raise Exception(f"User {user_id} not found")
+
+    medications = []
+    started = []
+    for medication in Medication.query.filter_by(user_id=user_id).order_by(Medication.start_date):
+        medications.append({
+            'name': medication.name,
+            'dosage': medication.dosage,
+            'frequency': medication.frequency,
+            'start_date': medication.start_date
+        })
+        if medication.start_date:
+            started.append({'date': medication.start_date, 'medication': medication.name,
+                            'action': 'Started', 'notes': ''})
+    # Doses are streamed from the index already in order, so the history is
+    # never held in memory; it has to be consumed within the app context
+    doses = dose_history(user_id, start_date, end_date).yield_per(HISTORY_BATCH_ROWS)
+    taken = ({'date': taken_at, 'medication': name or 'Deleted medication', 'action': 'Taken', 'notes': ''}
+             for taken_at, scheduled_for, medication_id, name in doses)
+    history = heapq.merge(started, taken, key=lambda entry: entry['date'])
+
+    prescriptions = []
+    for prescription in Prescription.query.filter_by(user_id=user_id).order_by(Prescription.date_prescribed):
+        extracted = json.loads(prescription.ocr_data) if prescription.ocr_data else {}
+        prescriptions.append({
+            'doctor_name': prescription.doctor_name,
+            'date_prescribed': prescription.date_prescribed,
+            'medication': ', '.join(extracted.get('medications', [])),
+            'status': prescription.ocr_status or ''
+        })
+
+    # The history is not part of the report fingerprint, the latest dose is
+    last_dose_id = db.session.query(db.func.max(DoseEvent.id)).filter(DoseEvent.user_id == user_id).scalar()
+    user_data = {'id': user.id, 'name': user.name, 'medication_history': history, 'last_dose_id': last_dose_id}
+    if start_date and end_date:
+        user_data['adherence'] = load_adherence(start_date, end_date, [user_id]).by_medication()
+    return user_data, medications, prescriptions
+
+
+def _render_user(user_id, start_date, end_date, kinds):
+    try:
+        paths = []
+        with app.app_context():
+            user_data, medications, prescriptions = load_report_data(user_id, start_date, end_date)
+            if 'medication' in kinds:
+                paths.append(_generator.generate_medication_report(
+                    user_data, medications, start_date, end_date,
+                    filename=os.path.join(f'user_{user_id}', 'medication_report.pdf')))
+        if 'prescription' in kinds:
+            paths.append(_generator.generate_prescription_report(
+                user_data, prescriptions,
+                filename=os.path.join(f'user_{user_id}', 'prescription_report.pdf')))
+        return {'user_id': user_id, 'success': True, 'paths': paths}
+    except Exception as e:
+        return {'user_id': user_id, 'success': False, 'error': str(e)}
+
+
+def generate_reports(user_ids, output_dir, start_date, end_date, workers=None,
+                     kinds=REPORT_KINDS, progress=None, cache_dir=None):
+    """
+    Render reports for `user_ids` across `workers` processes and yield a
+    {user_id, success, paths or error} dict per user as it completes.
+    The files go to a new run_<timestamp>_<suffix> directory under
+    `output_dir`, so runs sharing `output_dir` never overwrite each other.
+    `progress(done, total, result)` is called after each user. Reports
+    are reused from the ReportCache in `cache_dir` if given.
+    """
+    user_ids = list(user_ids)
+    os.makedirs(output_dir, exist_ok=True)
+    run_dir = tempfile.mkdtemp(prefix=datetime.now().strftime('run_%Y%m%d_%H%M%S_'), dir=output_dir)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(run_dir, cache_dir)) as executor:
+        futures = [executor.submit(_render_user, user_id, start_date, end_date, kinds)
+                   for user_id in user_ids]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            if progress:
+                progress(done, len(user_ids), result)
+            yield result
+
+
+class ReportArchive:
+    def __init__(self, target, output_dir):
+        """
+        Collect report files into a zip or tar archive at `target`, or a
+        tar stream on stdout when `target` is '-'
+        """
+        self.output_dir = output_dir
+        if target == '-':
+            self.archive = tarfile.open(fileobj=sys.stdout.buffer, mode='w|')
+        elif target.endswith('.zip'):
+            self.archive = zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED)
+        elif target.endswith(('.tar.gz', '.tgz')):
+            self.archive = tarfile.open(target, 'w:gz')
+        else:
+            self.archive = tarfile.open(target, 'w')
+
+    def add(self, path):
+        arcname = os.path.relpath(path, self.output_dir)
+        if isinstance(self.archive, zipfile.ZipFile):
+            self.archive.write(path, arcname)
+        else:
+            self.archive.add(path, arcname)
+
+    def close(self):
+        self.archive.close()
+
+
+def _print_progress(started):
+    def progress(done, total, result):
+        rate = done / max(time.time() - started, 1e-9)
+        status = 'ok' if result['success'] else f"failed: {result['error']}"
+        print(f"[{done}/{total}] user {result['user_id']} {status} "
+              f"({rate:.1f} users/s, {(total - done) / rate:.0f}s left)", file=sys.stderr)
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('user_ids', nargs='*', type=int)
+    parser.add_argument('--all-users', action='store_true')
+    parser.add_argument('--output', help='directory for the reports (default: a temporary one with --archive)')
+    parser.add_argument('--archive', help='.zip, .tar or .tar.gz file to collect the reports in, or - for stdout')
+    # Whole days, so repeated runs produce the same report fingerprints
+    today = datetime.combine(date.today(), datetime.min.time())
+    parser.add_argument('--start', type=lambda value: datetime.strptime(value, '%Y-%m-%d'),
+                        default=today - timedelta(days=30))
+    parser.add_argument('--end', type=lambda value: datetime.strptime(value, '%Y-%m-%d'),
+                        default=today + timedelta(days=1))
+    parser.add_argument('--kinds', nargs='+', choices=REPORT_KINDS, default=list(REPORT_KINDS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--cache-dir', help='ReportCache directory to reuse unchanged reports from, '
+                                            "e.g. the app's reports/cache")
+    args = parser.parse_args(argv)
+
+    user_ids = args.user_ids
+    if args.all_users:
+        with app.app_context():
+            user_ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id)]
+            db.engine.dispose()
+    if not user_ids:
+        parser.error('no users given')
+    if not args.output and not args.archive:
+        parser.error('give --output, --archive or both')
+
+    with tempfile.TemporaryDirectory() as scratch:
+        output_dir = args.output or scratch
+        archive = ReportArchive(args.archive, output_dir) if args.archive else None
+        failed = 0
+        try:
+            for result in generate_reports(user_ids, output_dir, args.start, args.end, args.workers,
+                                           args.kinds, progress=_print_progress(time.time()),
+                                           cache_dir=args.cache_dir):
+                failed += not result['success']
+                if archive:
+                    for path in result.get('paths', []):
+                        archive.add(path)
+        finally:
+            if archive:
+                archive.close()
+    print(f"Done: {len(user_ids) - failed} users, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
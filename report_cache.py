@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class ReportCache:
+    def __init__(self, cache_dir=os.path.join('reports', 'cache'), max_bytes=256 * 1024 * 1024):
+        """
+        Store of rendered report files keyed on a fingerprint of their
+        inputs. Entries are indexed per user so they can be invalidated when
+        the user's data changes, and the least recently used files are
+        removed once they take more than `max_bytes`.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _connection(self):
+        # SQLite connections cannot be shared between threads. The cache
+        # directory is only created once the cache is first used.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            connection = sqlite3.connect(os.path.join(self.cache_dir, 'index.db'), timeout=30,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS report_cache (
+                    fingerprint TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_report_cache_user_id ON report_cache (user_id);
+                CREATE INDEX IF NOT EXISTS ix_report_cache_last_access ON report_cache (last_access);
+            ''')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def fingerprint(*inputs):
+        """
+        Return a hash of report inputs; dates and other values are
+        serialized with str()
+        """
+        payload = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, fingerprint):
+        """
+        Return the path of the cached report for `fingerprint`, or None
+        """
+        connection = self._connection()
+        row = connection.execute('SELECT path FROM report_cache WHERE fingerprint = ?',
+                                 (fingerprint,)).fetchone()
+        if row is None:
+            return None
+        if not os.path.exists(row[0]):
+            connection.execute('DELETE FROM report_cache WHERE fingerprint = ?', (fingerprint,))
+            return None
+        connection.execute('UPDATE report_cache SET last_access = ? WHERE fingerprint = ?',
+                           (time.time(), fingerprint))
+        return row[0]
+
+    def put(self, fingerprint, user_id, source_path):
+        """
+        Copy a rendered report into the cache and return the cached path
+        """
+        connection = self._connection()
+        path = os.path.join(self.cache_dir, f'{fingerprint}.pdf')
+        # Copy under a temporary name so readers never see a partial file
+        partial = f'{path}.{uuid.uuid4().hex}.tmp'
+        shutil.copyfile(source_path, partial)
+        os.replace(partial, path)
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'INSERT OR REPLACE INTO report_cache (fingerprint, user_id, path, size, last_access) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (fingerprint, user_id, path, os.path.getsize(path), time.time())
+            )
+            evicted = self._evict(connection, keep=fingerprint)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        self._remove_files(evicted)
+        return path
+
+    def invalidate(self, user_id):
+        """
+        Drop every cached report of a user
+        """
+        if not os.path.exists(os.path.join(self.cache_dir, 'index.db')):
+            # Nothing has been cached yet
+            return
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            paths = [path for path, in connection.execute(
+                'SELECT path FROM report_cache WHERE user_id = ?', (user_id,))]
+            connection.execute('DELETE FROM report_cache WHERE user_id = ?', (user_id,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        self._remove_files(paths)
+
+    def stats(self):
+        """
+        Return the number of cached reports and their total size
+        """
+        entries, total = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM report_cache').fetchone()
+        return {'entries': entries, 'bytes': total}
+
+    def _evict(self, connection, keep):
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM report_cache').fetchone()[0]
+        evicted = []
+        oldest = connection.execute(
+            'SELECT fingerprint, path, size FROM report_cache WHERE fingerprint != ? ORDER BY last_access',
+            (keep,)
+        )
+        for fingerprint, path, size in oldest.fetchall():
+            if total <= self.max_bytes:
+                break
+            total -= size
+            evicted.append(path)
+            connection.execute('DELETE FROM report_cache WHERE fingerprint = ?', (fingerprint,))
+        return evicted
+
+    def _remove_files(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -1,19 +1,130 @@
+import csv
+import itertools
+import json
 import os
-from datetime import datetime, timedelta
+import shutil
+import uuid
+from datetime import date, datetime, time, timedelta
+from xml.sax.saxutils import escape
 
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
-from reportlab.platypus import (Paragraph, SimpleDocTemplate, Spacer, Table,
+from reportlab.platypus import (LongTable, Paragraph, SimpleDocTemplate, Spacer, Table,
                                 TableStyle)
 
+# Bump when the report layout changes so cached reports are not reused
+REPORT_VERSION = 1
+
+# History rows per LongTable, so no single table has to be laid out whole
+HISTORY_CHUNK_ROWS = 500
+
+# Fixed column widths keep the history chunks aligned with each other
+HISTORY_COLUMN_WIDTHS = [70, 120, 80, 198]
+
+HISTORY_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 14),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 12),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+
+# Streamed exports are sent in chunks of about this size
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+class _LineBuffer:
+    """
+    File-like object for csv.writer that returns each formatted row
+    instead of storing it
+    """
+
+    def write(self, value):
+        return value
+
+
+def _export_value(value):
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return value
+
+
+def _chunked(lines, chunk_bytes):
+    # The first line goes out on its own so clients get bytes immediately
+    chunk = []
+    size = 0
+    first = True
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if first or size >= chunk_bytes:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+            first = False
+    if chunk:
+        yield ''.join(chunk)
+
+
+def iter_csv(rows, columns, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """
+    Yield CSV text for `rows` (sequences ordered like `columns`, such as
+    a database cursor) with a header line, consuming the rows lazily
+    """
+    writer = csv.writer(_LineBuffer())
+    lines = itertools.chain(
+        [writer.writerow(columns)],
+        (writer.writerow([_export_value(value) for value in row]) for row in rows)
+    )
+    return _chunked(lines, chunk_bytes)
+
+
+def iter_jsonl(rows, columns, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """
+    Yield one JSON object per row of `rows`, keyed by `columns`,
+    consuming the rows lazily
+    """
+    lines = (json.dumps(dict(zip(columns, [_export_value(value) for value in row]))) + '\n'
+             for row in rows)
+    return _chunked(lines, chunk_bytes)
+
+
+class _LazyStory(list):
+    """
+    Story for doc.build that pulls flowables from an iterator as the
+    document consumes them, so only the next few exist at any time
+    """
+
+    def __init__(self, flowables):
+        super().__init__()
+        self._pending = iter(flowables)
+
+    def __len__(self):
+        # Keep two flowables queued so keepWithNext can look ahead
+        while self._pending is not None and list.__len__(self) < 2:
+            try:
+                self.append(next(self._pending))
+            except StopIteration:
+                self._pending = None
+        return list.__len__(self)
+
 
 class ReportGenerator:
-    def __init__(self, output_dir='reports'):
+    def __init__(self, output_dir='reports', cache=None):
         """
-        Initialize the report generator
+        Initialize the report generator. With a ReportCache, a report whose
+        inputs match an earlier one reuses the earlier file.
         """
         self.output_dir = output_dir
+        self.cache = cache
         self.styles = getSampleStyleSheet()
         
         # Create custom styles
@@ -34,15 +145,71 @@ class ReportGenerator:
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
 
-    def generate_medication_report(self, user_data, medications, start_date, end_date):
+    def _report_path(self, prefix, filename):
         """
-        Generate a PDF report of medication history
+        Return the output path for a report, by default a name unique even
+        across concurrent runs
         """
-        try:
-            # Create filename with timestamp
+        if filename is None:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f'medication_report_{timestamp}.pdf'
-            filepath = os.path.join(self.output_dir, filename)
+            filename = f'{prefix}_{timestamp}_{uuid.uuid4().hex[:8]}.pdf'
+        filepath = os.path.join(self.output_dir, filename)
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        return filepath
+
+    def _cached_report(self, prefix, filename, *inputs):
+        """
+        Return (fingerprint, path) for a report; path is a copy of the
+        cached file in the output directory on a cache hit and None
+        otherwise. The cache's own file can be evicted at any time, so it
+        is never handed out.
+        """
+        if self.cache is None:
+            return None, None
+        fingerprint = self.cache.fingerprint(REPORT_VERSION, prefix, *inputs)
+        cached = self.cache.get(fingerprint)
+        if cached is None:
+            return fingerprint, None
+        filepath = self._report_path(prefix, filename)
+        shutil.copyfile(cached, filepath)
+        return fingerprint, filepath
+
+    def _store_report(self, fingerprint, user_data, filepath):
+        if fingerprint is not None:
+            self.cache.put(fingerprint, user_data.get('id'), filepath)
+
+    def generate_medication_report(self, user_data, medications, start_date, end_date, history=None,
+                                   filename=None, adherence=None):
+        """
+        Generate a PDF report of medication history. `history` is an
+        iterable of {date, medication, action, notes} mappings, such as a
+        database cursor, and defaults to user_data['medication_history'].
+        It is consumed lazily so long histories are never held in memory.
+        `filename` is relative to the output directory.
+        `adherence` is a list of AdherenceResult.by_medication() rows for
+        the period, defaulting to user_data['adherence'], shown as its own
+        section when given.
+        With a cache, a history given as a list is part of the fingerprint;
+        for other iterables the caller invalidates the user's entries when
+        the history changes.
+        """
+        try:
+            if history is None:
+                history = user_data.get('medication_history', [])
+            if adherence is None:
+                adherence = user_data.get('adherence')
+            fingerprint, cached = self._cached_report(
+                'medication_report', filename,
+                {key: value for key, value in user_data.items() if key != 'medication_history'},
+                medications, start_date, end_date,
+                history if isinstance(history, (list, tuple)) else None,
+                adherence
+            )
+            if cached:
+                return cached
+            
+            # Create a unique filename unless one is given
+            filepath = self._report_path('medication_report', filename)
             
             # Create PDF document
             doc = SimpleDocTemplate(
@@ -81,7 +248,7 @@ class ReportGenerator:
                     med['name'],
                     med['dosage'],
                     med['frequency'],
-                    med['start_date'].strftime('%Y-%m-%d')
+                    med['start_date'].strftime('%Y-%m-%d') if med.get('start_date') else ''
                 ])
             
             medication_table = Table(medication_data)
@@ -102,53 +269,93 @@ class ReportGenerator:
             content.append(medication_table)
             content.append(Spacer(1, 20))
             
+            if adherence:
+                content.append(Paragraph("Adherence", self.styles['CustomHeading']))
+                content.append(self._adherence_table(adherence))
+                content.append(Spacer(1, 20))
+            
             # Add medication history
             content.append(Paragraph("Medication History", self.styles['CustomHeading']))
             
-            # Create history table
-            history_data = [['Date', 'Medication', 'Action', 'Notes']]
-            for entry in user_data.get('medication_history', []):
-                if start_date <= entry['date'] <= end_date:
-                    history_data.append([
-                        entry['date'].strftime('%Y-%m-%d'),
-                        entry['medication'],
-                        entry['action'],
-                        entry.get('notes', '')
-                    ])
-            
-            history_table = Table(history_data)
-            history_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 14),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-                ('FONTSIZE', (0, 1), (-1, -1), 12),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            
-            content.append(history_table)
+            history_tables = self._history_tables(history, start_date, end_date)
             
             # Build PDF
-            doc.build(content)
+            doc.build(_LazyStory(itertools.chain(content, history_tables)))
+            self._store_report(fingerprint, user_data, filepath)
             
             return filepath
         except Exception as e:
             raise Exception(f"Error generating report: {str(e)}")
 
-    def generate_prescription_report(self, user_data, prescriptions):
+    def _adherence_table(self, adherence):
+        """
+        Return a table of doses taken, adherence, on-time rate and streaks
+        per medication
+        """
+        def percent(rate):
+            return f"{rate:.0%}" if rate is not None else '-'
+        
+        data = [['Medication', 'Doses Taken', 'Adherence', 'On Time', 'Streak']]
+        for row in adherence:
+            data.append([
+                row.get('name') or '',
+                f"{row['taken']} / {row['scheduled']}",
+                percent(row['rate']),
+                percent(row['on_time_rate']),
+                f"{row['current_streak']} (best {row['longest_streak']})"
+            ])
+        table = Table(data, repeatRows=1)
+        table.setStyle(HISTORY_TABLE_STYLE)
+        return table
+
+    def _history_tables(self, history, start_date, end_date, chunk_rows=HISTORY_CHUNK_ROWS):
         """
-        Generate a PDF report of prescriptions
+        Yield the history entries within the period as LongTables of at
+        most `chunk_rows` rows, each repeating the header on every page
+        """
+        header = ['Date', 'Medication', 'Action', 'Notes']
+        rows = []
+        emitted = False
+        for entry in history:
+            if start_date <= entry['date'] <= end_date:
+                notes = entry.get('notes') or ''
+                if len(notes) > 30:
+                    # Wrap long notes within the fixed column width
+                    notes = Paragraph(escape(notes), self.styles['Normal'])
+                rows.append([
+                    entry['date'].strftime('%Y-%m-%d'),
+                    entry['medication'],
+                    entry['action'],
+                    notes
+                ])
+                if len(rows) == chunk_rows:
+                    yield self._history_table(header, rows)
+                    rows = []
+                    emitted = True
+        if rows or not emitted:
+            yield self._history_table(header, rows)
+
+    def _history_table(self, header, rows):
+        table = LongTable([header] + rows, colWidths=HISTORY_COLUMN_WIDTHS, repeatRows=1)
+        table.setStyle(HISTORY_TABLE_STYLE)
+        return table
+
+    def generate_prescription_report(self, user_data, prescriptions, filename=None):
+        """
+        Generate a PDF report of prescriptions. `filename` is relative to
+        the output directory.
         """
         try:
-            # Create filename with timestamp
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f'prescription_report_{timestamp}.pdf'
-            filepath = os.path.join(self.output_dir, filename)
+            # Only what the report shows, so logging doses does not
+            # invalidate it
+            fingerprint, cached = self._cached_report(
+                'prescription_report', filename, user_data['name'], prescriptions
+            )
+            if cached:
+                return cached
+            
+            # Create a unique filename unless one is given
+            filepath = self._report_path('prescription_report', filename)
             
             # Create PDF document
             doc = SimpleDocTemplate(
@@ -179,7 +386,7 @@ class ReportGenerator:
             for prescription in prescriptions:
                 prescription_data.append([
                     prescription['doctor_name'],
-                    prescription['date_prescribed'].strftime('%Y-%m-%d'),
+                    prescription['date_prescribed'].strftime('%Y-%m-%d') if prescription.get('date_prescribed') else '',
                     prescription['medication'],
                     prescription['status']
                 ])
@@ -203,6 +410,7 @@ class ReportGenerator:
             
             # Build PDF
             doc.build(content)
+            self._store_report(fingerprint, user_data, filepath)
             
             return filepath
         except Exception as e:
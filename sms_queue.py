@@ -0,0 +1,289 @@
+import random
+import sqlite3
+import threading
+import time
+
+
+class TwilioTransport:
+    def __init__(self, client):
+        """
+        Deliver SMS messages through a Twilio REST client
+        """
+        self.client = client
+
+    def send(self, recipient, sender, body):
+        self.client.messages.create(body=body, from_=sender, to=recipient)
+
+
+class SMSQueue:
+    # A claimed message not finished within this many seconds is assumed
+    # lost with its worker and becomes pending again
+    CLAIM_TIMEOUT = 300
+    # Tries at recording the outcome of a send, and the pause between them
+    UPDATE_ATTEMPTS = 5
+    UPDATE_RETRY_DELAY = 1.0
+    # Idle workers purge old sent messages at most this often
+    PURGE_INTERVAL = 3600
+
+    def __init__(self, db_path, transport, workers=4, rate=1.0, burst=1,
+                 max_attempts=5, base_delay=2.0, max_delay=300.0, retention=7 * 24 * 3600):
+        """
+        Durable outbound SMS queue stored in a SQLite table and drained by a
+        pool of worker threads. `transport` is any object with a
+        send(recipient, sender, body) method. `rate` and `burst` limit each
+        sender across every process sharing `db_path`. Sent messages are
+        deleted `retention` seconds after delivery.
+        """
+        self.db_path = db_path
+        self.transport = transport
+        self.workers = workers
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retention = retention
+        self.purged_at = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.threads = []
+        self._local = threading.local()
+
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS sms_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                sender TEXT,
+                body TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                claimed_at REAL,
+                sent_at REAL,
+                last_error TEXT
+            )
+        ''')
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS ix_sms_outbox_due ON sms_outbox (status, next_attempt_at)'
+        )
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS sms_rate_limit (
+                sender TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def _connection(self):
+        # SQLite connections cannot be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def enqueue(self, recipient, body, sender=None):
+        """
+        Queue a message for delivery and return its id
+        """
+        cursor = self._connection().execute(
+            'INSERT INTO sms_outbox (recipient, sender, body, next_attempt_at) VALUES (?, ?, ?, ?)',
+            (recipient, sender, body, time.time())
+        )
+        self.wakeup.set()
+        return cursor.lastrowid
+
+    def start(self):
+        """
+        Start the worker threads
+        """
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run_worker, name=f'sms-worker-{index}')
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def run(self):
+        """
+        Start the worker threads and deliver until interrupted, for a
+        process dedicated to sending
+        """
+        self.start()
+        try:
+            while self.running:
+                time.sleep(1)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Stop the worker threads after their current message
+        """
+        self.running = False
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def stats(self):
+        """
+        Return the number of messages in each status
+        """
+        return dict(self._connection().execute(
+            'SELECT status, COUNT(*) FROM sms_outbox GROUP BY status'
+        ).fetchall())
+
+    def purge(self, now=None):
+        """
+        Delete messages sent more than `retention` seconds ago and return
+        how many were deleted
+        """
+        now = time.time() if now is None else now
+        self.purged_at = now
+        return self._connection().execute(
+            "DELETE FROM sms_outbox WHERE status = 'sent' AND sent_at < ?", (now - self.retention,)
+        ).rowcount
+
+    def _acquire(self, sender):
+        """
+        Block until the sender's token bucket has a token and take it. The
+        buckets are rows of the queue database, so every process sharing it
+        draws from the same limit.
+        """
+        connection = self._connection()
+        while True:
+            now = time.time()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute(
+                    'SELECT tokens, updated_at FROM sms_rate_limit WHERE sender = ?', (sender or '',)
+                ).fetchone()
+                tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+                if tokens >= 1:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO sms_rate_limit (sender, tokens, updated_at) VALUES (?, ?, ?)',
+                        (sender or '', tokens - 1, now)
+                    )
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            if tokens >= 1:
+                return
+            time.sleep((1 - tokens) / self.rate)
+
+    def _claim(self):
+        """
+        Atomically take the oldest due message, or return None
+        """
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                "UPDATE sms_outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+                (now - self.CLAIM_TIMEOUT,)
+            )
+            row = connection.execute(
+                "SELECT id, recipient, sender, body, attempts FROM sms_outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row:
+                connection.execute(
+                    "UPDATE sms_outbox SET status = 'sending', claimed_at = ? WHERE id = ?",
+                    (now, row[0])
+                )
+            connection.execute('COMMIT')
+            return row
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _update(self, message_id, sql, params):
+        """
+        Record the outcome of a send, retrying while the database is
+        locked. A message whose outcome is never recorded is claimed again
+        after CLAIM_TIMEOUT.
+        """
+        for attempt in range(1, self.UPDATE_ATTEMPTS + 1):
+            try:
+                self._connection().execute(sql, params)
+                return
+            except sqlite3.OperationalError as e:
+                print(f"Error updating SMS {message_id} (attempt {attempt}): {str(e)}")
+                if attempt < self.UPDATE_ATTEMPTS:
+                    time.sleep(self.UPDATE_RETRY_DELAY)
+
+    def _deliver(self, message_id, recipient, sender, body, attempts):
+        self._acquire(sender)
+        try:
+            self.transport.send(recipient, sender, body)
+        except Exception as e:
+            attempts += 1
+            if attempts >= self.max_attempts:
+                self._update(
+                    message_id,
+                    "UPDATE sms_outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                    (attempts, str(e), message_id)
+                )
+            else:
+                # Exponential backoff with jitter
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+                self._update(
+                    message_id,
+                    "UPDATE sms_outbox SET status = 'pending', attempts = ?, last_error = ?, "
+                    "next_attempt_at = ? WHERE id = ?",
+                    (attempts, str(e), time.time() + delay * random.uniform(0.5, 1.0), message_id)
+                )
+            print(f"Error sending SMS {message_id} (attempt {attempts}): {str(e)}")
+            return
+        self._update(
+            message_id,
+            "UPDATE sms_outbox SET status = 'sent', attempts = ?, sent_at = ? WHERE id = ?",
+            (attempts + 1, time.time(), message_id)
+        )
+
+    def _idle_wait(self):
+        """
+        Return how long an idle worker should sleep, at most one second
+        """
+        try:
+            next_attempt_at = self._connection().execute(
+                "SELECT MIN(next_attempt_at) FROM sms_outbox WHERE status = 'pending'"
+            ).fetchone()[0]
+        except sqlite3.OperationalError:
+            return 1
+        if next_attempt_at is None:
+            return 1
+        return min(1, max(next_attempt_at - time.time(), 0.01))
+
+    def _run_worker(self):
+        while self.running:
+            try:
+                message = self._claim()
+            except sqlite3.OperationalError as e:
+                print(f"Error claiming SMS: {str(e)}")
+                message = None
+            if message is None:
+                if time.time() - self.purged_at >= self.PURGE_INTERVAL:
+                    try:
+                        self.purge()
+                    except sqlite3.OperationalError as e:
+                        print(f"Error purging sent SMS: {str(e)}")
+                self.wakeup.wait(self._idle_wait())
+                self.wakeup.clear()
+                continue
+            try:
+                self._deliver(*message)
+            except sqlite3.OperationalError as e:
+                # The message stays claimed and is retried after CLAIM_TIMEOUT
+                print(f"Error delivering SMS {message[0]}: {str(e)}")
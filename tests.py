@@ -1,8 +1,38 @@
+import io
+import json
 import os
+import tempfile
+import threading
+import time
 import unittest
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-from app import Medication, Prescription, User, app, db
+from firebase_admin import messaging
+
+from adherence import AdherenceAnalyzer
+from app import (REMINDER_WINDOW, DeviceToken, DoseEvent, Medication, MedicationTombstone,
+                 NotificationLedger, Prescription, User, app, backfill_next_due_at,
+                 claim_notification, claim_notifications, compute_next_due_at, db, dose_history,
+                 due_medications, requeue_stale_ocr_jobs, send_sms_notification, store_ocr_result)
+from device_registry import DeviceTokenRegistry
+from fuzzy_index import FuzzyIndex
+from image_preprocessing import ImagePreprocessor
+from notification_dispatcher import NotificationDispatcher, is_invalid_token_error
+from ocr_batch import main as ocr_batch_main
+from ocr_cache import OCRCache
+from ocr_jobs import OCRJobQueue, iter_pdf_pages
+from ocr_processor import OCRProcessor
+from prescription_extractor import PrescriptionExtractor
+from reminder_scheduler import ReminderScheduler
+from reminder_sync import ReminderSync, claim_push, load_tokens, prune_tokens
+from reminder_system import ReminderSystem
+from report_batch import ReportArchive, generate_reports, load_report_data
+from report_cache import ReportCache
+from report_generator import ReportGenerator, iter_csv
+from sms_queue import SMSQueue
 
 
 class TestMedTrackr(unittest.TestCase):
@@ -28,6 +58,14 @@ class TestMedTrackr(unittest.TestCase):
             
             self.user_id = user.id
 
+    def login(self):
+        """
+        Log the test user in on the test client
+        """
+        with self.app.session_transaction() as session:
+            session['_user_id'] = str(self.user_id)
+            session['_fresh'] = True
+
     def tearDown(self):
         """
         Clean up test environment
@@ -124,5 +162,1182 @@ class TestMedTrackr(unittest.TestCase):
             self.assertEqual(len(user.prescriptions), 1)
             self.assertEqual(user.prescriptions[0].doctor_name, 'Dr. Smith')
 
+    def test_due_reminders(self):
+        """
+        Test that the batch endpoint returns only medications due now
+        """
+        now = datetime.now()
+        with app.app_context():
+            for name, offset in [('Aspirin', timedelta(0)), ('Metformin', timedelta(hours=3))]:
+                reminder_time = (now + offset).replace(second=0, microsecond=0).time()
+                db.session.add(Medication(
+                    user_id=self.user_id, name=name, dosage='100mg', frequency='once',
+                    start_date=now, reminder_time=reminder_time,
+                    next_due_at=compute_next_due_at(reminder_time, now - REMINDER_WINDOW)
+                ))
+            db.session.commit()
+        
+        self.login()
+        response = self.app.get('/reminders/due')
+        data = response.get_json()
+        self.assertTrue(data['success'])
+        self.assertEqual([med['name'] for med in data['medications']], ['Aspirin'])
+        
+        # Taking the dose clears it until the next occurrence
+        self.app.post(f"/medication/{data['medications'][0]['id']}/taken")
+        self.assertEqual(self.app.get('/reminders/due').get_json()['medications'], [])
+
+    def test_early_dose_skips_pending_occurrence(self):
+        """
+        Test that a dose taken shortly before its reminder is not reminded
+        again
+        """
+        now = datetime.now()
+        occurrence = (now + timedelta(minutes=30)).replace(second=0, microsecond=0)
+        with app.app_context():
+            medication = Medication(
+                user_id=self.user_id, name='Aspirin', dosage='100mg', frequency='once',
+                start_date=now, reminder_time=occurrence.time(),
+                next_due_at=compute_next_due_at(occurrence.time(), now - REMINDER_WINDOW)
+            )
+            db.session.add(medication)
+            db.session.commit()
+            medication_id = medication.id
+        
+        self.login()
+        self.assertTrue(self.app.post(f'/medication/{medication_id}/taken').json['success'])
+        with app.app_context():
+            medication = db.session.get(Medication, medication_id)
+            self.assertEqual(medication.next_due_at,
+                             compute_next_due_at(occurrence.time(), occurrence + timedelta(minutes=1)))
+            self.assertEqual(due_medications(self.user_id, occurrence), [])
+
+    def test_due_reminder_across_midnight(self):
+        """
+        Test that a midnight reminder is due a minute before midnight, and
+        that a lapsed dose rolls forward to its next occurrence
+        """
+        before_midnight = datetime(2026, 1, 1, 23, 59, 30)
+        reminder_time = datetime(2026, 1, 2, 0, 0).time()
+        with app.app_context():
+            medication = Medication(
+                user_id=self.user_id, name='Aspirin', dosage='100mg', frequency='once',
+                start_date=before_midnight, reminder_time=reminder_time,
+                next_due_at=compute_next_due_at(reminder_time, before_midnight - REMINDER_WINDOW)
+            )
+            db.session.add(medication)
+            db.session.commit()
+            
+            self.assertEqual(due_medications(self.user_id, before_midnight), [medication])
+            
+            # Nobody took it: two days later it has rolled to that night
+            later = datetime(2026, 1, 3, 12, 0)
+            self.assertEqual(due_medications(self.user_id, later), [])
+            self.assertEqual(medication.next_due_at,
+                             compute_next_due_at(reminder_time, datetime(2026, 1, 4, 0, 0)))
+
+    def test_reminder_without_next_due_at(self):
+        """
+        Test that medications saved without next_due_at are still reminded
+        and can be backfilled
+        """
+        now = datetime(2026, 1, 1, 9, 0)
+        with app.app_context():
+            due = Medication(user_id=self.user_id, name='Aspirin', dosage='100mg', frequency='once',
+                             start_date=now, reminder_time=now.time())
+            later = Medication(user_id=self.user_id, name='Metformin', dosage='500mg', frequency='once',
+                               start_date=now, reminder_time=(now + timedelta(hours=3)).time())
+            db.session.add_all([due, later])
+            db.session.commit()
+            
+            self.assertEqual(due_medications(self.user_id, now), [due])
+            self.assertEqual(due.next_due_at, compute_next_due_at(due.reminder_time, now - REMINDER_WINDOW))
+            self.assertEqual(later.next_due_at, compute_next_due_at(later.reminder_time, now))
+            
+            later.next_due_at = None
+            db.session.commit()
+            self.assertEqual(backfill_next_due_at(now), 1)
+            self.assertEqual(later.next_due_at, compute_next_due_at(later.reminder_time, now))
+
+    def test_reminder_sms_sent_once_per_occurrence(self):
+        """
+        Test that repeated polls text a due dose only once
+        """
+        now = datetime.now()
+        reminder_time = now.replace(second=0, microsecond=0).time()
+        with app.app_context():
+            db.session.get(User, self.user_id).phone_number = '+15550000000'
+            db.session.add(Medication(
+                user_id=self.user_id, name='Aspirin', dosage='100mg', frequency='once',
+                start_date=now, reminder_time=reminder_time,
+                next_due_at=compute_next_due_at(reminder_time, now - REMINDER_WINDOW)
+            ))
+            db.session.commit()
+        
+        self.login()
+        queue = mock.Mock()
+        with mock.patch('app.sms_queue', queue):
+            for _ in range(3):
+                self.assertEqual(len(self.app.get('/reminders/due').get_json()['medications']), 1)
+        self.assertEqual(queue.enqueue.call_count, 1)
+        self.assertEqual(queue.start.call_count, 1)
+        
+        # Under gunicorn the web workers only enqueue
+        with mock.patch('app.sms_queue', queue), mock.patch.dict(os.environ, {'SMS_DELIVERY_PROCESS': '1'}):
+            self.assertTrue(send_sms_notification('+15550000000', 'Time to take Aspirin'))
+        self.assertEqual((queue.enqueue.call_count, queue.start.call_count), (2, 1))
+        
+        with app.app_context():
+            medication = Medication.query.filter_by(user_id=self.user_id).first()
+            self.assertFalse(claim_notification(medication.id, medication.next_due_at, 'sms'))
+            self.assertTrue(claim_notification(medication.id, medication.next_due_at, 'push'))
+            
+            later = medication.next_due_at + timedelta(days=1)
+            self.assertEqual(
+                claim_notifications([(medication.id, medication.next_due_at), (medication.id, later)], 'sms'),
+                {(medication.id, later)}
+            )
+            self.assertEqual(claim_notifications([(medication.id, later)], 'sms'), set())
+
+    def test_device_token_registration(self):
+        """
+        Test registering and unregistering a device token
+        """
+        self.login()
+        self.assertTrue(self.app.post('/device_token', json={'token': 'abc'}).get_json()['success'])
+        self.assertTrue(self.app.post('/device_token', json={'token': 'abc'}).get_json()['success'])
+        with app.app_context():
+            self.assertEqual([t.token for t in DeviceToken.query.filter_by(user_id=self.user_id)], ['abc'])
+        
+        self.assertTrue(self.app.delete('/device_token', json={'token': 'abc'}).get_json()['success'])
+        self.assertEqual(self.app.delete('/device_token', json={'token': 'abc'}).status_code, 404)
+
+    def test_upload_queues_ocr_job(self):
+        """
+        Test that an upload returns before OCR and exposes its status
+        """
+        self.login()
+        jobs = mock.Mock()
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch('app.ocr_jobs', jobs), \
+                mock.patch.dict(app.config, {'UPLOAD_FOLDER': directory}):
+            response = self.app.post('/upload_prescription', data={
+                'prescriptionImage': (io.BytesIO(b'image bytes'), 'scan.png'),
+                'doctorName': 'Dr. Smith',
+                'prescriptionDate': '2026-01-01'
+            })
+        prescription = response.get_json()['prescription']
+        self.assertEqual(prescription['ocr_status'], 'pending')
+        self.assertEqual(jobs.submit.call_args[0][0], prescription['id'])
+        
+        status = self.app.get(f"/prescription/{prescription['id']}/ocr").get_json()
+        self.assertEqual(status['status'], 'pending')
+        
+        store_ocr_result(prescription['id'], {
+            'success': True,
+            'text': 'Amoxicillin 500mg',
+            'extracted_data': {'medications': ['amoxicillin']}
+        })
+        status = self.app.get(f"/prescription/{prescription['id']}/ocr").get_json()
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['extracted_data'], {'medications': ['amoxicillin']})
+
+    def test_stale_ocr_jobs_are_requeued(self):
+        """
+        Test that prescriptions left pending by a restart are resubmitted
+        once, and failed when their file is gone
+        """
+        now = datetime.utcnow()
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.dict(app.config, {'UPLOAD_FOLDER': directory}), app.app_context():
+            open(os.path.join(directory, 'scan.png'), 'wb').close()
+            stale = Prescription(user_id=self.user_id, image_path='scan.png', ocr_status='pending',
+                                 ocr_queued_at=now - timedelta(hours=1))
+            missing = Prescription(user_id=self.user_id, image_path='gone.png', ocr_status='pending')
+            fresh = Prescription(user_id=self.user_id, image_path='scan.png', ocr_status='pending',
+                                 ocr_queued_at=now)
+            db.session.add_all([stale, missing, fresh])
+            db.session.commit()
+            
+            jobs = mock.Mock()
+            with mock.patch('app.ocr_jobs', jobs):
+                self.assertEqual(requeue_stale_ocr_jobs(now), 1)
+                # Another worker starting up finds nothing left to claim
+                self.assertEqual(requeue_stale_ocr_jobs(now), 0)
+            jobs.submit.assert_called_once_with(stale.id, os.path.join(directory, 'scan.png'))
+            db.session.expire_all()
+            self.assertEqual([p.ocr_status for p in (stale, missing, fresh)], ['pending', 'failed', 'pending'])
+
+    def test_reminder_stream(self):
+        """
+        Test that a due medication is pushed on the reminder stream
+        """
+        now = datetime.now()
+        reminder_time = now.replace(second=0, microsecond=0).time()
+        with app.app_context():
+            db.session.add(Medication(
+                user_id=self.user_id, name='Aspirin', dosage='100mg', frequency='once',
+                start_date=now, reminder_time=reminder_time,
+                next_due_at=compute_next_due_at(reminder_time, now - REMINDER_WINDOW)
+            ))
+            db.session.commit()
+        
+        self.login()
+        response = self.app.get('/reminders/stream', buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        self.assertTrue(next(chunks).decode().startswith('retry:'))
+        event = next(chunks).decode()
+        response.close()
+        self.assertTrue(event.startswith('event: reminder'))
+        self.assertIn('Aspirin', event)
+
+    def test_reminder_sync(self):
+        """
+        Test bulk loading and incremental sync from the Medication table
+        """
+        now = datetime.now()
+        with app.app_context():
+            medications = [
+                Medication(user_id=self.user_id, name=name, dosage='10mg', frequency='once',
+                           start_date=now, reminder_time=now.time().replace(hour=hour, minute=0))
+                for name, hour in [('Aspirin', 8), ('Metformin', 9), ('Ibuprofen', 10)]
+            ]
+            db.session.add_all(medications)
+            db.session.add(Medication(user_id=self.user_id, name='No reminder', start_date=now))
+            db.session.commit()
+            kept_id, changed_id, deleted_id = [medication.id for medication in medications]
+            
+            reminder_system = ReminderSystem(firebase_handler=StubFirebaseHandler())
+            sync = ReminderSync(reminder_system)
+            self.assertEqual(sync.load_all(), 3)
+            
+            medications[1].reminder_time = now.time().replace(hour=21, minute=30)
+            db.session.delete(medications[2])
+            db.session.add(MedicationTombstone(medication_id=deleted_id))
+            db.session.commit()
+            sync.sync()
+            
+            reminders = reminder_system.get_reminders(self.user_id)
+            self.assertEqual(set(reminders), {kept_id, changed_id})
+            self.assertEqual(reminders[changed_id]['reminder_time'], '21:30')
+            
+            # Tombstones every sync has passed are purged once old enough
+            db.session.add(MedicationTombstone(medication_id=deleted_id, deleted_at=datetime.utcnow()))
+            MedicationTombstone.query.filter_by(id=sync.tombstone_watermark).update(
+                {'deleted_at': datetime.utcnow() - ReminderSync.TOMBSTONE_RETENTION - timedelta(minutes=1)})
+            db.session.commit()
+            sync.sync()
+            self.assertEqual(MedicationTombstone.query.count(), 1)
+
+    def test_scheduler_claims_push_in_ledger(self):
+        """
+        Test that the reminder_sync wiring claims each push occurrence once
+        across scheduler processes
+        """
+        with app.app_context():
+            medication = Medication(user_id=self.user_id, name='Aspirin', dosage='81mg',
+                                    frequency='once', start_date=datetime.now())
+            db.session.add(medication)
+            db.session.add(DeviceToken(user_id=self.user_id, token='phone-token'))
+            db.session.commit()
+            medication_id = medication.id
+        
+        handlers = []
+        for _ in range(2):
+            handler = StubFirebaseHandler()
+            registry = DeviceTokenRegistry(load_tokens, prune_tokens)
+            reminder_system = ReminderSystem(firebase_handler=handler, claim=claim_push,
+                                             token_registry=registry)
+            reminder_system.add_reminder(self.user_id, medication_id, 'Aspirin', '81mg', 'once', '08:00')
+            fire_at = reminder_system.scheduler.next_fire_time()
+            reminder_system._fire(reminder_system.scheduler.pop_due(fire_at))
+            handlers.append(handler)
+        
+        self.assertEqual(handlers[0].sent[0][0], ['phone-token'])
+        self.assertEqual(handlers[1].sent, [])
+        with app.app_context():
+            self.assertEqual(NotificationLedger.query.filter_by(channel='push').count(), 1)
+
+    def test_batch_reports(self):
+        """
+        Test rendering reports for several users in worker processes
+        """
+        import zipfile
+        
+        with app.app_context():
+            other = User(email='other@example.com', password_hash='x', name='Other User')
+            db.session.add(other)
+            db.session.add(Medication(user_id=self.user_id, name='Aspirin', dosage='81mg',
+                                      frequency='Daily', start_date=datetime(2024, 1, 1),
+                                      last_taken=datetime(2024, 1, 2, 8, 0)))
+            db.session.add(Prescription(user_id=self.user_id, doctor_name='Dr. Smith',
+                                        date_prescribed=datetime(2024, 1, 1), ocr_status='done',
+                                        ocr_data='{"medications": ["aspirin"]}'))
+            db.session.commit()
+            user_ids = [self.user_id, other.id, 9999]
+        
+        with tempfile.TemporaryDirectory() as directory:
+            progress = []
+            results = list(generate_reports(user_ids, directory, datetime(2024, 1, 1), datetime(2024, 2, 1),
+                                            workers=2, progress=lambda done, total, result: progress.append(done)))
+            
+            by_user = {result['user_id']: result for result in results}
+            self.assertEqual(progress, [1, 2, 3])
+            self.assertFalse(by_user[9999]['success'])
+            self.assertEqual(len(by_user[self.user_id]['paths']), 2)
+            self.assertNotEqual(set(by_user[self.user_id]['paths']), set(by_user[user_ids[1]]['paths']))
+            
+            # A second run into the same directory keeps the first run's files
+            [rerun] = generate_reports([self.user_id], directory, datetime(2024, 1, 1), datetime(2024, 2, 1),
+                                       workers=1)
+            self.assertTrue(set(rerun['paths']).isdisjoint(by_user[self.user_id]['paths']))
+            self.assertTrue(all(os.path.exists(path) for path in by_user[self.user_id]['paths']))
+            
+            archive = ReportArchive(os.path.join(directory, 'reports.zip'), directory)
+            for path in by_user[self.user_id]['paths']:
+                archive.add(path)
+            archive.close()
+            run = os.path.relpath(os.path.dirname(os.path.dirname(by_user[self.user_id]['paths'][0])), directory)
+            with zipfile.ZipFile(os.path.join(directory, 'reports.zip')) as zipped:
+                self.assertEqual(sorted(zipped.namelist()),
+                                 [f'{run}/user_{self.user_id}/medication_report.pdf',
+                                  f'{run}/user_{self.user_id}/prescription_report.pdf'])
+
+    def test_dose_history_ignores_other_users_medications(self):
+        """
+        Test that a deleted medication's id is not reused and its doses are
+        never named after another user's medication
+        """
+        with app.app_context():
+            medication = Medication(user_id=self.user_id, name='Aspirin', start_date=datetime(2024, 1, 1))
+            db.session.add(medication)
+            db.session.commit()
+            deleted_id = medication.id
+            db.session.add(DoseEvent(user_id=self.user_id, medication_id=deleted_id,
+                                     taken_at=datetime(2024, 1, 1, 8, 0)))
+            db.session.delete(medication)
+            other = User(email='other@example.com', password_hash='x', name='Other User')
+            db.session.add(other)
+            db.session.commit()
+            
+            db.session.add(Medication(user_id=other.id, name='Private', start_date=datetime(2024, 1, 1)))
+            db.session.commit()
+            self.assertEqual(Medication.query.filter_by(id=deleted_id).count(), 0)
+            
+            db.session.add(Medication(id=deleted_id, user_id=other.id, name='Private',
+                                      start_date=datetime(2024, 1, 1)))
+            db.session.commit()
+            self.assertEqual([row.name for row in dose_history(self.user_id)], [None])
+
+    def test_dose_history(self):
+        """
+        Test that every dose taken is logged and read back by date range
+        """
+        from datetime import time as dt_time
+        
+        with app.app_context():
+            medication = Medication(user_id=self.user_id, name='Aspirin', dosage='81mg', frequency='Daily',
+                                    start_date=datetime(2024, 1, 1), reminder_time=dt_time(8, 0))
+            db.session.add(medication)
+            db.session.commit()
+            medication_id = medication.id
+            for day in range(1, 11):
+                db.session.add(DoseEvent(user_id=self.user_id, medication_id=medication_id,
+                                         taken_at=datetime(2024, 1, day, 8, 30),
+                                         scheduled_for=datetime(2024, 1, day, 8, 0)))
+            db.session.commit()
+        self.login()
+        
+        # Marking a dose taken appends to the log instead of replacing it
+        self.assertTrue(self.app.post(f'/medication/{medication_id}/taken').json['success'])
+        self.assertTrue(self.app.post(f'/medication/{medication_id}/taken').json['success'])
+        with app.app_context():
+            events = DoseEvent.query.filter(DoseEvent.taken_at > datetime(2024, 2, 1)).all()
+            self.assertEqual(len(events), 2)
+            self.assertTrue(abs(events[0].scheduled_for - events[0].taken_at) <= timedelta(hours=12))
+        
+        response = self.app.get('/doses?start=2024-01-03&end=2024-01-05')
+        self.assertEqual([dose['taken_at'] for dose in response.json['doses']],
+                         ['2024-01-03T08:30:00', '2024-01-04T08:30:00', '2024-01-05T08:30:00'])
+        self.assertEqual(response.json['doses'][0]['medication'], 'Aspirin')
+        self.assertEqual(self.app.get('/doses?start=January').status_code, 400)
+        
+        with app.app_context():
+            query = dose_history(self.user_id, datetime(2024, 1, 3), datetime(2024, 1, 6))
+            statement = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+            plan = ' '.join(row[-1] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {statement}')))
+            self.assertIn('ix_dose_event_user_taken_at', plan)
+            
+            user_data, medications, prescriptions = load_report_data(
+                self.user_id, datetime(2024, 1, 1), datetime(2024, 1, 2, 23, 59))
+            # The history is streamed, and the latest dose fingerprints it
+            self.assertNotIsInstance(user_data['medication_history'], list)
+            self.assertEqual(user_data['last_dose_id'], events[-1].id)
+            self.assertEqual([(entry['date'], entry['action']) for entry in user_data['medication_history']],
+                             [(datetime(2024, 1, 1), 'Started'),
+                              (datetime(2024, 1, 1, 8, 30), 'Taken'),
+                              (datetime(2024, 1, 2, 8, 30), 'Taken')])
+
+    def test_adherence(self):
+        """
+        Test the adherence endpoint and report section over logged doses
+        """
+        from datetime import time as dt_time
+        
+        with app.app_context():
+            medication = Medication(user_id=self.user_id, name='Aspirin', dosage='81mg', frequency='Daily',
+                                    start_date=datetime(2024, 1, 1), reminder_time=dt_time(8, 0))
+            db.session.add(medication)
+            db.session.commit()
+            for day in (1, 2, 4, 5):
+                db.session.add(DoseEvent(user_id=self.user_id, medication_id=medication.id,
+                                         taken_at=datetime(2024, 1, day, 8, 20),
+                                         scheduled_for=datetime(2024, 1, day, 8, 0)))
+            db.session.commit()
+        self.login()
+        
+        response = self.app.get('/adherence?start=2024-01-01&end=2024-01-05')
+        summary = response.json['summary']
+        self.assertEqual((summary['scheduled'], summary['taken'], summary['rate']), (5, 4, 0.8))
+        self.assertEqual(summary['lateness']['up_to_1h_late'], 4)
+        self.assertNotIn('users', summary)
+        [row] = response.json['medications']
+        self.assertEqual((row['name'], row['longest_streak'], row['current_streak']), ('Aspirin', 2, 2))
+        
+        with app.app_context(), tempfile.TemporaryDirectory() as directory:
+            user_data, medications, prescriptions = load_report_data(
+                self.user_id, datetime(2024, 1, 1), datetime(2024, 1, 6))
+            self.assertEqual(user_data['adherence'][0]['taken'], 4)
+            path = ReportGenerator(directory).generate_medication_report(
+                user_data, medications, datetime(2024, 1, 1), datetime(2024, 1, 6))
+            self.assertTrue(os.path.getsize(path) > 0)
+
+    def test_history_export(self):
+        """
+        Test streaming the medication history as CSV and JSON lines
+        """
+        with app.app_context():
+            db.session.add(Medication(user_id=self.user_id, name='Aspirin', dosage='81mg',
+                                      frequency='Daily', start_date=datetime(2024, 1, 1),
+                                      last_taken=datetime(2024, 1, 2, 8, 0)))
+            db.session.add(Medication(user_id=self.user_id + 1, name='Other', dosage='1mg'))
+            db.session.commit()
+        self.login()
+        
+        response = self.app.get('/export/medications?format=csv')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/csv')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(lines[0], 'id,name,dosage,frequency,start_date,end_date,reminder_time,last_taken')
+        self.assertEqual(lines[1:], ['1,Aspirin,81mg,Daily,2024-01-01T00:00:00,,,2024-01-02T08:00:00'])
+        
+        response = self.app.get('/export/medications?format=jsonl')
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([(record['name'], record['end_date']) for record in records], [('Aspirin', None)])
+        
+        self.assertEqual(self.app.get('/export/medications?format=xml').status_code, 400)
+        self.assertEqual(self.app.get('/export/users').status_code, 404)
+
+
+class StubFirebaseHandler:
+    def __init__(self, failing_tokens=()):
+        self.sent = []
+        self.failing_tokens = set(failing_tokens)
+
+    def send_multicast_notification(self, tokens, title, body, data=None):
+        self.sent.append((tokens, title, body))
+        return SimpleNamespace(responses=[
+            SimpleNamespace(success=token not in self.failing_tokens,
+                            exception=messaging.UnregisteredError('Token is not registered')
+                            if token in self.failing_tokens else None)
+            for token in tokens
+        ])
+
+
+class TestReminderSystem(unittest.TestCase):
+    def test_scheduler_pops_due_batch_in_order(self):
+        """
+        Test that co-due keys are popped together, earliest first
+        """
+        scheduler = ReminderScheduler(clock=lambda: 0)
+        scheduler.schedule('b', 20)
+        scheduler.schedule('a', 10)
+        scheduler.schedule('c', 30)
+        scheduler.schedule('c', 15)
+        scheduler.cancel('b')
+        
+        self.assertEqual(scheduler.next_fire_time(), 10)
+        self.assertEqual(scheduler.pop_due(20), [('a', 10), ('c', 15)])
+        self.assertEqual(len(scheduler), 0)
+        self.assertIsNone(scheduler.next_fire_time())
+
+    def test_fire_notifies_and_reschedules(self):
+        """
+        Test that firing a reminder notifies the user's devices, prunes
+        invalid tokens and schedules the next day
+        """
+        handler = StubFirebaseHandler(failing_tokens={'stale-token'})
+        stored_tokens = {'user1': ['phone-token', 'stale-token']}
+        pruned = []
+        
+        def prune(tokens):
+            pruned.extend(tokens)
+        
+        registry = DeviceTokenRegistry(
+            lambda user_ids: {user_id: stored_tokens.get(user_id, []) for user_id in user_ids},
+            prune
+        )
+        reminder_system = ReminderSystem(firebase_handler=handler, token_registry=registry)
+        reminder_system.add_reminder('user1', 'med1', 'Aspirin', '100mg', 'once', '08:00')
+        fire_at = reminder_system.scheduler.next_fire_time()
+        
+        reminder_system._fire(reminder_system.scheduler.pop_due(fire_at))
+        
+        self.assertEqual(len(handler.sent), 1)
+        self.assertEqual(handler.sent[0][0], ['phone-token', 'stale-token'])
+        self.assertIn('Aspirin', handler.sent[0][2])
+        self.assertEqual(pruned, ['stale-token'])
+        self.assertEqual(registry.tokens_for_users(['user1']), {'user1': ['phone-token']})
+        self.assertIsNotNone(reminder_system.reminders['med1']['last_notified'])
+        self.assertIn('med1', reminder_system.scheduler)
+
+    def test_fire_claims_batch_once(self):
+        """
+        Test that co-due reminders are claimed in one call and only the
+        claimed ones are notified
+        """
+        handler = StubFirebaseHandler()
+        registry = DeviceTokenRegistry(lambda user_ids: {user_id: [f'token-{user_id}'] for user_id in user_ids})
+        calls = []
+        
+        def claim(occurrences):
+            calls.append(occurrences)
+            return {occurrence for occurrence in occurrences if occurrence[0] == 'med1'}
+        
+        reminder_system = ReminderSystem(firebase_handler=handler, claim=claim, token_registry=registry)
+        reminder_system.add_reminder('user1', 'med1', 'Aspirin', '100mg', 'once', '08:00')
+        reminder_system.add_reminder('user2', 'med2', 'Metformin', '500mg', 'once', '08:00')
+        fire_at = reminder_system.scheduler.next_fire_time()
+        
+        reminder_system._fire(reminder_system.scheduler.pop_due(fire_at))
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(medication_id for medication_id, _ in calls[0]), ['med1', 'med2'])
+        self.assertEqual(calls[0][0][1], datetime.utcfromtimestamp(fire_at))
+        self.assertEqual([message[0] for message in handler.sent], [['token-user1']])
+        self.assertIsNone(reminder_system.reminders['med2']['last_notified'])
+        self.assertIn('med2', reminder_system.scheduler)
+
+    def test_device_token_registry_ttl_and_lru(self):
+        """
+        Test that the registry loads misses in bulk, expires entries and
+        evicts the least recently used user
+        """
+        now = [0]
+        loads = []
+        
+        def loader(user_ids):
+            loads.append(sorted(user_ids))
+            return {user_id: [f'token-{user_id}'] for user_id in user_ids}
+        
+        registry = DeviceTokenRegistry(loader, ttl=60, max_users=2, clock=lambda: now[0])
+        registry.tokens_for_users([1, 2])
+        registry.tokens_for_users([1, 2])
+        self.assertEqual(loads, [[1, 2]])
+        
+        registry.tokens_for_users([3])
+        registry.tokens_for_users([1, 2])
+        self.assertEqual(loads[-1], [1])
+        
+        now[0] = 61
+        registry.tokens_for_users([2])
+        self.assertEqual(loads[-1], [2])
+
+    def test_user_and_minute_indexes(self):
+        """
+        Test that the per-user and per-minute indexes follow add/update/remove
+        """
+        reminder_system = ReminderSystem(firebase_handler=StubFirebaseHandler())
+        reminder_system.add_reminder('user1', 'med1', 'Aspirin', '100mg', 'once', '00:00')
+        reminder_system.add_reminder('user1', 'med2', 'Metformin', '500mg', 'once', '23:59')
+        reminder_system.add_reminder('user2', 'med3', 'Ibuprofen', '200mg', 'once', '23:59')
+        
+        self.assertEqual(set(reminder_system.get_reminders('user1')), {'med1', 'med2'})
+        self.assertEqual(
+            {r['medication_id'] for r in reminder_system.get_reminders_at(23 * 60 + 59)},
+            {'med2', 'med3'}
+        )
+        
+        reminder_system.update_reminder('med2', user_id='user2', reminder_time='00:00')
+        self.assertEqual(set(reminder_system.get_reminders('user1')), {'med1'})
+        self.assertIsNone(reminder_system.get_next_reminder('user1'))
+        self.assertEqual(len(reminder_system.get_reminders_at(0)), 2)
+        
+        reminder_system.remove_reminder('med1')
+        self.assertEqual(reminder_system.get_reminders('user1'), {})
+        self.assertNotIn('user1', reminder_system.user_index)
+
+
+class TestNotificationDispatcher(unittest.TestCase):
+    def test_coalesces_identical_payloads(self):
+        """
+        Test that identical payloads share multicast chunks and that
+        per-token failures are reported
+        """
+        handler = StubFirebaseHandler(failing_tokens={'token3'})
+        dispatcher = NotificationDispatcher(handler, max_workers=2, chunk_size=2)
+        result = dispatcher.dispatch(
+            [(f'token{i}', 'Medication Reminder', 'Time to take Aspirin', None) for i in range(5)] +
+            [('token0', 'Medication Reminder', 'Time to take Aspirin', None),
+             ('token9', 'Medication Reminder', 'Time to take Metformin', None)]
+        )
+        dispatcher.shutdown()
+        
+        self.assertEqual(sorted(len(tokens) for tokens, _, _ in handler.sent), [1, 1, 2, 2])
+        self.assertEqual(result.success_count, 5)
+        self.assertEqual([token for token, _ in result.failures], ['token3'])
+
+    def test_only_token_errors_prune(self):
+        """
+        Test that a malformed message does not count as an invalid token
+        """
+        from firebase_admin import exceptions
+        
+        self.assertTrue(is_invalid_token_error(messaging.UnregisteredError('Token is not registered')))
+        self.assertTrue(is_invalid_token_error(exceptions.InvalidArgumentError(
+            'The registration token is not a valid FCM registration token')))
+        self.assertFalse(is_invalid_token_error(exceptions.InvalidArgumentError(
+            'Message payload is too large')))
+
+
+class TestOCRJobQueue(unittest.TestCase):
+    def test_reports_result_from_worker_process(self):
+        """
+        Test that a job runs in the pool and reports its result
+        """
+        results = {}
+        done = threading.Event()
+        
+        def on_complete(job_id, result):
+            results[job_id] = result
+            done.set()
+        
+        queue = OCRJobQueue(on_complete, max_workers=1)
+        with mock.patch.dict(os.environ, {'OCR_CACHE_PATH': ''}):
+            queue.submit(7, 'missing.png')
+            self.assertTrue(done.wait(30))
+        queue.shutdown()
+        
+        self.assertFalse(results[7]['success'])
+        self.assertIn('missing.png', results[7]['error'])
+
+    def test_pdf_pages_are_bounded_and_combined(self):
+        """
+        Test that PDF pages are OCRed with a bounded number in flight and
+        merged in page order
+        """
+        import ocr_jobs
+        
+        lock = threading.Lock()
+        in_flight = [0, 0]
+        digests = set()
+        
+        def ocr_page(pdf_path, page_number, digest=None):
+            digests.add(digest)
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.01 * (page_number % 3))
+            with lock:
+                in_flight[0] -= 1
+            return {'success': True, 'page': page_number, 'text': f'Page {page_number} aspirin'}
+        
+        with ThreadPoolExecutor(max_workers=8) as executor, \
+                mock.patch.object(ocr_jobs, 'pdf_page_count', return_value=12), \
+                mock.patch.object(ocr_jobs, '_run_ocr_pdf_page', ocr_page):
+            pages = list(iter_pdf_pages(executor, 'scan.pdf', max_in_flight=3, digest='abc'))
+        
+        self.assertLessEqual(in_flight[1], 3)
+        self.assertEqual(digests, {'abc'})
+        self.assertEqual(sorted(page['page'] for page in pages), list(range(1, 13)))
+        result = OCRProcessor().combine_pages(pages)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['pages'], 12)
+        self.assertTrue(result['text'].startswith('Page 1 aspirin\n\f\nPage 2 aspirin'))
+        self.assertEqual(result['extracted_data']['medications'], ['aspirin'])
+
+    def test_pdf_jobs_share_bounded_coordinators(self):
+        """
+        Test that PDF jobs wait for a coordinator thread and skip hashing
+        without a cache
+        """
+        import ocr_jobs
+        
+        lock = threading.Lock()
+        running = [0, 0]
+        results = {}
+        
+        def pages(executor, pdf_path, max_in_flight, digest=None):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return [{'success': True, 'text': pdf_path, 'digest': digest}]
+        
+        queue = OCRJobQueue(lambda job_id, result: results.update({job_id: result}), max_pdf_jobs=1)
+        with ThreadPoolExecutor(max_workers=2) as executor, \
+                mock.patch.dict(os.environ, {'OCR_CACHE_PATH': ''}), \
+                mock.patch.object(queue, '_executor', return_value=executor), \
+                mock.patch.object(ocr_jobs, 'iter_pdf_pages', pages), \
+                mock.patch.object(ocr_jobs, '_combine_pages', lambda page_results: page_results[0]), \
+                mock.patch.object(ocr_jobs, 'file_digest') as digest:
+            futures = [queue.submit(job_id, f'scan{job_id}.pdf') for job_id in range(3)]
+            for future in futures:
+                future.result(timeout=10)
+            queue.shutdown()
+        
+        self.assertEqual(running[1], 1)
+        self.assertFalse(digest.called)
+        self.assertEqual(sorted(results), [0, 1, 2])
+        self.assertIsNone(results[2]['digest'])
+
+
+class TestOCRBatch(unittest.TestCase):
+    def test_resumes_from_output_file(self):
+        """
+        Test that a batch run skips recorded paths and repairs a cut-off line
+        """
+        from PIL import Image
+        
+        with tempfile.TemporaryDirectory() as directory:
+            scans = os.path.join(directory, 'scans')
+            os.makedirs(os.path.join(scans, 'partner'))
+            paths = [os.path.join(scans, 'a.png'), os.path.join(scans, 'partner', 'b.png'),
+                     os.path.join(scans, 'c.jpg')]
+            for path in paths:
+                Image.new('L', (20, 20), 255).save(path)
+            with open(os.path.join(scans, 'notes.txt'), 'w') as f:
+                f.write('not a prescription')
+            output = os.path.join(directory, 'results.jsonl')
+            with open(output, 'w') as f:
+                f.write(json.dumps({'path': paths[0], 'success': True, 'text': 'done before'}) + '\n')
+                f.write('{"path": "' + paths[1][:10])
+            
+            # Workers run as threads so the patches reach them under any
+            # multiprocessing start method
+            with mock.patch('pytesseract.image_to_string', return_value='Ibuprofen 200 mg'), \
+                    mock.patch('ocr_batch.ProcessPoolExecutor', ThreadPoolExecutor), \
+                    mock.patch('sys.stderr', io.StringIO()):
+                ocr_batch_main([scans, '--output', output, '--workers', '1',
+                                '--engine', 'pytesseract', '--no-preprocess'])
+            
+            with open(output) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(sorted(record['path'] for record in records), sorted(paths))
+            self.assertEqual(records[0]['text'], 'done before')
+            self.assertTrue(all(record['success'] for record in records))
+            self.assertEqual(records[1]['extracted_data']['medications'], ['ibuprofen'])
+
+
+class TestOCRCache(unittest.TestCase):
+    def test_repeated_image_is_served_from_cache(self):
+        """
+        Test that OCR runs once for identical image bytes
+        """
+        from PIL import Image
+        
+        with tempfile.TemporaryDirectory() as directory:
+            image_path = os.path.join(directory, 'prescription.png')
+            Image.new('L', (20, 20), 255).save(image_path)
+            cache = OCRCache(os.path.join(directory, 'ocr_cache.db'))
+            processor = OCRProcessor(cache=cache)
+            
+            with mock.patch('pytesseract.get_tesseract_version', return_value='5.3.0'), \
+                    mock.patch('pytesseract.image_to_string', return_value='Aspirin 100mg daily') as ocr:
+                first = processor.process_image(image_path)
+                second = processor.process_image(image_path)
+            
+            self.assertEqual(ocr.call_count, 1)
+            self.assertEqual(first, second)
+            self.assertEqual(second['extracted_data']['medications'], ['aspirin'])
+            stats = cache.stats()
+            self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_evicts_least_recently_used(self):
+        """
+        Test that the cache stays within its size limit
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = OCRCache(os.path.join(directory, 'ocr_cache.db'), max_bytes=100)
+            cache.put('a', {'text': 'x' * 30})
+            cache.put('b', {'text': 'y' * 30})
+            cache.get('a')
+            cache.put('c', {'text': 'z' * 30})
+            
+            self.assertIsNotNone(cache.get('a'))
+            self.assertIsNone(cache.get('b'))
+            self.assertIsNotNone(cache.get('c'))
+            self.assertEqual(cache.stats()['evictions'], 1)
+            self.assertLessEqual(cache.stats()['bytes'], 100)
+
+    def test_lookups_do_not_write(self):
+        """
+        Test that hits and misses are counted in memory until flushed
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = OCRCache(os.path.join(directory, 'ocr_cache.db'))
+            cache.put('a', {'text': 'x'})
+            connection = cache._connection()
+            changes = connection.total_changes
+            cache.get('a')
+            cache.get('b')
+            self.assertEqual(connection.total_changes, changes)
+            
+            stats = cache.stats()
+            self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+
+class FakeTessBaseAPI:
+    def __init__(self):
+        self.image = None
+
+    def SetImage(self, image):
+        self.image = image
+
+    def GetUTF8Text(self):
+        return 'Metformin 500mg twice daily'
+
+
+class TestOCREngine(unittest.TestCase):
+    def test_tesserocr_engine_is_reused(self):
+        """
+        Test that the tesserocr backend loads one engine for many images
+        """
+        import ocr_processor
+        from PIL import Image
+        
+        engines = []
+        
+        def load_engine():
+            engines.append(FakeTessBaseAPI())
+            return engines[-1]
+        
+        fake = SimpleNamespace(PyTessBaseAPI=load_engine, tesseract_version=lambda: '5.3.0')
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(ocr_processor, 'tesserocr', fake), \
+                mock.patch.object(ocr_processor, '_tesserocr_api', None), \
+                mock.patch('pytesseract.image_to_string') as subprocess_ocr:
+            image_path = os.path.join(directory, 'prescription.png')
+            Image.new('L', (20, 20), 255).save(image_path)
+            processor = OCRProcessor(engine='tesserocr')
+            results = [processor.process_image(image_path) for _ in range(3)]
+            
+            self.assertEqual(len(engines), 1)
+            self.assertFalse(subprocess_ocr.called)
+            self.assertEqual(results[2]['extracted_data']['medications'], ['metformin'])
+
+    def test_falls_back_without_tesserocr(self):
+        """
+        Test that pytesseract is used when tesserocr is not installed
+        """
+        import ocr_processor
+        
+        with mock.patch.object(ocr_processor, 'tesserocr', None):
+            with self.assertWarns(RuntimeWarning):
+                self.assertEqual(OCRProcessor(engine='tesserocr').engine, 'pytesseract')
+
+
+class TestPrescriptionExtractor(unittest.TestCase):
+    def test_extracts_fields(self):
+        """
+        Test whole-word, longest-first medication matching and field regexes
+        """
+        extractor = PrescriptionExtractor(['amoxicillin', 'amoxicillin clavulanate',
+                                           'insulin glargine', 'aspirin'])
+        text = (
+            "Dr. Jane Smith MD\n"
+            "Amoxicillin Clavulanate 875 mg twice daily\n"
+            "Insulin glargine 10 units nightly\n"
+            "aspirin 81mg, then amoxicillin\n"
+            "Aspirinate powder\n"
+            "Date: 13/04/2024\n"
+        )
+        
+        data = extractor.extract(text)
+        self.assertEqual(data['medications'], ['amoxicillin clavulanate', 'insulin glargine',
+                                               'aspirin', 'amoxicillin'])
+        self.assertEqual(data['doctor_name'], 'Dr. Jane Smith MD')
+        self.assertEqual(len(data['dosage']), 2)
+        self.assertEqual(len(data['frequency']), 2)
+        self.assertEqual(data['date'], '2024-04-13')
+
+    def test_matches_misread_names(self):
+        """
+        Test that OCR-noisy medication names are found through the fuzzy index
+        """
+        index = FuzzyIndex(['amoxicillin', 'metformin', 'metoprolol', 'aspirin'])
+        self.assertEqual(index.lookup('Amoxici11in'), (('amoxicillin', 1.0),))
+        self.assertEqual(index.lookup('metfromin')[0][0], 'metformin')
+        self.assertEqual(index.lookup('tablets'), ())
+        
+        extractor = PrescriptionExtractor(['amoxicillin', 'metformin', 'aspirin'])
+        data = extractor.extract("Metfrmin 500 mg daily\nAmoxici11in 250 mg\nAspirin 81 mg")
+        self.assertEqual(data['medications'], ['metformin', 'amoxicillin', 'aspirin'])
+
+    def test_fingerprint_covers_settings(self):
+        """
+        Test that the OCR cache fingerprint changes with the fuzzy settings
+        and the lexicon
+        """
+        fingerprint = PrescriptionExtractor(['aspirin']).fingerprint
+        self.assertEqual(PrescriptionExtractor(['aspirin']).fingerprint, fingerprint)
+        self.assertNotEqual(PrescriptionExtractor(['aspirin'], fuzzy_min_score=0.9).fingerprint, fingerprint)
+        self.assertNotEqual(PrescriptionExtractor(['aspirin'], fuzzy=False).fingerprint, fingerprint)
+        self.assertNotEqual(PrescriptionExtractor(['aspirin', 'metformin']).fingerprint, fingerprint)
+
+
+class TestImagePreprocessor(unittest.TestCase):
+    def test_prepares_phone_photo(self):
+        """
+        Test orientation, downscaling, binarization and cropping
+        """
+        from PIL import Image, ImageDraw
+        
+        photo = Image.new('RGB', (4000, 3000), (200, 190, 180))
+        ImageDraw.Draw(photo).rectangle((1000, 1000, 1400, 1100), fill=(20, 20, 20))
+        exif = photo.getexif()
+        exif[0x0112] = 6  # rotated 90 degrees
+        buffer = io.BytesIO()
+        photo.save(buffer, 'JPEG', exif=exif)
+        buffer.seek(0)
+        
+        image = ImagePreprocessor(target_dpi=200).process(Image.open(buffer))
+        self.assertEqual(image.mode, 'L')
+        self.assertEqual(image.size, (1650, 2200))
+        self.assertEqual(set(image.getdata()) - {0, 255}, set())
+        
+        buffer.seek(0)
+        cropped = ImagePreprocessor(target_dpi=200, crop=True, crop_margin=0).process(Image.open(buffer))
+        self.assertLess(cropped.width, 200)
+        self.assertLess(cropped.height, 400)
+
+
+class TestReportGenerator(unittest.TestCase):
+    def test_history_is_streamed_in_chunks(self):
+        """
+        Test that history entries are consumed lazily into bounded tables
+        """
+        start = datetime(2024, 1, 1)
+        consumed = []
+        
+        def history():
+            for index in range(1200):
+                consumed.append(index)
+                yield {'date': start + timedelta(hours=index), 'medication': 'Aspirin',
+                       'action': 'Taken', 'notes': ''}
+        
+        with tempfile.TemporaryDirectory() as directory:
+            generator = ReportGenerator(directory)
+            tables = generator._history_tables(history(), start, start + timedelta(days=30), chunk_rows=250)
+            first = next(tables)
+            self.assertEqual(len(consumed), 250)
+            self.assertEqual(first.repeatRows, 1)
+            # 30 days of hourly entries plus the end of the period itself
+            self.assertEqual([len(table._cellvalues) - 1 for table in tables], [250, 221])
+            
+            path = generator.generate_medication_report(
+                {'name': 'Test User'}, [], start, start + timedelta(days=60), history=history())
+            self.assertTrue(os.path.getsize(path) > 0)
+
+    def test_csv_export_is_lazy(self):
+        """
+        Test that exported rows are read only as chunks are consumed
+        """
+        consumed = []
+        
+        def rows():
+            for index in range(10000):
+                consumed.append(index)
+                yield (index, 'Aspirin, 81mg', datetime(2024, 1, 1))
+        
+        chunks = iter_csv(rows(), ['id', 'name', 'taken_at'], chunk_bytes=4096)
+        self.assertEqual(next(chunks), 'id,name,taken_at\r\n')
+        self.assertEqual(len(consumed), 0)
+        chunk = next(chunks)
+        self.assertTrue(chunk.startswith('0,"Aspirin, 81mg",2024-01-01T00:00:00\r\n'))
+        self.assertTrue(len(chunk) >= 4096)
+        self.assertTrue(len(consumed) < 200)
+        self.assertEqual(chunk.count('\n') + sum(rest.count('\n') for rest in chunks), 10000)
+
+
+class TestAdherenceAnalyzer(unittest.TestCase):
+    def test_matches_doses_to_schedule(self):
+        """
+        Test scheduling, duplicate and unknown events, lateness and streaks
+        """
+        analyzer = AdherenceAnalyzer([7, 3], [1, 2], [8 * 60, 20 * 60],
+                                     [datetime(2024, 1, 1), datetime(2024, 1, 5, 21)],
+                                     [None, datetime(2024, 1, 8)])
+        medication_ids, taken_at, scheduled_for = [], [], []
+        for day in (1, 2, 3, 5, 6, 7, 8, 9, 10):
+            medication_ids.append(7)
+            scheduled_for.append(datetime(2024, 1, day, 8))
+            taken_at.append(datetime(2024, 1, day, 8, day * 5))
+        # The second dose of an occurrence and doses of unknown medications
+        # or without an occurrence are ignored
+        medication_ids += [3, 3, 3, 99, 7]
+        scheduled_for += [datetime(2024, 1, 6, 20), datetime(2024, 1, 6, 20), datetime(2024, 1, 7, 20),
+                          datetime(2024, 1, 7, 20), None]
+        taken_at += [datetime(2024, 1, 6, 19), datetime(2024, 1, 6, 20, 5), datetime(2024, 1, 7, 21),
+                     datetime(2024, 1, 7, 21), datetime(2024, 1, 4, 12)]
+        
+        result = analyzer.analyze(medication_ids, taken_at, scheduled_for,
+                                  datetime(2024, 1, 1), datetime(2024, 1, 10, 12))
+        metformin, aspirin = result.by_medication()
+        self.assertEqual((aspirin['scheduled'], aspirin['taken'], aspirin['rate']), (10, 9, 0.9))
+        self.assertEqual((aspirin['median_lateness'], aspirin['p90_lateness']), (30, 50))
+        self.assertEqual((aspirin['longest_streak'], aspirin['current_streak']), (6, 6))
+        self.assertEqual((metformin['scheduled'], metformin['taken'], metformin['on_time_rate']), (2, 2, 0))
+        self.assertEqual([user['user_id'] for user in result.by_user()], [1, 2])
+        
+        cohort = result.cohort()
+        self.assertEqual((cohort['users'], cohort['scheduled'], cohort['taken']), (2, 12, 11))
+        self.assertEqual(cohort['lateness'], {'early': 1, 'on_time': 3, 'up_to_1h_late': 7,
+                                              'up_to_3h_late': 0, 'over_3h_late': 0})
+
+
+class TestReportCache(unittest.TestCase):
+    def test_reuses_and_invalidates_reports(self):
+        """
+        Test that identical inputs reuse the rendered file until invalidated
+        """
+        medications = [{'name': 'Aspirin', 'dosage': '81mg', 'frequency': 'Daily',
+                        'start_date': datetime(2024, 1, 1)}]
+        start, end = datetime(2024, 1, 1), datetime(2024, 2, 1)
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ReportCache(os.path.join(directory, 'cache'))
+            generator = ReportGenerator(directory, cache=cache)
+            user_data = {'id': 1, 'name': 'Test User', 'medication_history': []}
+            
+            first = generator.generate_medication_report(user_data, medications, start, end)
+            with mock.patch.object(generator, '_history_tables') as render:
+                second = generator.generate_medication_report(user_data, medications, start, end)
+            self.assertFalse(render.called)
+            self.assertNotEqual(second, first)
+            self.assertFalse(second.startswith(os.path.join(directory, 'cache')))
+            
+            changed = generator.generate_medication_report(user_data, medications, start, datetime(2024, 3, 1))
+            self.assertNotEqual(changed, second)
+            self.assertEqual(cache.stats()['entries'], 2)
+            
+            cache.invalidate(1)
+            self.assertEqual(cache.stats()['entries'], 0)
+            self.assertTrue(os.path.exists(second))
+            self.assertTrue(os.path.exists(first))
+
+    def test_prescription_report_ignores_doses(self):
+        """
+        Test that a prescription report stays cached when only dose data
+        changes
+        """
+        prescriptions = [{'doctor_name': 'Dr. Smith', 'date_prescribed': datetime(2024, 1, 1),
+                          'medication': 'Aspirin', 'status': 'done'}]
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ReportCache(os.path.join(directory, 'cache'))
+            generator = ReportGenerator(directory, cache=cache)
+            generator.generate_prescription_report({'id': 1, 'name': 'Test User', 'last_dose_id': 1},
+                                                   prescriptions)
+            generator.generate_prescription_report({'id': 1, 'name': 'Test User', 'last_dose_id': 2,
+                                                    'adherence': []}, prescriptions)
+            self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_evicts_least_recently_used(self):
+        """
+        Test that cached reports stay within the size limit
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ReportCache(os.path.join(directory, 'cache'), max_bytes=250)
+            source = os.path.join(directory, 'report.pdf')
+            with open(source, 'wb') as f:
+                f.write(b'x' * 100)
+            for fingerprint in ['a', 'b', 'c']:
+                cache.put(fingerprint, 1, source)
+                if fingerprint == 'b':
+                    cache.get('a')
+            
+            self.assertIsNotNone(cache.get('a'))
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(cache.stats(), {'entries': 2, 'bytes': 200})
+
+
+class FlakySMSTransport:
+    def __init__(self, failures):
+        self.failures = failures
+        self.delivered = []
+
+    def send(self, recipient, sender, body):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('Twilio unavailable')
+        self.delivered.append((recipient, sender, body))
+
+
+class TestSMSQueue(unittest.TestCase):
+    def test_retries_until_delivered(self):
+        """
+        Test that a failed send is retried with backoff and then delivered
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            transport = FlakySMSTransport(failures=2)
+            queue = SMSQueue(os.path.join(directory, 'sms.db'), transport,
+                             workers=2, rate=100, burst=10, base_delay=0.01)
+            queue.enqueue('+15550000000', 'Time to take Aspirin', sender='+15551111111')
+            queue.start()
+            deadline = time.time() + 5
+            while queue.stats().get('sent') != 1 and time.time() < deadline:
+                time.sleep(0.01)
+            queue.stop()
+            
+            self.assertEqual(transport.delivered, [('+15550000000', '+15551111111', 'Time to take Aspirin')])
+            self.assertEqual(queue.stats(), {'sent': 1})
+
+    def test_rate_limit_is_shared_between_queues(self):
+        """
+        Test that queues on the same database draw from one token bucket
+        per sender
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sms.db')
+            first = SMSQueue(path, FlakySMSTransport(failures=0), rate=10, burst=1)
+            second = SMSQueue(path, FlakySMSTransport(failures=0), rate=10, burst=1)
+            first._acquire('+15551111111')
+            started = time.monotonic()
+            second._acquire('+15551111111')
+            self.assertGreaterEqual(time.monotonic() - started, 0.05)
+            
+            started = time.monotonic()
+            second._acquire('+15552222222')
+            self.assertLess(time.monotonic() - started, 0.05)
+
+    def test_purge_deletes_old_sent_messages(self):
+        """
+        Test that sent messages are deleted after the retention period and
+        unsent ones are kept
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            queue = SMSQueue(os.path.join(directory, 'sms.db'), FlakySMSTransport(failures=0), retention=60)
+            sent = queue.enqueue('+15550000000', 'Time to take Aspirin')
+            queue.enqueue('+15550000000', 'Time to take Metformin')
+            queue._connection().execute(
+                "UPDATE sms_outbox SET status = 'sent', sent_at = ? WHERE id = ?", (time.time(), sent)
+            )
+            
+            self.assertEqual(queue.purge(), 0)
+            self.assertEqual(queue.purge(now=time.time() + 61), 1)
+            self.assertEqual(queue.stats(), {'pending': 1})
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file